@@ -0,0 +1,259 @@
+"""
+Scaling benchmarks of both partitioning pipelines on synthetic street
+networks, with the in-process graph engine (no ArcGIS needed).
+
+Every case builds a network, zones and facilities from a fixed seed, then
+runs the capacity pipeline (fishnet, cost matrix, greedy and flow
+assignment) and the distance pipeline (iterative boundary points with a
+service area solve, and the single-pass Voronoi, which must agree). Each
+case runs in a fresh process so that its peak memory is its own.
+
+    python benchmarks/run_benchmarks.py [--suite small|medium|full] [--output FILE]
+    python benchmarks/run_benchmarks.py --compare OLD.json NEW.json
+
+Results are saved as JSON, by default to benchmarks/results/<commit>.json.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+sys.path.insert(0, HERE)
+
+from network_partitioning.assignment import flow_assignment, greedy_assignment
+from network_partitioning.candidates import CandidateMatrix, CandidateExpander
+from network_partitioning.fishnet import Fishnet
+from network_partitioning.graph import Graph
+from network_partitioning.profiling import Profiler, peak_rss, profiler
+from network_partitioning.routing import GraphBackend, PointSet
+
+import synthetic
+
+# (fishnet cells, facilities) per suite; every pair runs on each network.
+SUITES = {
+    "small": [(1000, 10), (10000, 10), (10000, 100)],
+    "medium": [(1000, 10), (10000, 100), (100000, 100), (100000, 1000)],
+    "full": [(1000, 10), (10000, 100), (100000, 100), (100000, 1000),
+             (1000000, 100), (1000000, 1000)],
+}
+
+# The iterative distance method solves once per facility; above this many
+# facilities only the single-pass method runs, unless --iterative-limit is
+# raised.
+ITERATIVE_LIMIT = 100
+
+
+# Build the inputs of a case and run both pipelines on them.
+def run_case(case):
+    rng = np.random.default_rng(case["seed"])
+    cells, num_fac = case["cells"], case["facilities"]
+    side = max(int(math.sqrt(cells) / 2), 10)
+    result = {"case": case}
+
+    with Profiler(case_name(case)) as trace:
+        with profiler().stage("network") as stage:
+            graph = Graph.from_polylines(synthetic.NETWORKS[case["network"]](side, rng))
+            stage.rows = graph.num_edges
+        backend = GraphBackend(graph)
+        xmin, ymin = graph.node_xy.min(axis = 0)
+        xmax, ymax = graph.node_xy.max(axis = 0)
+        extent = (xmin, ymin, xmax, ymax)
+        fac_ids, fac_xy, fac_cap = synthetic.facilities(graph, num_fac, rng)
+        fac_points = PointSet(fac_ids, fac_xy)
+
+        # Capacity pipeline.
+        with profiler().stage("create_fishnet") as stage:
+            zones = synthetic.zones(extent, case["zones"], rng, case["burden"])
+            size = math.sqrt((xmax - xmin) * (ymax - ymin) / cells)
+            fishnet = Fishnet.from_geometry(zones, graph.node_xy[graph.edge_u],
+                                            graph.node_xy[graph.edge_v], extent, size)
+            stage.rows = len(fishnet)
+        cell_ids = np.arange(1, len(fishnet) + 1)
+        cell_points = PointSet(cell_ids, fishnet.centroids())
+        burden = fishnet.value
+        capacity = fac_cap * burden.sum() / fac_cap.sum()
+
+        with profiler().stage("dist_matrix") as stage:
+            inc, fac, cost = backend.closest_facilities(cell_points, fac_points,
+                                                        case["num_to_find"])
+            matrix = CandidateMatrix.from_triples(cell_ids, fac_ids, inc, fac, cost)
+            stage.rows = len(matrix.fac)
+
+        def solve(cell_list, k):
+            i, f, c = backend.closest_facilities(
+                cell_points.select(matrix.cell_ids[cell_list]), fac_points, k)
+            return matrix.cell_index(i), matrix.facility_index(f), c
+
+        with profiler().stage("greedy_assignment"):
+            greedy = greedy_assignment(matrix, burden, capacity,
+                                       CandidateExpander(matrix, solve))
+
+        with profiler().stage("flow_assignment"):
+            flow = flow_assignment(matrix, burden, capacity, CandidateExpander(matrix, solve))
+
+        # Distance pipeline.
+        iterative = None
+        if num_fac <= case["iterative_limit"]:
+            with profiler().stage("boundary_points") as stage:
+                ids = fac_ids.tolist()
+                barriers = []
+                for i, current_id in enumerate(ids[:-1]):
+                    barriers.extend(backend.boundary_points(
+                        fac_points.select([current_id]), fac_points.select(ids[i + 1:]),
+                        fac_points.select(ids[:i]) if i else None))
+                stage.rows = len(barriers)
+            with profiler().stage("service_area"):
+                iterative = backend.voronoi(fac_points, barriers = barriers)
+
+        with profiler().stage("voronoi") as stage:
+            voronoi = backend.voronoi(fac_points)
+            stage.rows = len(voronoi.boundary_edges())
+
+    result["graph"] = {"nodes": graph.num_nodes, "edges": graph.num_edges}
+    result["cells"] = len(fishnet)
+    result["stages"] = dict((s["name"], {"seconds": s["duration"], "rows": s["rows"]})
+                            for s in trace.to_dict()["stages"])
+    result["counters"] = trace.counters
+    result["peak_rss_bytes"] = peak_rss()
+    result["quality"] = {
+        "greedy": {"cost": greedy.cost, "max_overload": greedy.max_overload,
+                   "gap": greedy.gap(flow.lower_bound)},
+        "flow": {"cost": flow.cost, "max_overload": flow.max_overload,
+                 "gap": flow.gap(), "lower_bound": flow.lower_bound},
+    }
+    # Both distance methods must give the same partitions. Nodes at equal
+    # cost from two facilities go to the one solved first in ITERATIVE and
+    # may go to the other in VORONOI, so labels are only counted; the cost
+    # of every node and the length partitioned must agree.
+    if iterative is not None:
+        costs = np.where(np.isfinite(voronoi.dist), voronoi.dist, -1.0)
+        result["iterative_vs_voronoi"] = {
+            "label_differences": int((iterative.label != voronoi.label).sum()),
+            "costs_match": bool(np.allclose(
+                np.where(np.isfinite(iterative.dist), iterative.dist, -1.0), costs)),
+            "length_error": float(abs(partition_lengths(graph, iterative, num_fac).sum() -
+                                      partition_lengths(graph, voronoi, num_fac).sum())),
+        }
+    return result
+
+
+# Length of the network in each facility's partition of a Voronoi result.
+def partition_lengths(graph, voronoi, num):
+    edges, start, end, owner = voronoi.edge_pieces()
+    return np.bincount(owner, (end - start) * graph.edge_cost[edges], minlength = num)
+
+
+def case_name(case):
+    return "{network}-{cells}c-{facilities}f".format(**case)
+
+
+# Cases of a suite, each network with each size.
+def suite_cases(suite, seed, iterative_limit):
+    cases = []
+    for network in sorted(synthetic.NETWORKS):
+        for cells, num_fac in SUITES[suite]:
+            cases.append({"network": network, "cells": cells, "facilities": num_fac,
+                          "zones": max(int(math.sqrt(cells) / 10), 2),
+                          "burden": "lognormal", "num_to_find": 5, "seed": seed,
+                          "iterative_limit": iterative_limit})
+    return cases
+
+
+# Run a case in a child process and return its result.
+def run_isolated(case):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      "--case", json.dumps(case)])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = HERE,
+                                       stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Print a table of two result files side by side: time per stage and
+# quality of the assignments, for the cases both contain.
+def compare(old_path, new_path):
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    old_cases = dict((case_name(r["case"]), r) for r in old["results"])
+    print("{0:<28} {1:<18} {2:>10} {3:>10} {4:>7}".format(
+        "case", "stage", old["commit"], new["commit"], "ratio"))
+    for r in new["results"]:
+        name = case_name(r["case"])
+        if name not in old_cases: continue
+        o = old_cases[name]
+        for stage, timing in sorted(r["stages"].items()):
+            if stage not in o["stages"]: continue
+            before, after = o["stages"][stage]["seconds"], timing["seconds"]
+            print("{0:<28} {1:<18} {2:>10.3f} {3:>10.3f} {4:>7.2f}".format(
+                name, stage, before, after, after / before if before else float("nan")))
+        for method in ("greedy", "flow"):
+            q_old, q_new = o["quality"][method], r["quality"][method]
+            print("{0:<28} {1:<18} {2:>10.1f} {3:>10.1f}  overload {4:.1f} -> {5:.1f}".format(
+                name, method + " cost", q_old["cost"], q_new["cost"],
+                q_old["max_overload"], q_new["max_overload"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Network partitioning benchmarks.")
+    parser.add_argument("--suite", choices = sorted(SUITES), default = "small")
+    parser.add_argument("--network", choices = sorted(synthetic.NETWORKS),
+                        help = "only run cases on this network")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--iterative-limit", type = int, default = ITERATIVE_LIMIT)
+    parser.add_argument("--output", help = "result file (default: results/<commit>.json)")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"))
+    parser.add_argument("--case", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit = git_commit()
+    output = args.output or os.path.join(HERE, "results", commit + ".json")
+    results = []
+    for case in suite_cases(args.suite, args.seed, args.iterative_limit):
+        if args.network and case["network"] != args.network: continue
+        print(" ... " + case_name(case), flush = True)
+        result = run_isolated(case)
+        results.append(result)
+        print(" ...... {0:.2f} s, peak {1:.0f} MB, greedy overload {2:.1f}, flow overload {3:.1f}"
+              .format(sum(s["seconds"] for s in result["stages"].values()),
+                      (result["peak_rss_bytes"] or 0) / 2 ** 20,
+                      result["quality"]["greedy"]["max_overload"],
+                      result["quality"]["flow"]["max_overload"]), flush = True)
+        check = result.get("iterative_vs_voronoi")
+        if check and not (check["costs_match"] and check["length_error"] < 1e-6):
+            print(" ...... ITERATIVE and VORONOI partitions differ: costs match {0}, "
+                  "length error {1:g}".format(check["costs_match"], check["length_error"]),
+                  flush = True)
+
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, "w") as f:
+        json.dump({"commit": commit, "suite": args.suite,
+                   "date": datetime.datetime.now().isoformat(timespec = "seconds"),
+                   "python": platform.python_version(), "numpy": np.__version__,
+                   "platform": platform.platform(), "results": results}, f, indent = 2)
+    print(" ... results saved to " + output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Reproducible synthetic inputs for the benchmarks: street networks (grid,
+radial and random planar), rectangular zones with a burden distribution,
+and facilities with capacities. Coordinates are in metres.
+"""
+
+import math
+import numpy as np
+
+
+# Streets of a `side` x `side` lattice, one polyline per row and column.
+def grid_network(side, rng, spacing = 100.0):
+    coords = np.arange(side) * spacing
+    lines = [np.column_stack([coords, np.full(side, c)]) for c in coords]
+    lines += [np.column_stack([np.full(side, c), coords]) for c in coords]
+    return lines
+
+
+# Ring roads around a centre joined by spokes, with about `side` x `side`
+# intersections. Ring and spoke polylines share the same vertex arrays so
+# that they meet exactly.
+def radial_network(side, rng, spacing = 100.0):
+    num_rings = max(side // 2, 1)
+    num_spokes = max(2 * side, 3)
+    angle = np.arange(num_spokes) * 2 * math.pi / num_spokes
+    radius = (np.arange(num_rings) + 1) * spacing
+    extent = radius[-1]
+    x = extent + radius[:, None] * np.cos(angle)[None, :]
+    y = extent + radius[:, None] * np.sin(angle)[None, :]
+    centre = np.array([[extent, extent]])
+
+    lines = []
+    for r in range(num_rings):
+        ring = np.column_stack([x[r], y[r]])
+        lines.append(np.vstack([ring, ring[:1]]))
+    for s in range(num_spokes):
+        lines.append(np.vstack([centre, np.column_stack([x[:, s], y[:, s]])]))
+    return lines
+
+
+# A jittered lattice with some streets removed and random diagonals, one at
+# most per block so the graph stays planar. All east-west streets and the
+# westmost north-south street are kept, which keeps it connected.
+def random_network(side, rng, spacing = 100.0, keep = 0.7, diagonal = 0.3):
+    jitter = rng.uniform(-0.3, 0.3, (side, side, 2)) * spacing
+    jitter[0, :, :] = jitter[-1, :, :] = jitter[:, 0, :] = jitter[:, -1, :] = 0
+    grid = np.stack(np.meshgrid(np.arange(side), np.arange(side), indexing = "xy"),
+                    axis = -1) * spacing + jitter
+
+    lines = []
+    for r in range(side):
+        for c in range(side):
+            if c + 1 < side:
+                lines.append(grid[r, c:c + 2])
+            if r + 1 < side and (c == 0 or rng.random() < keep):
+                lines.append(grid[r:r + 2, c])
+            if r + 1 < side and c + 1 < side and rng.random() < diagonal:
+                if rng.random() < 0.5:
+                    lines.append(np.array([grid[r, c], grid[r + 1, c + 1]]))
+                else:
+                    lines.append(np.array([grid[r, c + 1], grid[r + 1, c]]))
+    return lines
+
+
+NETWORKS = {
+    "grid": grid_network,
+    "radial": radial_network,
+    "random": random_network,
+}
+
+
+# `num` x `num` rectangular zones over `extent` as (ID, ring edges, burden)
+# tuples for `Fishnet.from_geometry`. Burden is the same for every zone
+# ("uniform"), lognormal, or falls off from a random hotspot.
+def zones(extent, num, rng, distribution = "uniform"):
+    xmin, ymin, xmax, ymax = extent
+    xs = np.linspace(xmin, xmax, num + 1)
+    ys = np.linspace(ymin, ymax, num + 1)
+    centre_x, centre_y = np.meshgrid((xs[:-1] + xs[1:]) / 2, (ys[:-1] + ys[1:]) / 2,
+                                     indexing = "ij")
+
+    if distribution == "uniform":
+        burden = np.full(centre_x.shape, 1000.0)
+    elif distribution == "lognormal":
+        burden = rng.lognormal(6.0, 1.0, centre_x.shape)
+    elif distribution == "hotspot":
+        hx, hy = rng.uniform(xmin, xmax), rng.uniform(ymin, ymax)
+        sigma = max(xmax - xmin, ymax - ymin) / 4
+        d2 = (centre_x - hx) ** 2 + (centre_y - hy) ** 2
+        burden = 10.0 + 1000.0 * np.exp(-d2 / (2 * sigma ** 2))
+    else:
+        raise ValueError("Unknown burden distribution: " + str(distribution))
+
+    result = []
+    for i in range(num):
+        for j in range(num):
+            x1, x2, y1, y2 = xs[i], xs[i + 1], ys[j], ys[j + 1]
+            ring = np.array([(x1, y1), (x1, y2), (x2, y2), (x2, y1), (x1, y1)])
+            edges = (ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1])
+            result.append((i * num + j + 1, edges, float(burden[i, j])))
+    return result
+
+
+# `num` facilities at random network nodes, with IDs from 1 and capacities
+# between 1 and 3.
+def facilities(graph, num, rng):
+    nodes = rng.choice(graph.num_nodes, size = min(num, graph.num_nodes), replace = False)
+    ids = np.arange(1, len(nodes) + 1)
+    return ids, graph.node_xy[nodes], rng.uniform(1.0, 3.0, len(nodes))
@@ -0,0 +1,73 @@
+"""
+Network partitioning engines shared by the geoprocessing scripts, and the
+partitioning functions themselves for use from other Python code:
+
+    from network_partitioning import Session, cap_based_nt_partitioning
+
+    with Session(network, engine = "GRAPH", streets = streets) as session:
+        for job in jobs:
+            cap_based_nt_partitioning(..., session = session)
+
+Submodules are imported on first access of their names, so importing the
+package is cheap and arcpy is only loaded when a run needs it.
+"""
+
+import importlib
+import sys
+
+# Public name -> submodule defining it.
+_EXPORTS = {
+    "Assignment": "assignment",
+    "AssignmentResult": "assignment",
+    "flow_assignment": "assignment",
+    "greedy_assignment": "assignment",
+    "local_search": "assignment",
+    "MatrixCache": "cache",
+    "cap_based_nt_partitioning": "capacity",
+    "CandidateMatrix": "candidates",
+    "CandidateExpander": "candidates",
+    "Checkpoint": "checkpoint",
+    "dist_based_nt_partitioning": "distance",
+    "Fishnet": "fishnet",
+    "Graph": "graph",
+    "ContractionHierarchy": "hierarchy",
+    "build_index": "hierarchy",
+    "FacilityDiff": "incremental",
+    "RunState": "incremental",
+    "Profiler": "profiling",
+    "PointSet": "routing",
+    "RoutingBackend": "routing",
+    "NetworkAnalystBackend": "routing",
+    "GraphBackend": "routing",
+    "make_backend": "routing",
+    "NETWORK_ANALYST": "routing",
+    "GRAPH": "routing",
+    "Session": "session",
+    "SweepPlan": "sweep",
+    "capacity_sweep": "sweep",
+    "NetworkVoronoi": "voronoi",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def _load(name):
+    module = importlib.import_module("." + _EXPORTS[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _EXPORTS:
+            raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+        return _load(name)
+
+    def __dir__():
+        return sorted(set(globals()) | set(_EXPORTS))
+else:
+    # Module __getattr__ needs Python 3.7 (ArcGIS Pro 2.6); import eagerly
+    # before that.
+    for _name in _EXPORTS:
+        _load(_name)
@@ -0,0 +1,5 @@
+from .cli import main
+
+# Worker processes of parallel solves import this module again.
+if __name__ == "__main__":
+    main()
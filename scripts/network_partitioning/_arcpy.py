@@ -0,0 +1,33 @@
+"""
+Deferred access to arcpy, so that the routing and assignment engines can be
+imported and run on machines without ArcGIS Pro.
+"""
+
+_arcpy = None
+
+
+# Import arcpy on first use and keep the module around.
+def get_arcpy():
+    global _arcpy
+    if _arcpy is None:
+        import arcpy
+        _arcpy = arcpy
+    return _arcpy
+
+
+# True if arcpy can be imported in this interpreter.
+def has_arcpy():
+    try:
+        get_arcpy()
+    except ImportError:
+        return False
+    return True
+
+
+# Report progress through the geoprocessing messages when arcpy is around,
+# or on stdout otherwise.
+def add_message(message):
+    if has_arcpy():
+        _arcpy.AddMessage(message)
+    else:
+        print(message)
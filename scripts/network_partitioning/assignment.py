@@ -0,0 +1,677 @@
+"""
+Capacitated assignment of fishnet cells to facilities over a sparse
+`CandidateMatrix`.
+"""
+
+import heapq
+import time
+import numpy as np
+
+from .profiling import profiler
+
+INF = float("inf")
+
+# Loads within this relative margin of a capacity count as not overloaded.
+_EPS = 1e-9
+
+
+class AssignmentResult(object):
+    # Candidate row chosen for every cell (-1 if the cell has none), the
+    # resulting facility loads, total cost and, for the flow engine, the
+    # optimal cost of the relaxed problem as a lower bound on the optimum
+    # (None unless the flow was solved to optimality) and the `status` of
+    # the solve. `trajectory` lists the (seconds, cost, overload, cut)
+    # reached by each round of local search.
+    def __init__(self, row, facility, load, capacity, cost,
+                 lower_bound = None, iterations = 0, trajectory = None, status = None):
+        self.row = row
+        self.facility = facility
+        self.load = load
+        self.capacity = capacity
+        self.cost = cost
+        self.lower_bound = lower_bound
+        self.iterations = iterations
+        self.trajectory = trajectory or []
+        self.status = status
+
+    # Largest load above capacity.
+    @property
+    def max_overload(self):
+        if len(self.load) == 0: return 0.0
+        excess = self.load - self.capacity * (1 + _EPS)
+        return float(max(0.0, excess.max()))
+
+    # Relative distance of the cost from a lower bound on the optimum, or
+    # None without a bound. The bound only holds for assignments within
+    # capacity, so there is no gap for an overloaded result either.
+    def gap(self, lower_bound = None):
+        if lower_bound is None: lower_bound = self.lower_bound
+        if lower_bound is None or self.cost == 0 or self.max_overload > 0: return None
+        return max(self.cost - lower_bound, 0.0) / abs(self.cost)
+
+
+class Assignment(object):
+    # Current assignment during the greedy heuristic: the position (rank)
+    # of the chosen candidate in every cell's list and its facility index,
+    # and facility loads, all as integer-indexed arrays.
+    def __init__(self, matrix, burden, capacity):
+        self.matrix = matrix
+        self.burden = np.asarray(burden, dtype = np.float64)
+        self.capacity = np.asarray(capacity, dtype = np.float64)
+        self.rank = np.full(matrix.num_cells, -1, dtype = np.int64)
+        self.facility = np.full(matrix.num_cells, -1, dtype = np.int64)
+        self.load = np.zeros(matrix.num_facilities)
+
+    # Assign every cell with candidates to its nearest facility.
+    def assign_nearest(self):
+        has = self.matrix.counts > 0
+        self.rank[has] = 0
+        self.facility[has] = self.matrix.fac[self.matrix.offsets[:-1][has]]
+        self.load = _loads(self.facility, self.burden, self.matrix.num_facilities)
+
+    # Assign every cell to its candidate at position `rank` (-1 for none).
+    def assign_ranks(self, rank):
+        rank = np.asarray(rank, dtype = np.int64)
+        has = rank >= 0
+        self.rank = np.where(has, rank, -1)
+        self.facility[:] = -1
+        self.facility[has] = self.matrix.fac[self.matrix.offsets[:-1][has] + rank[has]]
+        self.load = _loads(self.facility, self.burden, self.matrix.num_facilities)
+
+    # Assign cell `c` to its candidate at position `rank`.
+    def assign_to(self, c, rank):
+        f = int(self.matrix.fac[self.matrix.offsets[c] + rank])
+        self.rank[c] = rank
+        self.facility[c] = f
+        self.load[f] += self.burden[c]
+        return f
+
+    # Dissociate cell `c` from its facility.
+    def remove_from(self, c):
+        f = int(self.facility[c])
+        self.load[f] -= self.burden[c]
+        self.facility[c] = -1
+        return f
+
+    # Cells assigned to facility `f`.
+    def members(self, f):
+        return np.nonzero(self.facility == f)[0]
+
+    # Facilities loaded above capacity.
+    def overloaded(self):
+        return set(np.nonzero(self.load > self.capacity)[0].tolist())
+
+    def result(self, **kwargs):
+        rows = np.where(self.rank >= 0, self.matrix.offsets[:-1] + self.rank, -1)
+        return _result(rows, self.matrix, self.burden, self.capacity, **kwargs)
+
+
+# Build a result from the chosen row of every cell.
+def _result(rows, matrix, burden, capacity, **kwargs):
+    has = rows >= 0
+    facility = np.where(has, matrix.fac[np.maximum(rows, 0)], -1).astype(np.int64)
+    return AssignmentResult(rows, facility, _loads(facility, burden, len(capacity)),
+                            capacity, float(matrix.cost[rows[has]].sum()), **kwargs)
+
+
+# For every cell, the row with the lowest `value` (-1 if no rows).
+def _argmin_rows(offsets, cells, value):
+    num_cells = len(offsets) - 1
+    rows = np.full(num_cells, -1, dtype = np.int64)
+    has = np.diff(offsets) > 0
+    if not has.any(): return rows
+    cell_min = np.full(num_cells, INF)
+    cell_min[has] = np.minimum.reduceat(value, offsets[:-1][has])
+    hit = np.nonzero(value <= cell_min[cells])[0]
+    first = np.ones(len(hit), dtype = bool)
+    first[1:] = cells[hit[1:]] != cells[hit[:-1]]
+    rows[cells[hit[first]]] = hit[first]
+    return rows
+
+
+# Facility loads for the chosen rows.
+def _loads(facility, burden, num_fac):
+    has = facility >= 0
+    return np.bincount(facility[has], weights = burden[has],
+                       minlength = num_fac).astype(np.float64)
+
+
+# Solve the capacitated transportation problem (cells -> facilities, cell
+# burden against facility capacity, minimizing total cost) exactly over the
+# candidate matrix, as a min-cost flow by successive shortest paths. Every
+# cell starts with its burden at its nearest facility; then flow is moved
+# from overloaded facilities to ones with room along the cheapest paths of
+# the residual graph, where an arc f -> g moves burden of a cell on f to its
+# candidate g at the difference of their costs per unit of burden. A cell
+# may end up split between facilities; each such cell goes to one of them
+# (one with room if possible) and the overload this leaves is repaired by
+# moving whole cells, with more candidates from `expand` where needed.
+# Optimal flow gives the cost of this relaxation as a lower bound on any
+# assignment within capacity.
+#
+# When overload is left that no path can take, the cells on the facilities
+# it reaches are passed to `expand(cells)`, which adds candidates to the
+# matrix and returns those that cannot get more, and the flow is solved
+# again. Without `expand`, or when no cell can get more, the overload stays,
+# as if taken by a dummy facility, and the result is marked infeasible. The
+# search stops after `max_seconds`, keeping the overload not yet moved.
+def flow_assignment(matrix, burden, capacity, expand = None, max_seconds = None):
+    deadline = None if max_seconds is None else time.time() + max_seconds
+    burden = np.asarray(burden, dtype = np.float64)
+    capacity = np.asarray(capacity, dtype = np.float64)
+    tried = set()
+    paths = 0
+    while True:
+        flow, status, reached, count = _min_cost_flow(matrix, burden, capacity, deadline)
+        paths += count
+        if status != "infeasible" or expand is None: break
+        # Cells on the facilities that the overload can reach, none of
+        # whose candidates has room.
+        cells = matrix.row_cells()
+        stuck = np.unique(cells[(flow > 0) & reached[matrix.fac]])
+        stuck = [c for c in stuck[matrix.counts[stuck] < matrix.num_facilities].tolist()
+                 if c not in tried]
+        if not stuck: break
+        tried.update(expand(stuck))
+
+    profiler().count("flow_paths", paths)
+    bound = None
+    if status == "optimal":
+        has = matrix.counts > 0
+        unit = _unit_costs(matrix, burden)
+        bound = float(flow @ unit + matrix.cost[matrix.offsets[:-1][has & (burden <= 0)]].sum())
+    rows = _round_flow(flow, matrix, burden, capacity)
+    while True:
+        rows, reached = _repair(rows, matrix, burden, capacity, deadline)
+        if reached is None or expand is None: break
+        # Rounding can leave overload in a region that the flow filled up;
+        # its cells get more candidates, keeping their positions.
+        has = rows >= 0
+        rank = np.where(has, rows - matrix.offsets[:-1], -1)
+        stuck = np.nonzero(has & reached[matrix.fac[np.maximum(rows, 0)]] &
+                           (matrix.counts < matrix.num_facilities))[0]
+        stuck = [c for c in stuck.tolist() if c not in tried]
+        if not stuck: break
+        tried.update(expand(stuck))
+        rows = np.where(has, matrix.offsets[:-1] + rank, -1)
+    return _result(rows, matrix, burden, capacity, lower_bound = bound,
+                   iterations = paths, status = status)
+
+
+# Cost of every row per unit of its cell's burden (0 for cells without).
+def _unit_costs(matrix, burden):
+    row_burden = burden[matrix.row_cells()]
+    positive = row_burden > 0
+    return np.where(positive, matrix.cost / np.where(positive, row_burden, 1.0), 0.0)
+
+
+# Min-cost flow of the burden of the cells of `matrix` (see
+# `flow_assignment`). Returns the flow on every row; the status: "optimal",
+# "infeasible" when overload is left that no path can take, or "time
+# limit"; the facilities reachable from the overload when infeasible; and
+# the number of paths applied.
+def _min_cost_flow(matrix, burden, capacity, deadline = None):
+    fac = matrix.fac.astype(np.int64)
+    num_fac = matrix.num_facilities
+    has = matrix.counts > 0
+    flow = np.zeros(len(fac))
+    flow[matrix.offsets[:-1][has]] = np.maximum(burden[has], 0)
+    load = np.bincount(fac, weights = flow, minlength = num_fac)
+    tol = _EPS * capacity + 1e-12 * float(flow.sum())
+    arcs = _ResidualArcs(matrix, _unit_costs(matrix, burden), flow)
+
+    paths = 0
+    while True:
+        over = load - capacity > tol
+        if not over.any(): return flow, "optimal", None, paths
+        if deadline is not None and time.time() > deadline:
+            return flow, "time limit", None, paths
+
+        # Bellman-Ford over facilities from all overloaded ones; lengths
+        # can be negative, but cycles are not, as the flow is optimal for
+        # the burden it has moved so far.
+        weight = arcs.weight
+        dist = np.where(over, 0.0, INF)
+        pred = np.full(num_fac, -1, dtype = np.int64)
+        for _ in range(num_fac):
+            through = dist[:, None] + weight
+            p = np.argmin(through, axis = 0)
+            best = through[p, np.arange(num_fac)]
+            better = best < dist - 1e-12 * (1 + np.abs(np.where(best < INF, best, 0)))
+            if not better.any(): break
+            dist[better] = best[better]
+            pred[better] = p[better]
+
+        room = capacity - load
+        target = ~over & (room > tol) & (dist < INF)
+        if not target.any(): return flow, "infeasible", dist < INF, paths
+        t = int(np.argmin(np.where(target, dist, INF)))
+
+        path = [t]
+        while pred[path[-1]] >= 0 and len(path) <= num_fac:
+            path.append(int(pred[path[-1]]))
+        path.reverse()
+        s = path[0]
+        moves = [arcs.pair(f, g) for f, g in zip(path[:-1], path[1:])]
+        amount = min(load[s] - capacity[s], room[t], min(flow[r] for r, _ in moves))
+        changed = []
+        for r, q in moves:
+            if flow[q] <= arcs.tiny: changed.append(q)
+            flow[r] -= amount
+            flow[q] += amount
+            if flow[r] <= arcs.tiny: changed.append(r)
+        arcs.update(changed)
+        load[s] -= amount
+        load[t] += amount
+        paths += 1
+
+
+class _ResidualArcs(object):
+    # Arcs f -> g of the residual graph of `flow` over the candidate rows:
+    # burden of a cell on row r (flow[r] > 0) moved to its row s, of length
+    # unit[s] - unit[r]. `weight[f, g]` is the shortest arc. The pairs of
+    # the rows carrying flow at first are sorted once by facility pair and
+    # length; pairs of rows that carry flow later are kept in heaps. Pairs
+    # whose row no longer carries flow are dropped as they come up.
+    def __init__(self, matrix, unit, flow):
+        self.offsets = matrix.offsets
+        self.fac = matrix.fac.astype(np.int64)
+        self.cells = matrix.row_cells()
+        self.unit = unit
+        self.flow = flow
+        self.tiny = 1e-12 * max(float(flow.sum()), 1.0)
+        self.num_fac = num_fac = matrix.num_facilities
+
+        r = np.nonzero(flow > self.tiny)[0]
+        n = matrix.counts[self.cells[r]]
+        src = np.repeat(r, n)
+        dst = (np.repeat(self.offsets[self.cells[r]] - np.cumsum(n) + n, n) +
+               np.arange(int(n.sum())))
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+        key = self.fac[src] * num_fac + self.fac[dst]
+        length = unit[dst] - unit[src]
+        order = np.lexsort((length, key))
+        self.src, self.dst, self.length = src[order], dst[order], length[order]
+        keys = np.arange(num_fac * num_fac)
+        self.head = np.searchsorted(key[order], keys)
+        self.end = np.searchsorted(key[order], keys, side = "right")
+        self.extra = {}
+        self.weight = np.full((num_fac, num_fac), INF)
+        listed = self.head < self.end
+        self.weight.flat[keys[listed]] = self.length[self.head[listed]]
+
+    # Rows (r, s) of the shortest arc f -> g.
+    def pair(self, f, g):
+        k = f * self.num_fac + g
+        i = self.head[k]
+        best = None
+        if i < self.end[k]:
+            best = (self.length[i], int(self.src[i]), int(self.dst[i]))
+        heap = self.extra.get(k)
+        if heap and (best is None or heap[0][0] < best[0]):
+            best = heap[0]
+        return best[1], best[2]
+
+    # Drop the pairs of facility pair `k` whose row no longer carries flow
+    # from the front, and set its weight.
+    def _refresh(self, k):
+        i, end = self.head[k], self.end[k]
+        while i < end and self.flow[self.src[i]] <= self.tiny:
+            i += 1
+        self.head[k] = i
+        w = self.length[i] if i < end else INF
+        heap = self.extra.get(k)
+        while heap and self.flow[heap[0][1]] <= self.tiny:
+            heapq.heappop(heap)
+        if heap: w = min(w, heap[0][0])
+        self.weight.flat[k] = w
+
+    # Update the arcs of `rows` that started or stopped carrying flow.
+    def update(self, rows):
+        for r in rows:
+            c = self.cells[r]
+            f = self.fac[r]
+            started = self.flow[r] > self.tiny
+            for q in range(self.offsets[c], self.offsets[c + 1]):
+                if q == r: continue
+                k = f * self.num_fac + self.fac[q]
+                if started:
+                    heapq.heappush(self.extra.setdefault(k, []),
+                                   (self.unit[q] - self.unit[r], int(r), int(q)))
+                self._refresh(k)
+
+
+# Row of every cell for a flow: the row carrying most of its burden. Cells
+# split between facilities, largest first, go to the cheapest of their
+# facilities with room for them instead, if any.
+def _round_flow(flow, matrix, burden, capacity):
+    cells = matrix.row_cells()
+    rows = _argmin_rows(matrix.offsets, cells, -flow)
+    carrying = np.bincount(cells[flow > 1e-12 * max(float(flow.sum()), 1.0)],
+                           minlength = matrix.num_cells)
+    split = np.nonzero(carrying > 1)[0]
+    whole = np.ones(matrix.num_cells, dtype = bool)
+    whole[split] = False
+    facility = np.where(whole & (rows >= 0), matrix.fac[np.maximum(rows, 0)], -1)
+    load = _loads(facility, burden, len(capacity))
+    limit = capacity * (1 + _EPS)
+    for c in split[np.argsort(-burden[split], kind = "stable")].tolist():
+        rs = np.arange(matrix.offsets[c], matrix.offsets[c + 1])
+        rs = rs[flow[rs] > 0]
+        fits = rs[load[matrix.fac[rs]] + burden[c] <= limit[matrix.fac[rs]]]
+        if len(fits): rows[c] = fits[0]
+        load[matrix.fac[rows[c]]] += burden[c]
+    return rows
+
+
+# Remove the overload left by rounding with augmenting paths of whole
+# cells between facilities: an arc f -> g stands for moving the cheapest
+# cell of f to its candidate g, with the increase in cost as length. The
+# shortest path from an overloaded facility to one with room for the last
+# cell is applied as a chain of moves, until no overload is left, no path
+# is found, 50 paths in a row do not reduce it, or the `deadline`. Returns
+# the rows and, if no path was found, the facilities the overload reaches.
+def _repair(rows, matrix, burden, capacity, deadline = None):
+    cells, fac, cost = matrix.row_cells(), matrix.fac.astype(np.int64), matrix.cost
+    rows = rows.copy()
+    num_fac = len(capacity)
+    facility = np.where(rows >= 0, fac[np.maximum(rows, 0)], -1)
+    load = _loads(facility, burden, num_fac)
+    limit = capacity * (1 + _EPS)
+    row_burden = burden[cells]
+    least_excess, stall = INF, 0
+
+    while True:
+        over = load > limit
+        if not over.any(): break
+        if deadline is not None and time.time() > deadline: break
+        excess = float(np.maximum(load - limit, 0).sum())
+        if excess < least_excess:
+            least_excess, stall = excess, 0
+        else:
+            stall += 1
+            if stall > 50: break
+
+        src = facility[cells]
+        valid = (src >= 0) & (fac != src)
+        delta = np.where(valid, np.maximum(cost - cost[np.maximum(rows, 0)][cells], 0.0), INF)
+        weight = np.full((num_fac, num_fac), INF)
+        np.minimum.at(weight, (np.maximum(src, 0)[valid], fac[valid]), delta[valid])
+
+        # Dijkstra over facilities from all overloaded ones.
+        dist = np.where(over, 0.0, INF)
+        pred = np.full(num_fac, -1, dtype = np.int64)
+        done = np.zeros(num_fac, dtype = bool)
+        for _ in range(num_fac):
+            open_dist = np.where(done, INF, dist)
+            p = int(np.argmin(open_dist))
+            if open_dist[p] == INF: break
+            done[p] = True
+            through = dist[p] + weight[p]
+            better = through < dist
+            dist[better] = through[better]
+            pred[better] = p
+
+        # Cheapest last move of a cell into a facility with room for it.
+        fits = valid & ~over[fac] & (load[fac] + row_burden <= limit[fac])
+        total = np.where(fits, dist[np.maximum(src, 0)] + delta, INF)
+        last = int(np.argmin(total))
+        if total[last] == INF: return rows, dist < INF
+
+        path = [int(src[last])]
+        while not over[path[-1]] and pred[path[-1]] >= 0 and len(path) <= num_fac:
+            path.append(int(pred[path[-1]]))
+        path.reverse()
+
+        moves = []
+        for f, g in zip(path[:-1], path[1:]):
+            pair = np.nonzero((src == f) & (fac == g) & (delta == weight[f, g]))[0]
+            moves.append(int(pair[0]))
+        moves.append(last)
+        for r in moves:
+            c = int(cells[r])
+            load[facility[c]] -= burden[c]
+            load[fac[r]] += burden[c]
+            facility[c] = fac[r]
+            rows[c] = r
+    return rows, None
+
+
+# The tool's original heuristic: assign every cell to its nearest facility,
+# then repeatedly take an overloaded facility and move the cells with the
+# smallest increase in cost to their next candidate, if that facility is not
+# overloaded. When cells of the facility have no next candidate, the
+# exhausted cells of all overloaded facilities are passed to `expand(cells)`
+# at once, which adds candidates to the matrix and returns the cells that
+# cannot get more; without it, such cells stay where they are. Starting
+# from the candidate positions `initial` instead, e.g. a previous result,
+# only the overload left in it is moved.
+def greedy_assignment(matrix, burden, capacity, expand = None, initial = None):
+    state = Assignment(matrix, burden, capacity)
+    capacity = state.capacity
+    num_fac = matrix.num_facilities
+
+    if initial is None:
+        state.assign_nearest()
+    else:
+        state.assign_ranks(initial)
+    load = state.load
+    overloaded = state.overloaded()
+    count = 0
+    tried = set()
+    iterations, moved = 0, 0
+
+    # Move points from overloaded facilities to underloaded facilities.
+    while overloaded and count < num_fac:
+        prev_len = len(overloaded)
+        f = overloaded.pop()
+        iterations += 1
+        members = state.members(f)
+
+        # If no facility in point's list, find rest nearest facilities for
+        # this and every other overloaded facility in one batch.
+        if expand is not None:
+            counts = matrix.counts
+            if any(c not in tried for c in
+                   members[state.rank[members] + 1 >= counts[members]].tolist()):
+                group = np.fromiter(overloaded | {f}, dtype = np.int64)
+                exhausted = np.nonzero(np.isin(state.facility, group) &
+                                       (state.rank + 1 >= counts))[0]
+                exhausted = [c for c in exhausted.tolist() if c not in tried]
+                tried.update(expand(exhausted))
+
+        # Difference of cost from each cell to this facility and to its next
+        # candidate; cells with smaller difference move first.
+        members = members[state.rank[members] + 1 < matrix.counts[members]]
+        current = matrix.offsets[members] + state.rank[members]
+        diff = matrix.cost[current + 1] - matrix.cost[current]
+        for c in members[np.argsort(diff, kind = "stable")].tolist():
+            if load[f] <= capacity[f]: break
+            g = int(matrix.fac[matrix.offsets[c] + state.rank[c] + 1])
+            if load[g] > capacity[g]: continue
+            state.remove_from(c)
+            state.assign_to(c, state.rank[c] + 1)
+            moved += 1
+            if load[g] > capacity[g]: overloaded.add(g)
+
+        # If this facility is still overloaded, add it back.
+        if load[f] > capacity[f]: overloaded.add(f)
+
+        # Avoid infinite loop.
+        if len(overloaded) == prev_len:
+            count += 1
+        else: count = 0
+
+    profiler().count("greedy_iterations", iterations)
+    profiler().count("cells_moved", moved)
+    return state.result()
+
+
+# Improve an assignment by local search over the cells on partition
+# boundaries, in the spirit of Kernighan-Lin. The objective is total cost,
+# plus `cut_weight` times the mean assigned cost for every pair of adjacent
+# cells (`neighbours`, index arrays as from `Fishnet.neighbours`) in
+# different partitions, with overload above all: a move never adds overload
+# unless it removes more. Every round proposes, for each boundary cell, its
+# best move to another candidate facility, and for moves blocked by the
+# target's capacity, chains that move a cell of the target on to a third
+# facility (or back, as a swap). Proposals are applied best first if they
+# still improve the objective. Only improving moves are made, so the
+# assignment at any time is the best found; the search stops after
+# `max_seconds`, `max_rounds` or a round without improvement. Without
+# `neighbours`, all cells are searched and there is no cut term.
+def local_search(matrix, burden, capacity, result, neighbours = None, max_seconds = None,
+                 max_rounds = 100, cut_weight = 0.1, chain_width = 4):
+    start = time.time()
+    deadline = None if max_seconds is None else start + max_seconds
+    offsets, fac, cost = matrix.offsets, matrix.fac.astype(np.int64), matrix.cost
+    burden = np.asarray(burden, dtype = np.float64)
+    capacity = np.asarray(capacity, dtype = np.float64)
+    num_cells, num_fac = matrix.num_cells, matrix.num_facilities
+    cells = matrix.row_cells()
+    rows = result.row.copy()
+    facility = result.facility.copy()
+    load = _loads(facility, burden, num_fac)
+    limit = capacity * (1 + _EPS)
+
+    # Symmetric adjacency of cells.
+    if neighbours is None:
+        adj_ptr, adj = np.zeros(num_cells + 1, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    else:
+        i, j = (np.asarray(a, dtype = np.int64) for a in neighbours)
+        pairs = np.unique(np.concatenate([i * num_cells + j, j * num_cells + i]))
+        adj = pairs % num_cells
+        adj_ptr = np.searchsorted(pairs // num_cells, np.arange(num_cells + 1))
+    assigned = rows >= 0
+    cut_unit = cut_weight * float(cost[rows[assigned]].mean()) if assigned.any() else 0.0
+    # Proposals are ranked with overload outweighing cost and cut; moves
+    # are made by overload first, then cost and cut, in `improves`.
+    spread = float(cost.max() - cost.min()) if len(cost) else 0.0
+    positive = burden[burden > 0]
+    penalty = 2 * (spread + 4 * cut_unit + 1.0) / (positive.min() if len(positive) else 1.0)
+
+    def excess(f, change):
+        return max(load[f] + change - limit[f], 0.0) - max(load[f] - limit[f], 0.0)
+
+    def alike(c, g):
+        return int(np.count_nonzero(facility[adj[adj_ptr[c]:adj_ptr[c + 1]]] == g))
+
+    # Change of (overload, cost and cut) if cell `c` moves to candidate row
+    # `r`, or None if it is there already.
+    def delta(c, r):
+        f, g = int(facility[c]), int(fac[r])
+        if f == g: return None
+        b = burden[c]
+        return (excess(g, b) + excess(f, -b),
+                cost[r] - cost[rows[c]] + cut_unit * (alike(c, f) - alike(c, g)))
+
+    # Whether a change improves the objective: less overload, or as much
+    # and a lower cost and cut.
+    def improves(change):
+        return change[0] < -1e-12 or (change[0] <= 1e-12 and change[1] < -1e-12)
+
+    def move(c, r):
+        f, g = int(facility[c]), int(fac[r])
+        load[f] -= burden[c]
+        load[g] += burden[c]
+        facility[c], rows[c] = g, r
+
+    def state():
+        a = rows >= 0
+        cut = int(np.count_nonzero(facility[np.repeat(np.arange(num_cells), np.diff(adj_ptr))]
+                                   != facility[adj])) // 2
+        return (round(time.time() - start, 3), float(cost[rows[a]].sum()),
+                float(np.maximum(load - limit, 0).sum()), cut)
+
+    trajectory = [state()]
+    rounds, moved = 0, 0
+    while rounds < max_rounds and (deadline is None or time.time() < deadline):
+        rounds += 1
+        # Boundary cells (all cells without adjacency), and their rows to
+        # other facilities.
+        src = np.repeat(np.arange(num_cells), np.diff(adj_ptr))
+        if len(adj):
+            active = np.zeros(num_cells, dtype = bool)
+            active[src[facility[src] != facility[adj]]] = True
+        else:
+            active = facility >= 0
+        r = np.nonzero(active[cells] & (facility[cells] >= 0) & (fac != facility[cells]))[0]
+        if not len(r): break
+        c = cells[r]
+        f, g = facility[c], fac[r]
+
+        # Neighbours of each cell by facility, as sorted (cell, facility) keys.
+        keys, counts = np.unique(src * num_fac + facility[adj], return_counts = True)
+        def count(cc, ff):
+            if not len(keys): return np.zeros(len(cc))
+            k = cc * num_fac + ff
+            at = np.minimum(np.searchsorted(keys, k), len(keys) - 1)
+            return np.where(keys[at] == k, counts[at], 0)
+        gain = cost[r] - cost[rows[c]] + cut_unit * (count(c, f) - count(c, g))
+        over = lambda ff, change: (np.maximum(load[ff] + change - limit[ff], 0) -
+                                   np.maximum(load[ff] - limit[ff], 0))
+        score = gain + penalty * (over(g, burden[c]) + over(f, -burden[c]))
+
+        # Best move of every cell, and moves blocked by capacity alone.
+        proposals = []
+        order = np.lexsort((score, c))
+        first = np.ones(len(order), dtype = bool)
+        first[1:] = c[order[1:]] != c[order[:-1]]
+        best = order[first]
+        best = best[score[best] < -1e-12]
+        for k in best[np.argsort(score[best], kind = "stable")].tolist():
+            proposals.append((float(score[k]), [(int(c[k]), int(r[k]))]))
+
+        blocked = np.nonzero((gain < -1e-12) & (score >= -1e-12))[0]
+        if len(blocked):
+            # Candidate follow-up moves out of each facility, best first.
+            out = np.lexsort((gain, f))
+            out_start = np.searchsorted(f[out], np.arange(num_fac + 1))
+            pair = f[blocked] * num_fac + g[blocked]
+            order = np.lexsort((gain[blocked], pair))
+            first = np.ones(len(order), dtype = bool)
+            first[1:] = pair[order[1:]] != pair[order[:-1]]
+            for k in blocked[order[first]].tolist():
+                gg = int(g[k])
+                follow = out[out_start[gg]:out_start[gg + 1]][:chain_width]
+                proposals.append((float(gain[k]), [(int(c[k]), int(r[k]))] +
+                                  [(int(c[q]), int(r[q])) for q in follow.tolist()]))
+        proposals.sort(key = lambda p: p[0])
+
+        # Apply proposals that still improve the objective; a chain takes
+        # its first move and the first follow-up that makes it pay.
+        touched = set()
+        improved = 0
+        for _, chain in proposals:
+            if deadline is not None and time.time() > deadline: break
+            c1, r1 = chain[0]
+            if c1 in touched: continue
+            d1 = delta(c1, r1)
+            if d1 is None: continue
+            if improves(d1):
+                move(c1, r1)
+                touched.add(c1)
+                improved += 1
+                continue
+            if len(chain) == 1: continue
+            previous = rows[c1]
+            move(c1, r1)
+            for c2, r2 in chain[1:]:
+                if c2 in touched or c2 == c1 or facility[c2] != fac[r1]: continue
+                d2 = delta(c2, r2)
+                if d2 is not None and improves((d1[0] + d2[0], d1[1] + d2[1])):
+                    move(c2, r2)
+                    touched.update((c1, c2))
+                    improved += 2
+                    break
+            else:
+                move(c1, previous)
+        moved += improved
+        trajectory.append(state())
+        if not improved: break
+
+    profiler().count("local_search_rounds", rounds)
+    profiler().count("local_search_moves", moved)
+    return _result(rows, matrix, burden, capacity, lower_bound = result.lower_bound,
+                   iterations = rounds, trajectory = trajectory, status = result.status)
@@ -0,0 +1,119 @@
+"""
+On-disk cache of candidate matrices. Every matrix is stored under a key
+derived from the inputs of its solve, as one `.npy` file per array, and is
+loaded memory-mapped so that a rerun with the same inputs skips the solve.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from .candidates import CandidateMatrix
+
+_ARRAYS = ("cell_ids", "fac_ids", "offsets", "fac", "cost")
+
+
+class MatrixCache(object):
+    # Matrices in sub-folders of `directory`, named by key. Once the folder
+    # holds more than `max_bytes`, the least recently used entries are
+    # removed.
+    def __init__(self, directory = None, max_bytes = 2 ** 30):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "network_partitioning_cache")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # Key from the parts of a solve's input: strings, numbers, or hex
+    # digests of arrays.
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(repr(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    # The matrix stored under `key`, or None.
+    def load(self, key):
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path): return None
+        try:
+            arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode = "r")
+                      for name in _ARRAYS]
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark as recently used.
+        os.utime(path, None)
+        return CandidateMatrix(*arrays)
+
+    # Store `matrix` under `key`. The files are written to a scratch folder
+    # first, so that a half-written entry is never loaded.
+    def store(self, key, matrix):
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path): return
+        scratch = tempfile.mkdtemp(dir = self.directory, prefix = ".tmp")
+        for name in _ARRAYS:
+            np.save(os.path.join(scratch, name + ".npy"), np.ascontiguousarray(getattr(matrix, name)))
+        try:
+            os.rename(scratch, path)
+        except OSError:
+            # Stored by another run meanwhile.
+            shutil.rmtree(scratch, ignore_errors = True)
+        self._evict(keep = key)
+
+    # Remove least recently used entries until the cache fits `max_bytes`.
+    def _evict(self, keep = None):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path): continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes: break
+            if name == keep: continue
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors = True)
+            total -= size
+
+
+# Digest of arrays, for use in cache keys.
+def array_digest(*arrays):
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode("utf-8"))
+        digest.update(str(array.shape).encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Path and modification time of a dataset, so that edits to it change the
+# key. Datasets inside a file geodatabase are not files of their own; they
+# take the newest modification time of the geodatabase's files (other than
+# locks), so any edit to the geodatabase changes the key.
+def dataset_stamp(path):
+    path = str(path)
+    if os.path.isfile(path):
+        return (path, os.path.getmtime(path))
+    gdb = _geodatabase(path)
+    if gdb is None:
+        return (path, None)
+    times = [entry.stat().st_mtime for entry in os.scandir(gdb)
+             if entry.is_file() and not entry.name.lower().endswith(".lock")]
+    return (path, max(times) if times else None)
+
+
+# The file geodatabase folder that `path` is inside of, or None.
+def _geodatabase(path):
+    folder = os.path.dirname(os.path.abspath(path))
+    while folder and folder != os.path.dirname(folder):
+        if folder.lower().endswith(".gdb") and os.path.isdir(folder):
+            return folder
+        folder = os.path.dirname(folder)
+    return None
@@ -0,0 +1,156 @@
+"""
+Columnar k-nearest candidate matrix: for every fishnet cell, its closest
+facilities and the cost to them, stored as contiguous NumPy arrays instead
+of a dictionary of heaps.
+"""
+
+import numpy as np
+
+from .profiling import profiler
+
+
+class CandidateMatrix(object):
+    # Cells and facilities are referred to by index into `cell_ids` and
+    # `fac_ids` (their source IDs). The candidates of cell `c` are rows
+    # `offsets[c]:offsets[c + 1]` of `fac` and `cost`, in order of cost.
+    def __init__(self, cell_ids, fac_ids, offsets, fac, cost):
+        self.cell_ids = np.asarray(cell_ids, dtype = np.int64)
+        self.fac_ids = np.asarray(fac_ids, dtype = np.int64)
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.fac = np.asarray(fac, dtype = np.int32)
+        self.cost = np.asarray(cost, dtype = np.float64)
+        self._cell_sorter = None
+        self._fac_sorter = None
+
+    # Build the matrix from (cell ID, facility ID, cost) triples as returned
+    # by a routing backend.
+    @classmethod
+    def from_triples(cls, cell_ids, fac_ids, row_cell_ids, row_fac_ids, costs):
+        matrix = cls(cell_ids, fac_ids, np.zeros(len(cell_ids) + 1), [], [])
+        cells = matrix.cell_index(row_cell_ids)
+        facs = matrix.facility_index(row_fac_ids)
+        costs = np.asarray(costs, dtype = np.float64)
+        order = np.lexsort((costs, cells))
+        np.cumsum(np.bincount(cells, minlength = len(cell_ids)), out = matrix.offsets[1:])
+        matrix.fac = facs[order].astype(np.int32)
+        matrix.cost = costs[order]
+        return matrix
+
+    @property
+    def num_cells(self):
+        return len(self.cell_ids)
+
+    @property
+    def num_facilities(self):
+        return len(self.fac_ids)
+
+    # Number of candidates of every cell.
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    # Size of the arrays in bytes.
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.cell_ids, self.fac_ids, self.offsets,
+                                      self.fac, self.cost))
+
+    # Cell index of every row.
+    def row_cells(self):
+        return np.repeat(np.arange(self.num_cells), self.counts)
+
+    # The matrix with only the `k` closest candidates of every cell.
+    def first(self, k):
+        rank = np.arange(len(self.fac)) - np.repeat(self.offsets[:-1], self.counts)
+        keep = rank < k
+        offsets = np.zeros(self.num_cells + 1, dtype = np.int64)
+        np.cumsum(np.minimum(self.counts, k), out = offsets[1:])
+        return CandidateMatrix(self.cell_ids, self.fac_ids, offsets,
+                               self.fac[keep], self.cost[keep])
+
+    # Index of cells given their source IDs.
+    def cell_index(self, ids):
+        if self._cell_sorter is None:
+            self._cell_sorter = np.argsort(self.cell_ids, kind = "stable")
+        return _index_of(self.cell_ids, self._cell_sorter, ids)
+
+    # Index of facilities given their source IDs.
+    def facility_index(self, ids):
+        if self._fac_sorter is None:
+            self._fac_sorter = np.argsort(self.fac_ids, kind = "stable")
+        return _index_of(self.fac_ids, self._fac_sorter, ids)
+
+    # Add candidates (cell index, facility index, cost) after the existing
+    # candidates of their cells, so that positions within a cell's list stay
+    # valid. Facilities already listed for a cell are skipped.
+    def extend(self, cells, facs, costs):
+        cells = np.asarray(cells, dtype = np.int64)
+        facs = np.asarray(facs, dtype = np.int64)
+        costs = np.asarray(costs, dtype = np.float64)
+        num_fac = max(self.num_facilities, 1)
+
+        old_cells = self.row_cells()
+        known = np.isin(cells * num_fac + facs, old_cells * num_fac + self.fac)
+        cells, facs, costs = cells[~known], facs[~known], costs[~known]
+        if len(cells) == 0: return 0
+
+        all_cells = np.concatenate([old_cells, cells])
+        is_new = np.concatenate([np.zeros(len(old_cells), dtype = bool),
+                                 np.ones(len(cells), dtype = bool)])
+        all_costs = np.concatenate([self.cost, costs])
+        order = np.lexsort((all_costs, is_new, all_cells))
+        self.fac = np.concatenate([self.fac, facs.astype(np.int32)])[order]
+        self.cost = all_costs[order]
+        self.offsets = np.zeros(self.num_cells + 1, dtype = np.int64)
+        np.cumsum(np.bincount(all_cells, minlength = self.num_cells), out = self.offsets[1:])
+        return len(cells)
+
+
+class CandidateExpander(object):
+    # Grows the candidate lists of cells that ran out of candidates, in
+    # batches: all cells passed in one call are solved together, for the
+    # next k (`growth` times their longest list, up to all facilities).
+    # `solve(cells, k)` returns (cell index, facility index, cost) arrays of
+    # the k closest facilities of `cells`; `on_round(matrix)`, if given, is
+    # called after every round.
+    def __init__(self, matrix, solve, growth = 2, on_round = None):
+        self.matrix = matrix
+        self.solve = solve
+        self.growth = growth
+        self.on_round = on_round
+        self.rounds = 0
+        self.cells = 0
+
+    # Expand `cells`; returns those that cannot get more candidates.
+    def __call__(self, cells):
+        matrix = self.matrix
+        cells = np.asarray(cells, dtype = np.int64)
+        k = min(matrix.num_facilities,
+                self.growth * max(int(matrix.counts[cells].max()), 1))
+        before = matrix.counts[cells]
+        rows = self.solve(cells, k)
+        matrix.extend(*rows)
+        self.rounds += 1
+        self.cells += len(cells)
+        profiler().count("expansion_rounds")
+        profiler().count("expanded_cells", len(cells))
+        if self.on_round is not None: self.on_round(matrix)
+
+        after = matrix.counts[cells]
+        return cells[(after == before) | (after >= matrix.num_facilities)].tolist()
+
+    # Solves avoided compared to solving one cell at a time.
+    @property
+    def solves_saved(self):
+        return self.cells - self.rounds
+
+
+# Positions of `values` in `ids`, using `sorter` (argsort of `ids`).
+def _index_of(ids, sorter, values):
+    values = np.asarray(values, dtype = np.int64)
+    if len(values) == 0: return np.zeros(0, dtype = np.int64)
+    pos = np.searchsorted(ids, values, sorter = sorter)
+    index = sorter[np.minimum(pos, len(ids) - 1)]
+    if (ids[index] != values).any():
+        raise KeyError("Unknown IDs in candidate matrix.")
+    return index
@@ -0,0 +1,773 @@
+"""
+Capacity-based network partitioning: service areas sized by each
+facility's capacity and the zones' burden, as well as the proximity to
+facilities in the network.
+"""
+
+import os
+import numpy as np
+
+from ._arcpy import get_arcpy, add_message
+from .assignment import AssignmentResult, flow_assignment, greedy_assignment, local_search
+from .cache import MatrixCache, array_digest, dataset_stamp
+from .candidates import CandidateMatrix, CandidateExpander
+from .checkpoint import Checkpoint
+from .fishnet import Fishnet, read_zones, _CellFilter, _segments
+from .incremental import (FacilityDiff, RunState, patch_matrix, insert_threshold,
+                          initial_ranks, replace_rows)
+from .multilevel import coarsen, project
+from .profiling import profiler
+from .routing import PointSet, NETWORK_ANALYST
+from .session import Session
+from .table import read_columns, read_values, sum_column, write_columns, write_points, _positions
+from .tiles import TileSpill, halo_facilities, make_tiles, stitch, tile_fishnets
+
+# Name of the saved state of this tool, see `RunState`.
+TOOL = "cap_based_nt_partitioning"
+
+# Facility ID field of the output, named as by the dissolve of the fishnet
+# joined with its points that earlier versions made.
+FACILITY_FIELD = "fishnet_points_FacilityID"
+
+# Time budget of the `FLOW` assignment in seconds; when it runs out, the
+# overload not yet moved is left and reported.
+FLOW_SECONDS = 600
+
+
+# Distribute zones' burden to facilities.
+def distr_burden(points, burden_field, facilities, capacity_field):
+    total_burden = sum_column(points, burden_field)
+    total_capacity = sum_column(facilities, capacity_field)
+    ratio = total_burden / total_capacity
+
+    columns = read_columns(facilities, ['OID@', capacity_field])
+    write_columns(facilities, columns['OID@'], {'Burden': columns[capacity_field] * ratio})
+
+
+# Create fishnet cells from input zones: cells whose centre lies in a
+# zone and within 200 meters of a street, with the zone's burden shared
+# among them. Only the cell centres are written.
+def create_fishnet(polygon, polyline, output_points, size, valueField):
+    add_message("...creating fishnet from polygon.")
+    fishnet = Fishnet.from_zones(polygon, valueField, polyline, size)
+    add_message(" ...... {0} cells".format(len(fishnet)))
+    fishnet.write_points(output_points)
+    return fishnet
+
+
+# Calculate cost matrix from each fishnet cell to `num_to_find` closest facilities.
+# With a `cache`, a matrix solved before for the same network settings
+# (`key_parts`), facility and cell locations is loaded instead.
+def dist_matrix(facilities, backend, fishnet, num_to_find = 5, cache = None, key_parts = ()):
+    add_message("...generating distance matrix")
+
+    cells = PointSet.from_feature_class(fishnet, "FishnetID")
+
+    # Copy object ID to a new field for mapping locations back to them
+    write_columns(fishnet, cells.ids, {"FishnetID": cells.ids})
+    write_columns(facilities.source, facilities.ids, {"FacID": facilities.ids})
+    if cache is not None:
+        key = cache.key(*(tuple(key_parts) + (facilities.digest(), cells.digest(), num_to_find)))
+        matrix = cache.load(key)
+        if matrix is not None:
+            add_message(" ...... loaded distance matrix from cache")
+            return matrix, cells
+
+    cell_ids, fac_ids, costs = backend.closest_facilities(cells, facilities, num_to_find)
+
+    # Candidates of every cell, sorted by cost.
+    matrix = CandidateMatrix.from_triples(cells.ids, facilities.ids,
+                                          cell_ids, fac_ids, costs)
+    if cache is not None: cache.store(key, matrix)
+    return matrix, cells
+
+
+# Tiled `create_fishnet` and `dist_matrix` for region-scale zones: the
+# cells of each tile of `tile_size` are made, written to `output_points` and
+# solved against the facilities within `halo` of the tile (half a tile by
+# default) on their own, and spilled to `spill`. A solve never holds more
+# than one tile's cells and routes. Returns the stitched fishnet, candidate
+# matrix and cells; all cells end up in `output_points`.
+def tiled_dist_matrix(polygon, polyline, output_points, size, valueField, facilities,
+                      backend, spill, tile_size, halo = None, num_to_find = 5):
+    add_message("...creating fishnet and distance matrix by tiles")
+    zone_list, sr, extent, scale = read_zones(polygon, valueField)
+    starts, ends = _segments(polyline, sr)
+    origin, tiles = make_tiles(extent, size, tile_size)
+    if not halo: halo = tile_size / 2.0
+    write_columns(facilities.source, facilities.ids, {"FacID": facilities.ids})
+
+    next_id = 1
+    for tile, fishnet in tile_fishnets(tiles, origin, zone_list, starts, ends, size,
+                                       scale = scale, spatial_reference = sr):
+        if not len(fishnet): continue
+        ids = np.arange(next_id, next_id + len(fishnet), dtype = np.int64)
+        next_id += len(fishnet)
+        xy = fishnet.centroids()
+        write_points(output_points, xy, {"FishnetID": ids}, sr)
+        near = halo_facilities(facilities, tile.bounds(origin, size), halo, num_to_find)
+        matrix = CandidateMatrix.from_triples(ids, facilities.ids,
+            *backend.closest_facilities(PointSet(ids, xy, output_points, "FishnetID"),
+                                        near, num_to_find))
+        spill.save(tile, {"row": fishnet.row, "col": fishnet.col, "zone": fishnet.zone,
+                          "counts": matrix.counts, "fac": matrix.fac, "cost": matrix.cost})
+        profiler().record("tile_cells", tile.index, len(ids))
+        add_message(" ...... tile {0} of {1}: {2} cells, {3} facilities".format(
+            tile.index + 1, len(tiles), len(ids), len(near)))
+
+    # The global assignment balances capacity across tiles; cells whose
+    # tile's candidates run out are solved against all facilities. Cells
+    # split by refining are kept by the same test as `create_fishnet`'s.
+    accept = _CellFilter(dict((oid, edges) for oid, edges, _ in zone_list),
+                         starts, ends, 200, scale)
+    fishnet, matrix = stitch(spill, origin, size, zone_list, facilities.ids, sr, accept)
+    add_message(" ...... {0} cells in {1} tiles".format(len(fishnet), len(spill.tiles)))
+    fishnet.write_points(output_points)
+    cells = PointSet.from_feature_class(output_points, "FishnetID")
+    write_columns(output_points, cells.ids, {"FishnetID": cells.ids})
+    # Cells are known by their object IDs, as in `dist_matrix`, in the
+    # order they were written; these need not start at 1.
+    matrix = CandidateMatrix(cells.ids, matrix.fac_ids, matrix.offsets, matrix.fac,
+                             matrix.cost)
+    return fishnet, matrix, cells
+
+
+# Find the distance from these points to their `k` closest facilities,
+# in one solve.
+def find_rest(cell_list, k, matrix, cells, backend, facilities):
+    cell_ids, fac_ids, costs = backend.closest_facilities(
+        cells.select(matrix.cell_ids[cell_list]), facilities, k)
+    return matrix.cell_index(cell_ids), matrix.facility_index(fac_ids), costs
+
+
+# Assign fishnet cells to facilities with the goal of
+# assigning each facility appropriate burden and minimizing total cost.
+# `on_expand(matrix)` is called after every round of candidates solved.
+def assign_points(matrix, cells, facilities, backend, method = "GREEDY",
+                  on_expand = None, max_seconds = FLOW_SECONDS):
+    add_message("...assign points to facilities")
+
+    burden = read_values(cells.source, 'VALUE', matrix.cell_ids)
+    capacity = read_values(facilities.source, 'Burden', matrix.fac_ids)
+    result = assign(matrix, burden, capacity, cells, facilities, backend, method,
+                    on_expand = on_expand, max_seconds = max_seconds)
+
+    # Populate Current burden.
+    write_columns(facilities.source, matrix.fac_ids, {'Assigned_burden': result.load})
+
+    # Add assigned 'FacilityID' to fishnet feature layer.
+    write_columns(cells.source, matrix.cell_ids,
+                  {'FacilityID': facility_keys(assigned_ids(matrix, result))})
+
+    return result
+
+
+# Assign cells with `burden` to facilities with `capacity`, by `method`.
+# The greedy heuristic starts from the candidate positions `initial` if
+# given. The flow engine stops after `max_seconds`.
+def assign(matrix, burden, capacity, cells, facilities, backend, method = "GREEDY",
+           initial = None, on_expand = None, max_seconds = FLOW_SECONDS):
+    # Cells that run out of candidates are solved in batches for
+    # growing k instead of one by one for all facilities.
+    def solve(cell_list, k):
+        return find_rest(cell_list, k, matrix, cells, backend, facilities)
+    expand = CandidateExpander(matrix, solve, on_round = on_expand)
+
+    if method == "FLOW":
+        # Solve the assignment as a capacitated transportation problem
+        # and report how far it and the greedy heuristic are from the
+        # lower bound. The gap is only known for an assignment within
+        # capacity and a flow solved to optimality.
+        result = flow_assignment(matrix, burden, capacity, expand, max_seconds)
+        if result.status != "optimal":
+            add_message(" ...... flow: {0}, overload of {1:.2f} left".format(
+                "capacity too small for the burden" if result.status == "infeasible"
+                else "time limit of {0:.0f} s reached".format(max_seconds),
+                float(np.maximum(result.load - result.capacity, 0).sum())))
+        greedy = greedy_assignment(matrix, burden, capacity, initial = initial)
+        for name, res in (("greedy", greedy), ("flow", result)):
+            gap = res.gap(result.lower_bound)
+            add_message(" ...... {0}: total cost {1:.2f}, max overload {2:.2f}, "
+                        "gap {3}".format(name, res.cost, res.max_overload,
+                                         "n/a" if gap is None else "{0:.2%}".format(gap)))
+    else:
+        result = greedy_assignment(matrix, burden, capacity, expand, initial)
+    if expand.rounds:
+        add_message(" ...... expanded {0} cells in {1} rounds ({2} solves saved)"
+                    .format(expand.cells, expand.rounds, expand.solves_saved))
+    return result
+
+
+# Assign the cells of `fishnet`, written to `points_fc`, through up to
+# `levels` levels of super-cells (see `coarsen`), each holding at most an
+# eighth of a facility's average burden. The coarsest level is solved and
+# assigned by `method`. Each finer level keeps the facility of its
+# super-cell, except for the super-cells on partition boundaries: only
+# those are solved, for their own `num_to_find` closest facilities, and
+# start at the nearest one. The greedy heuristic then moves the overload
+# this leaves. Cells that are not solved keep the candidates of their
+# super-cell, whose costs are estimates of their own, and so is the cost
+# of the result. Returns the candidate matrix, cells and assignment of the
+# fishnet's cells, stored as `assign_points` does.
+def multilevel_assign(fishnet, facilities, backend, points_fc, levels, num_to_find = 5,
+                      method = "GREEDY"):
+    add_message("...assign points to facilities by levels of super-cells")
+    cells = PointSet.from_feature_class(points_fc, "FishnetID")
+    write_columns(points_fc, cells.ids, {"FishnetID": cells.ids})
+    write_columns(facilities.source, facilities.ids, {"FacID": facilities.ids})
+    capacity = read_values(facilities.source, 'Burden', facilities.ids)
+
+    hierarchy = coarsen(fishnet, levels, fishnet.value.sum() / (8.0 * len(facilities)),
+                        min_cells = 8 * len(facilities))
+    add_message(" ...... super-cells per level: " +
+                ", ".join(str(n) for n in hierarchy.sizes()))
+
+    # Cells of a level, located at their representatives.
+    def level_cells(level):
+        if level == 0: return cells
+        ids = np.arange(1, len(hierarchy.rep[level]) + 1)
+        return PointSet(ids, cells.xy[hierarchy.rep[level]], points_fc, "FishnetID",
+                        subset = True)
+
+    top = hierarchy.num_levels - 1
+    level_points = level_cells(top)
+    matrix = CandidateMatrix.from_triples(level_points.ids, facilities.ids,
+        *backend.closest_facilities(level_points, facilities, num_to_find))
+    result = assign(matrix, hierarchy.burden[top], capacity, level_points, facilities,
+                    backend, method)
+    profiler().record("multilevel_cells", top, len(level_points))
+
+    for level in range(top - 1, -1, -1):
+        level_points = level_cells(level)
+        parent = hierarchy.parent[level]
+        label = result.facility[parent]
+        solved = hierarchy.boundary(level, label)
+        cell_ids, fac_ids, costs = backend.closest_facilities(
+            level_points.select(level_points.ids[solved]), facilities, num_to_find)
+        matrix = project(matrix, parent, level_points.ids, solved,
+                         (_positions(level_points.ids, cell_ids), fac_ids, costs))
+        previous = np.where(solved | (label < 0), -1,
+                            facilities.ids[np.maximum(label, 0)])
+        result = assign(matrix, hierarchy.burden[level], capacity, level_points, facilities,
+                        backend, initial = initial_ranks(matrix, previous, []))
+        profiler().record("multilevel_cells", level, int(solved.sum()))
+        add_message(" ...... level {0}: {1} of {2} cells on boundaries solved".format(
+            level, int(solved.sum()), len(level_points)))
+
+    # Cells not solved on the finest level carry the costs of their
+    # super-cell's representative, so the total cost is an estimate.
+    if top > 0:
+        add_message(" ...... total cost {0:.2f}, estimated for the {1} cells not solved"
+                    .format(result.cost, int((~solved).sum())))
+
+    write_columns(facilities.source, matrix.fac_ids, {'Assigned_burden': result.load})
+    write_columns(cells.source, matrix.cell_ids,
+                  {'FacilityID': facility_keys(assigned_ids(matrix, result))})
+    return matrix, cells, result
+
+
+# Refine the fishnet near the partition boundaries, `levels` times: split
+# the cells of the finest level that have a neighbour assigned to another
+# facility, or whose second closest facility costs at most `gap` (a
+# fraction) more than the closest, into four, solve only their children
+# and assign all cells again. The cells are written anew to `points_fc`.
+# Returns the fishnet, candidate matrix, cells and assignment.
+def refine_fishnet(fishnet, matrix, cells, result, facilities, backend, points_fc,
+                   levels, num_to_find = 5, method = "GREEDY", gap = 0.05):
+    capacity = read_values(facilities.source, 'Burden', matrix.fac_ids)
+    for level in range(levels):
+        mask = boundary_cells(fishnet, assigned_ids(matrix, result)) | close_calls(matrix, gap)
+        mask &= fishnet.level == level
+        if not mask.any(): break
+        fishnet, source, child = fishnet.subdivide(mask)
+        add_message(" ...... level {0}: {1} cells split into {2}".format(
+            level + 1, int(mask.sum()), int(child.sum())))
+
+        fishnet.write_points(points_fc)
+        new_cells = PointSet.from_feature_class(points_fc, "FishnetID")
+        write_columns(points_fc, new_cells.ids, {"FishnetID": new_cells.ids})
+
+        # Cells that stay keep their candidates; only children are solved.
+        new_id = np.full(matrix.num_cells, -1, dtype = np.int64)
+        new_id[source[~child]] = new_cells.ids[~child]
+        rows = new_id[matrix.row_cells()]
+        kept = rows >= 0
+        cell_ids, fac_ids, costs = backend.closest_facilities(
+            new_cells.select(new_cells.ids[child]), facilities, num_to_find)
+        matrix = CandidateMatrix.from_triples(
+            new_cells.ids, matrix.fac_ids,
+            np.concatenate([rows[kept], cell_ids]),
+            np.concatenate([matrix.fac_ids[matrix.fac[kept]], fac_ids]),
+            np.concatenate([matrix.cost[kept], costs]))
+        cells = new_cells
+        result = assign(matrix, fishnet.value, capacity, cells, facilities, backend, method)
+
+    write_columns(facilities.source, matrix.fac_ids, {'Assigned_burden': result.load})
+    write_columns(cells.source, matrix.cell_ids,
+                  {'FacilityID': facility_keys(assigned_ids(matrix, result))})
+    return fishnet, matrix, cells, result
+
+
+# Improve the assignment by local search on the partition boundaries for at
+# most `seconds`, report the cost, overload and number of cell sides on
+# boundaries after every round, and store it as `assign_points` does.
+def improve_boundaries(fishnet, matrix, cells, result, facilities, seconds):
+    add_message("...improving partition boundaries")
+    capacity = read_values(facilities.source, 'Burden', matrix.fac_ids)
+    result = local_search(matrix, fishnet.value, capacity, result, fishnet.neighbours(),
+                          max_seconds = seconds)
+    for n, (elapsed, cost, overload, cut) in enumerate(result.trajectory):
+        profiler().record("local_search_cost", n, cost)
+        add_message(" ...... round {0} ({1:.1f} s): total cost {2:.2f}, overload {3:.2f}, "
+                    "boundary sides {4}".format(n, elapsed, cost, overload, cut))
+
+    write_columns(facilities.source, matrix.fac_ids, {'Assigned_burden': result.load})
+    if cells.source is not None:
+        write_columns(cells.source, matrix.cell_ids,
+                      {'FacilityID': facility_keys(assigned_ids(matrix, result))})
+    return result
+
+
+# Cells with a neighbour assigned to another facility (`assigned` IDs).
+def boundary_cells(fishnet, assigned):
+    i, j = fishnet.neighbours()
+    differ = assigned[i] != assigned[j]
+    mask = np.zeros(len(fishnet), dtype = bool)
+    mask[i[differ]] = True
+    mask[j[differ]] = True
+    return mask
+
+
+# Cells whose two closest candidates are within `gap` (a fraction of the
+# closest cost) of each other.
+def close_calls(matrix, gap):
+    mask = np.zeros(matrix.num_cells, dtype = bool)
+    if not gap: return mask
+    has = matrix.counts >= 2
+    first = matrix.offsets[:-1][has]
+    mask[has] = matrix.cost[first + 1] - matrix.cost[first] <= gap * matrix.cost[first]
+    return mask
+
+
+# Facility ID assigned to every cell, -1 for none.
+def assigned_ids(matrix, result):
+    return np.where(result.facility >= 0,
+                    matrix.fac_ids[np.maximum(result.facility, 0)], -1)
+
+
+# Facility IDs as the text of the FacilityID field, "False" for none.
+def facility_keys(ids):
+    ids = np.asarray(ids, dtype = np.int64)
+    return np.where(ids >= 0, ids.astype(str), str(False))
+
+
+# Burden and assigned burden of facilities `fac_ids` as output columns
+# keyed by FacilityID text.
+def facility_columns(fac_ids, burden, load, names = ("Burden", "Assigned_burden")):
+    keys = facility_keys(fac_ids).tolist()
+    return dict((name, dict(zip(keys, np.asarray(values, dtype = np.float64).tolist())))
+                for name, values in zip(names, (burden, load)))
+
+
+# Partition the zones among the facilities and write the service areas to
+# `output`. With a `session`, its network settings and backend are used
+# (and `streets`, `network`, `travel_mode`, `travel_direction` and `engine`
+# are ignored), so that many runs share one loaded network.
+#
+# With a `state_folder`, the run's state is saved there. If the folder
+# holds the state of a run with the same inputs and output except for the
+# facilities, only what the changed facilities touch is recomputed and
+# their service areas replaced in `output`.
+#
+# With `refine_levels`, cells on the boundaries between partitions are split
+# into quadrants that many times, for boundaries as fine as a fishnet of
+# `cell_size / 2 ** refine_levels` while solving only the cells split.
+#
+# With a `tile_size`, the fishnet and cost matrix are made tile by tile,
+# with facilities within `tile_halo` of each tile, see `tiled_dist_matrix`.
+#
+# With `search_seconds`, the final assignment is improved by local search
+# on the partition boundaries for that long at most.
+#
+# With `coarsen_levels`, the cells are merged into super-cells up to that
+# many times and the assignment is solved from the coarsest level down,
+# solving only the cells on partition boundaries, see `multilevel_assign`.
+# Matrix caching is not used then, and it is ignored with a `tile_size`.
+#
+# With a `checkpoint_folder`, the candidate matrix (also as cells run out
+# of candidates and more are solved, every minute or so), the assignment
+# and the searched assignment are saved there as they are made. A run with
+# `resume` and the same inputs carries on from the last one saved.
+def cap_based_nt_partitioning(
+    facilities, fac_cap_field,
+    zones, zones_burden_field,
+    streets, network, output,
+    travel_mode = "Driving Time",
+    travel_direction = "FROM_FACILITIES",
+    cell_size = 0.003,
+    num_to_find = 5,
+    engine = "NETWORK_ANALYST",
+    assignment = "GREEDY",
+    cache_folder = None,
+    session = None,
+    state_folder = None,
+    refine_levels = 0,
+    tile_size = None,
+    tile_halo = None,
+    search_seconds = None,
+    checkpoint_folder = None,
+    resume = False,
+    coarsen_levels = 0
+    ):
+    if num_to_find == None: num_to_find = 5
+    if session is None:
+        with Session(network, travel_mode, travel_direction, engine, streets) as session:
+            return cap_based_nt_partitioning(facilities, fac_cap_field, zones,
+                zones_burden_field, streets, network, output, cell_size = cell_size,
+                num_to_find = num_to_find, assignment = assignment,
+                cache_folder = cache_folder, session = session,
+                state_folder = state_folder, refine_levels = refine_levels,
+                tile_size = tile_size, tile_halo = tile_halo,
+                search_seconds = search_seconds,
+                checkpoint_folder = checkpoint_folder, resume = resume,
+                coarsen_levels = coarsen_levels)
+
+    arcpy = get_arcpy()
+    session.activate()
+    # Network Analyst solves, or the in-process graph engine on the streets.
+    backend = session.backend
+
+    # Facilities on a feature layer of the session.
+    fac_points = session.facilities(facilities, "FacID")
+    facilities_lyr = fac_points.source
+
+    if state_folder or checkpoint_folder:
+        settings = _settings(session, facilities, fac_cap_field, zones, zones_burden_field,
+                             output, cell_size, num_to_find, assignment, refine_levels,
+                             tile_size, tile_halo, search_seconds, coarsen_levels)
+    if state_folder:
+        state = RunState.load(state_folder, TOOL)
+        if state is not None and state.matches(settings) and arcpy.Exists(output):
+            add_message(" ... updating partitions of the previous run")
+            state, result = _update_partitions(state, session, fac_points,
+                                               fac_cap_field, output)
+            state.save(state_folder)
+            return result
+
+    fishnet_points = "fishnet_points"
+    fishnet_points = os.path.join(arcpy.env.workspace,  fishnet_points)
+
+    zones_lyr = os.path.join(arcpy.env.workspace, "zones_lyr")
+    arcpy.MakeFeatureLayer_management(zones, zones_lyr)
+
+    # Stages saved by an interrupted run with the same inputs, facilities
+    # and capacities.
+    checkpoint, resumed, saved = None, None, None
+    if checkpoint_folder:
+        capacity = read_values(facilities_lyr, fac_cap_field, fac_points.ids)
+        checkpoint = Checkpoint(checkpoint_folder, TOOL, dict(settings,
+            facilities_digest = array_digest(fac_points.ids, fac_points.xy, capacity)),
+            resume)
+        resumed, saved = checkpoint.latest(("matrix", "assignment", "local_search"))
+
+    spill, result = None, None
+    if resumed:
+        add_message(" ... resuming after the saved " + resumed.replace("_", " "))
+        cells_grid, matrix = _load_grid(saved)
+        with profiler().stage("distr_burden"):
+            cells = _write_cells(cells_grid, fishnet_points)
+            write_columns(facilities_lyr, fac_points.ids, {"FacID": fac_points.ids})
+            distr_burden(fishnet_points, 'VALUE', facilities_lyr, fac_cap_field)
+    elif tile_size:
+        # Fishnet and distance matrix tile by tile, spilled to disk.
+        spill = TileSpill()
+        with profiler().stage("tiles") as stage:
+            cells_grid, matrix, cells = tiled_dist_matrix(zones_lyr, session.streets,
+                fishnet_points, cell_size, zones_burden_field, fac_points, backend,
+                spill, tile_size, tile_halo, num_to_find)
+            stage.rows = len(cells_grid)
+        with profiler().stage("distr_burden"):
+            distr_burden(fishnet_points, 'VALUE', facilities_lyr, fac_cap_field)
+    else:
+        # Create fishnet points from input zones.
+        with profiler().stage("create_fishnet") as stage:
+            cells_grid = create_fishnet(zones_lyr, session.streets, fishnet_points,
+                                        cell_size, zones_burden_field)
+            stage.rows = len(cells_grid)
+
+        # Distribute burden to facilities.
+        with profiler().stage("distr_burden"):
+            distr_burden(fishnet_points, 'VALUE', facilities_lyr, fac_cap_field)
+
+        if coarsen_levels:
+            # Solve the coarsest super-cells and, below them, only the cells
+            # on partition boundaries.
+            with profiler().stage("multilevel_assign") as stage:
+                matrix, cells, result = multilevel_assign(cells_grid, fac_points, backend,
+                    fishnet_points, coarsen_levels, num_to_find, assignment)
+                stage.rows = len(matrix.fac)
+        else:
+            # Calculate distance matrix between facilities and fishnet points.
+            # Reruns with the same network settings and locations reuse the matrix.
+            with profiler().stage("dist_matrix") as stage:
+                cache = MatrixCache(cache_folder or None)
+                key_parts = (session.engine, dataset_stamp(session.network),
+                             dataset_stamp(session.streets), session.cost_field,
+                             session.oneway_field, session.travel_mode,
+                             session.travel_direction, cell_size)
+                matrix, cells = dist_matrix(fac_points, backend, fishnet_points,
+                                            num_to_find, cache, key_parts)
+                stage.rows = len(matrix.fac)
+
+    # Candidates solved for cells that ran out are saved along the way.
+    def save_matrix(matrix, force = True):
+        if checkpoint is not None and (force or checkpoint.due()):
+            checkpoint.save("matrix", _grid_arrays(cells_grid, matrix))
+
+    if resumed in (None, "matrix"):
+        # Assign fishnet points to facilities based on the distance between them and facilities' capacity.
+        if result is None:
+            if resumed is None: save_matrix(matrix)
+            with profiler().stage("assign_points") as stage:
+                result = assign_points(matrix, cells, fac_points, backend, assignment,
+                                       lambda extended: save_matrix(extended, False))
+                stage.rows = matrix.num_cells
+
+        # Split the cells along partition boundaries and assign again.
+        if refine_levels:
+            with profiler().stage("refine_fishnet") as stage:
+                coarse = len(cells_grid)
+                cells_grid, matrix, cells, result = refine_fishnet(
+                    cells_grid, matrix, cells, result, fac_points, backend, fishnet_points,
+                    refine_levels, num_to_find, assignment)
+                stage.rows = len(cells_grid) - coarse
+        if checkpoint is not None:
+            checkpoint.save("assignment", _checkpoint_arrays(cells_grid, matrix, result))
+    else:
+        result = _load_result(saved)
+        write_columns(facilities_lyr, matrix.fac_ids, {'Assigned_burden': result.load})
+
+    # Trade run time for quality on the boundaries.
+    if search_seconds and resumed != "local_search":
+        with profiler().stage("local_search") as stage:
+            result = improve_boundaries(cells_grid, matrix, cells, result, fac_points,
+                                        search_seconds)
+            stage.rows = result.iterations
+        if checkpoint is not None:
+            checkpoint.save("local_search", _checkpoint_arrays(cells_grid, matrix, result))
+
+    # Create output feature class: the outline of every facility's cells,
+    # traced on the grid.
+    with profiler().stage("dissolve") as stage:
+        burden = read_values(facilities_lyr, 'Burden', matrix.fac_ids)
+        stage.rows = cells_grid.dissolve(output, FACILITY_FIELD,
+            facility_keys(assigned_ids(matrix, result)),
+            facility_columns(matrix.fac_ids, burden, result.load))
+
+    if state_folder:
+        capacity = read_values(facilities_lyr, fac_cap_field, fac_points.ids)
+        _state(settings, cells_grid, matrix, assigned_ids(matrix, result), fac_points,
+               capacity, output).save(state_folder)
+
+    arcpy.Delete_management(zones_lyr)
+    arcpy.Delete_management(fishnet_points)
+    if spill is not None: spill.close()
+    if checkpoint is not None: checkpoint.clear()
+    return result
+
+
+# Inputs that must be the same for a run to update the partitions of a
+# previous one. Zones are compared by their object IDs, burden and area.
+def _settings(session, facilities, fac_cap_field, zones, zones_burden_field, output,
+              cell_size, num_to_find, assignment, refine_levels = 0, tile_size = None,
+              tile_halo = None, search_seconds = None, coarsen_levels = 0):
+    zone_columns = read_columns(zones, ["OID@", zones_burden_field, "SHAPE@AREA"], 0)
+    return {
+        "engine": session.engine,
+        "network": dataset_stamp(session.network),
+        "streets": dataset_stamp(session.streets),
+        "cost_field": session.cost_field,
+        "oneway_field": session.oneway_field,
+        "travel_mode": session.travel_mode,
+        "travel_direction": session.travel_direction,
+        "facilities": str(facilities),
+        "capacity_field": fac_cap_field,
+        "zones": str(zones),
+        "zones_digest": array_digest(*zone_columns.values()),
+        "output": str(output),
+        "cell_size": float(cell_size),
+        "num_to_find": int(num_to_find),
+        "assignment": assignment,
+        "refine_levels": int(refine_levels or 0),
+        "tile_size": float(tile_size or 0),
+        "tile_halo": float(tile_halo or 0),
+        "search_seconds": float(search_seconds or 0),
+        "coarsen_levels": int(coarsen_levels or 0),
+    }
+
+
+# State of a run: the fishnet, candidate matrix, assigned facility ID of
+# every cell, the facilities with their capacities, and the names of the
+# output's facility, burden and assigned burden fields.
+def _state(settings, fishnet, matrix, assigned, facilities, capacity, output):
+    arcpy = get_arcpy()
+    fields = [f.name for f in arcpy.ListFields(output)
+              if f.type not in ("OID", "Geometry") and
+              f.name.lower() not in ("shape_length", "shape_area")]
+    arrays = _grid_arrays(fishnet, matrix)
+    arrays.update({
+        "assigned": np.asarray(assigned, dtype = np.int64),
+        "facility_ids": facilities.ids, "facility_xy": facilities.xy,
+        "capacity": np.asarray(capacity, dtype = np.float64),
+        "output_fields": np.array(fields[:3]),
+    })
+    return RunState(TOOL, settings, arrays)
+
+
+# Arrays of the fishnet and candidate matrix, for `_load_grid`.
+def _grid_arrays(fishnet, matrix):
+    sr = fishnet.spatial_reference
+    return {
+        "origin": np.array(fishnet.origin), "size": np.array(fishnet.size),
+        "row": fishnet.row, "col": fishnet.col, "level": fishnet.level,
+        "zone": fishnet.zone, "value": fishnet.value,
+        "spatial_reference": np.array(sr.exportToString() if sr else ""),
+        "cell_ids": matrix.cell_ids, "fac_ids": matrix.fac_ids,
+        "offsets": matrix.offsets, "fac": matrix.fac, "cost": matrix.cost,
+    }
+
+
+# Fishnet and candidate matrix saved by `_grid_arrays`.
+def _load_grid(a):
+    sr = None
+    if str(a["spatial_reference"]):
+        sr = get_arcpy().SpatialReference()
+        sr.loadFromString(str(a["spatial_reference"]))
+    fishnet = Fishnet(a["origin"], float(a["size"]), a["row"], a["col"],
+                      a["zone"], a["value"], sr, a["level"])
+    matrix = CandidateMatrix(a["cell_ids"], a["fac_ids"], a["offsets"], a["fac"], a["cost"])
+    return fishnet, matrix
+
+
+# Arrays of the fishnet, candidate matrix and assignment of a checkpoint.
+def _checkpoint_arrays(fishnet, matrix, result):
+    arrays = _grid_arrays(fishnet, matrix)
+    arrays.update({"result_row": result.row, "result_facility": result.facility,
+                   "result_load": result.load, "result_capacity": result.capacity,
+                   "result_cost": np.array(result.cost)})
+    return arrays
+
+
+# Assignment saved by `_checkpoint_arrays`.
+def _load_result(a):
+    return AssignmentResult(a["result_row"], a["result_facility"], a["result_load"],
+                            a["result_capacity"], float(a["result_cost"]))
+
+
+# Write the cells of a saved fishnet to `points_fc` again, with their object
+# IDs as FishnetID, as `create_fishnet` and `dist_matrix` leave them.
+def _write_cells(fishnet, points_fc):
+    fishnet.write_points(points_fc)
+    cells = PointSet.from_feature_class(points_fc, "FishnetID")
+    write_columns(points_fc, cells.ids, {"FishnetID": cells.ids})
+    return cells
+
+
+# Update the partitions in `output` of the run saved in `state` for the
+# current facilities: solve the cost from added facilities to the cells in
+# reach, patch the candidate matrix, restart the assignment from the
+# previous one and replace the service areas of the facilities whose cells
+# changed. The greedy heuristic moves cells back to added facilities and
+# to those whose burden target grew, and the overload off the others;
+# `FLOW` has no warm start and solves the whole assignment again on the
+# patched matrix. Returns the new state and the assignment (None if no
+# facility changed).
+def _update_partitions(state, session, fac_points, fac_cap_field, output):
+    arcpy = get_arcpy()
+    a = state.arrays
+    settings = state.settings
+    num_to_find = settings["num_to_find"]
+    capacity = read_values(fac_points.source, fac_cap_field, fac_points.ids)
+    diff = FacilityDiff.between(a["facility_ids"], a["facility_xy"],
+                                fac_points.ids, fac_points.xy, a["capacity"], capacity)
+    add_message(" ...... facilities: " + str(diff))
+
+    fishnet, matrix = _load_grid(a)
+    sr = fishnet.spatial_reference
+    previous = a["assigned"]
+    if not len(diff):
+        return _state(settings, fishnet, matrix, previous, fac_points, capacity, output), None
+
+    # Network Analyst loads the cells from a feature class.
+    backend = session.backend
+    cells = PointSet(matrix.cell_ids, fishnet.centroids())
+    write_columns(fac_points.source, fac_points.ids, {"FacID": fac_points.ids})
+    if session.engine == NETWORK_ANALYST:
+        fishnet_points = os.path.join(arcpy.env.workspace, "fishnet_points")
+        write_points(fishnet_points, cells.xy, {"FishnetID": cells.ids}, sr)
+        cells = PointSet(cells.ids, cells.xy, fishnet_points, "FishnetID")
+
+    # Costs from the added facilities to the cells whose lists they can join.
+    with profiler().stage("dist_matrix") as stage:
+        rows = (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0))
+        if len(diff.added):
+            bound = float(insert_threshold(matrix, num_to_find).max())
+            cell_ids, fac_ids, costs = backend.closest_facilities(
+                cells, fac_points.select(diff.added), len(diff.added), bound)
+            rows = (matrix.cell_index(cell_ids), fac_ids, costs)
+        matrix, touched = patch_matrix(matrix, fac_points.ids, diff.removed, rows, num_to_find)
+        stage.rows = int(touched.sum())
+
+    # Restart the assignment from the previous one. Burden targets of all
+    # facilities change with the total capacity; cells may move back to
+    # the facilities whose target grew.
+    with profiler().stage("assign_points") as stage:
+        ratio = fishnet.value.sum() / capacity.sum()
+        target = dict(zip(a["facility_ids"].tolist(),
+                          (a["capacity"] * fishnet.value.sum() / a["capacity"].sum()).tolist()))
+        grown = [i for i, t in zip(fac_points.ids.tolist(), (capacity * ratio).tolist())
+                 if i not in target or t > target[i]]
+        write_columns(fac_points.source, fac_points.ids, {'Burden': capacity * ratio})
+        initial = None
+        if settings["assignment"] == "FLOW":
+            add_message(" ...... FLOW has no warm start; solving the whole assignment again")
+        else:
+            initial = initial_ranks(matrix, previous, grown)
+        result = assign(matrix, fishnet.value, capacity * ratio, cells, fac_points,
+                        backend, settings["assignment"], initial)
+        if settings.get("search_seconds"):
+            result = improve_boundaries(fishnet, matrix, PointSet(cells.ids, cells.xy), result,
+                                        fac_points, settings["search_seconds"])
+        write_columns(fac_points.source, matrix.fac_ids, {'Assigned_burden': result.load})
+        assigned = assigned_ids(matrix, result)
+        moved = assigned != previous
+        stage.rows = int(moved.sum())
+
+    # Dissolve the cells of the facilities that gained or lost cells and
+    # replace their service areas.
+    with profiler().stage("dissolve"):
+        changed = set(previous[moved].tolist()) | set(assigned[moved].tolist()) | \
+                  set(diff.added.tolist()) | set(diff.removed.tolist())
+        changed = np.array(sorted(changed), dtype = np.int64)
+        facility_field, burden_field, assigned_field = a["output_fields"].tolist()
+        temp_output = os.path.join(arcpy.env.workspace, "temp_output")
+        parts = np.isin(assigned, changed)
+        fishnet.subset(parts).dissolve(temp_output, facility_field,
+            facility_keys(assigned[parts]),
+            facility_columns(matrix.fac_ids, capacity * ratio, result.load,
+                             (burden_field, assigned_field)))
+        replace_rows(output, facility_field, facility_keys(changed).tolist(), temp_output)
+
+        # Burden targets of all facilities change with the total capacity.
+        keys = facility_keys(matrix.fac_ids).tolist()
+        values = dict(zip(keys, zip((capacity * ratio).tolist(), result.load.tolist())))
+        with arcpy.da.UpdateCursor(output, [facility_field, burden_field,
+                                            assigned_field]) as update_rows:
+            for row in update_rows:
+                if row[0] in values:
+                    update_rows.updateRow([row[0]] + list(values[row[0]]))
+        arcpy.Delete_management(temp_output)
+        if session.engine == NETWORK_ANALYST:
+            arcpy.Delete_management(cells.source)
+
+    return _state(settings, fishnet, matrix, assigned, fac_points, capacity, output), result
@@ -0,0 +1,99 @@
+"""
+Checkpoints of long runs. A run saves the stages it completes, and its
+progress within long stages, as units in a folder; a resumed run with the
+same settings loads the last unit saved and carries on from there instead
+of starting over.
+"""
+
+import json
+import os
+import time
+import numpy as np
+
+from ._arcpy import add_message
+
+_HEADER_FILE = "checkpoint.json"
+
+
+class Checkpoint(object):
+    # Units of the run of `tool` with `settings` (JSON values) saved in
+    # `folder`. With `resume`, the units of a run with the same tool and
+    # settings are kept; otherwise, or if they differ, the folder starts
+    # empty. Progress within a stage is saved when `due`, every `interval`
+    # seconds at most.
+    def __init__(self, folder, tool, settings, resume = False, interval = 60):
+        self.folder = folder
+        self.tool = tool
+        self.settings = json.loads(json.dumps(settings))
+        self.interval = interval
+        self.units = []
+        self._saved = time.time()
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        header = self._read_header()
+        if resume and header.get("tool") == tool and header.get("settings") == self.settings:
+            self.units = [unit for unit in header.get("units", [])
+                          if os.path.exists(self._path(unit))]
+        else:
+            if resume:
+                add_message(" ... no checkpoint of this run to resume; starting over")
+            self.clear()
+
+    def _path(self, unit):
+        return os.path.join(self.folder, "unit_{0}.npz".format(unit))
+
+    def _read_header(self):
+        try:
+            with open(os.path.join(self.folder, _HEADER_FILE)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    # Write `path` with `write(file)` through a temporary file, so that a
+    # run killed while saving leaves the previous file.
+    def _replace(self, path, write):
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            write(f)
+        os.replace(temp, path)
+
+    def _write_header(self):
+        text = json.dumps({"tool": self.tool, "settings": self.settings,
+                           "units": self.units}, indent = 2).encode("utf-8")
+        self._replace(os.path.join(self.folder, _HEADER_FILE), lambda f: f.write(text))
+
+    # True if progress should be saved again.
+    def due(self):
+        return time.time() - self._saved >= self.interval
+
+    # Save `arrays` (name -> array) as `unit`, replacing any saved before.
+    def save(self, unit, arrays):
+        self._replace(self._path(unit), lambda f: np.savez(f, **arrays))
+        if unit in self.units:
+            self.units.remove(unit)
+        self.units.append(unit)
+        self._write_header()
+        self._saved = time.time()
+
+    # Arrays of `unit`, or None if it was not saved.
+    def load(self, unit):
+        if unit not in self.units:
+            return None
+        with np.load(self._path(unit)) as data:
+            return dict((name, data[name]) for name in data.files)
+
+    # The last saved of `units` and its arrays, or (None, None).
+    def latest(self, units):
+        saved = [unit for unit in self.units if unit in units]
+        if not saved:
+            return None, None
+        return saved[-1], self.load(saved[-1])
+
+    # Remove every unit, as when the run is complete.
+    def clear(self):
+        for name in os.listdir(self.folder):
+            if name == _HEADER_FILE or (name.startswith("unit_") and
+                                        (name.endswith(".npz") or name.endswith(".tmp"))):
+                os.remove(os.path.join(self.folder, name))
+        self.units = []
@@ -0,0 +1,177 @@
+"""
+Command line interface to both partitioning tools, with the same
+parameters as the geoprocessing tools:
+
+    python -m network_partitioning capacity WORKSPACE OUTPUT ZONES BURDEN_FIELD
+        FACILITIES CAPACITY_FIELD STREETS CELL_SIZE NETWORK [options]
+    python -m network_partitioning distance WORKSPACE FACILITIES OUTPUT
+        NETWORK MAX_COST [options]
+
+to sweep the capacity tool over a grid of scenarios:
+
+    python -m network_partitioning sweep WORKSPACE TABLE.csv ZONES BURDEN_FIELD
+        FACILITIES STREETS NETWORK --capacity-field FIELD
+        [--vary cell_size=0.002,0.003 ...] [options]
+
+and to build the index of a street network once, for the GRAPH engine:
+
+    python -m network_partitioning index STREETS OUTPUT.npz [options]
+"""
+
+import argparse
+from collections import OrderedDict
+
+from ._arcpy import get_arcpy
+from .profiling import traced
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog = "network_partitioning",
+                                     description = "Network partitioning tools.")
+    tools = parser.add_subparsers(dest = "tool")
+    tools.required = True
+
+    capacity = tools.add_parser("capacity", help = "capacity-based network partitioning")
+    for name in ("workspace", "output", "zones", "burden_field", "facilities",
+                 "capacity_field", "streets"):
+        capacity.add_argument(name)
+    capacity.add_argument("cell_size", type = float)
+    capacity.add_argument("network")
+    capacity.add_argument("--travel-mode", default = "Driving Time")
+    capacity.add_argument("--travel-direction", default = "FROM_FACILITIES",
+                          choices = ["FROM_FACILITIES", "TO_FACILITIES"])
+    capacity.add_argument("--num-to-find", type = int, default = 5)
+    capacity.add_argument("--engine", default = "NETWORK_ANALYST",
+                          choices = ["NETWORK_ANALYST", "GRAPH"])
+    capacity.add_argument("--cost-field", help = "street cost field for the GRAPH engine")
+    capacity.add_argument("--oneway-field", help = "street one-way field for the GRAPH engine")
+    capacity.add_argument("--assignment", default = "GREEDY", choices = ["GREEDY", "FLOW"])
+    capacity.add_argument("--cache-folder")
+    capacity.add_argument("--trace-file")
+    capacity.add_argument("--state-folder")
+    capacity.add_argument("--refine-levels", type = int, default = 0)
+    capacity.add_argument("--tile-size", type = float)
+    capacity.add_argument("--tile-halo", type = float)
+    capacity.add_argument("--search-seconds", type = float)
+    capacity.add_argument("--coarsen-levels", type = int, default = 0)
+    capacity.add_argument("--checkpoint-folder")
+    capacity.add_argument("--resume", action = "store_true",
+                          help = "carry on from the checkpoint of an interrupted run")
+
+    distance = tools.add_parser("distance", help = "distance-based network partitioning")
+    for name in ("workspace", "facilities", "output", "network"):
+        distance.add_argument(name)
+    distance.add_argument("max_cost", type = float)
+    distance.add_argument("--travel-mode", default = "Driving Time")
+    distance.add_argument("--travel-direction", default = "FROM_FACILITIES",
+                          choices = ["FROM_FACILITIES", "TO_FACILITIES"])
+    distance.add_argument("--engine", default = "NETWORK_ANALYST",
+                          choices = ["NETWORK_ANALYST", "GRAPH"])
+    distance.add_argument("--cost-field", help = "street cost field for the GRAPH engine")
+    distance.add_argument("--oneway-field", help = "street one-way field for the GRAPH engine")
+    distance.add_argument("--method", default = "ITERATIVE", choices = ["ITERATIVE", "VORONOI"])
+    distance.add_argument("--workers", type = int, default = 1)
+    distance.add_argument("--trace-file")
+    distance.add_argument("--state-folder")
+    distance.add_argument("--output-type", default = "POLYGONS",
+                          choices = ["POLYGONS", "LINES", "HULLS", "BUFFERS"])
+    distance.add_argument("--buffer-distance", default = "50 Meters")
+    distance.add_argument("--checkpoint-folder")
+    distance.add_argument("--resume", action = "store_true",
+                          help = "carry on from the checkpoint of an interrupted run")
+
+    sweep = tools.add_parser("sweep", help = "capacity-based partitioning over scenarios")
+    for name in ("workspace", "table", "zones", "burden_field", "facilities",
+                 "streets", "network"):
+        sweep.add_argument(name)
+    sweep.add_argument("--vary", action = "append", default = [], metavar = "NAME=V1,V2",
+                       help = "values of a parameter to sweep: cell_size, num_to_find, "
+                              "fac_cap_field, travel_mode, travel_direction, assignment")
+    sweep.add_argument("--capacity-field", dest = "fac_cap_field")
+    sweep.add_argument("--cell-size", type = float, default = 0.003)
+    sweep.add_argument("--num-to-find", type = int, default = 5)
+    sweep.add_argument("--travel-mode", default = "Driving Time")
+    sweep.add_argument("--travel-direction", default = "FROM_FACILITIES",
+                       choices = ["FROM_FACILITIES", "TO_FACILITIES"])
+    sweep.add_argument("--assignment", default = "GREEDY", choices = ["GREEDY", "FLOW"])
+    sweep.add_argument("--engine", default = "NETWORK_ANALYST",
+                       choices = ["NETWORK_ANALYST", "GRAPH"])
+    sweep.add_argument("--cost-field", help = "street cost field for the GRAPH engine")
+    sweep.add_argument("--oneway-field", help = "street one-way field for the GRAPH engine")
+    sweep.add_argument("--workers", type = int, default = 1)
+    sweep.add_argument("--output-prefix")
+    sweep.add_argument("--cache-folder")
+    sweep.add_argument("--trace-file")
+
+    index = tools.add_parser("index", help = "build the contraction hierarchy of a network")
+    index.add_argument("streets", help = "polyline feature class, or graph saved as .npz")
+    index.add_argument("output", help = ".npz file to give as NETWORK with --engine GRAPH")
+    index.add_argument("--cost-field")
+    index.add_argument("--oneway-field")
+    return parser
+
+
+def main(argv = None):
+    args = _parser().parse_args(argv)
+    if getattr(args, "resume", False) and not args.checkpoint_folder:
+        _parser().error("--resume needs --checkpoint-folder")
+    if args.tool == "index":
+        from .hierarchy import build_index
+        build_index(args.streets, args.output, args.cost_field, args.oneway_field)
+        return
+
+    from .session import Session
+    arcpy = get_arcpy()
+    arcpy.env.workspace = args.workspace
+    arcpy.env.overwriteOutput = True
+
+    if args.tool == "sweep":
+        from .sweep import capacity_sweep
+        names = ("cell_size", "num_to_find", "fac_cap_field", "travel_mode",
+                 "travel_direction", "assignment")
+        base = dict((name, getattr(args, name)) for name in names)
+        with traced(args.trace_file, "capacity_sweep"):
+            capacity_sweep(args.facilities, args.zones, args.burden_field, args.streets,
+                args.network, args.table, _grid(args.vary), base, args.engine,
+                args.workers, args.output_prefix, args.cache_folder,
+                args.cost_field, args.oneway_field)
+    elif args.tool == "capacity":
+        from .capacity import cap_based_nt_partitioning
+        session = Session(args.network, args.travel_mode, args.travel_direction,
+                          args.engine, args.streets, cost_field = args.cost_field,
+                          oneway_field = args.oneway_field)
+        with traced(args.trace_file, "cap_based_nt_partitioning"), session:
+            cap_based_nt_partitioning(args.facilities, args.capacity_field, args.zones,
+                args.burden_field, args.streets, args.network, args.output,
+                args.travel_mode, args.travel_direction, args.cell_size,
+                args.num_to_find, args.engine, args.assignment, args.cache_folder,
+                session = session, state_folder = args.state_folder,
+                refine_levels = args.refine_levels,
+                tile_size = args.tile_size, tile_halo = args.tile_halo,
+                search_seconds = args.search_seconds,
+                checkpoint_folder = args.checkpoint_folder, resume = args.resume,
+                coarsen_levels = args.coarsen_levels)
+    else:
+        from .distance import dist_based_nt_partitioning
+        session = Session(args.network, args.travel_mode, args.travel_direction,
+                          args.engine, cost_field = args.cost_field,
+                          oneway_field = args.oneway_field)
+        with traced(args.trace_file, "dist_based_nt_partitioning"), session:
+            dist_based_nt_partitioning(args.facilities, args.network, args.output,
+                args.travel_mode, args.travel_direction, args.max_cost,
+                args.engine, args.method, args.workers, session = session,
+                state_folder = args.state_folder, output_type = args.output_type,
+                buffer_distance = args.buffer_distance,
+                checkpoint_folder = args.checkpoint_folder, resume = args.resume)
+
+
+# Scenario grid from NAME=V1,V2 arguments, with numbers for the numeric
+# parameters.
+def _grid(vary):
+    types = {"cell_size": float, "num_to_find": int}
+    grid = OrderedDict()
+    for item in vary:
+        name, _, values = item.partition("=")
+        name = name.strip().replace("-", "_")
+        grid[name] = [types.get(name, str)(v.strip()) for v in values.split(",")]
+    return grid
@@ -0,0 +1,328 @@
+"""
+Distance-based network partitioning: service areas of facilities sized by
+proximity, or another cost, to the facilities in the network.
+"""
+
+import os
+import numpy as np
+
+from ._arcpy import get_arcpy, add_message
+from .cache import dataset_stamp
+from .checkpoint import Checkpoint
+from .incremental import (FacilityDiff, RunState, update_labels, touched_facilities,
+                          replace_rows)
+from .parallel import parallel_boundary_points
+from .profiling import profiler
+from .routing import GraphBackend
+from .session import Session
+from .voronoi import NetworkVoronoi
+
+# Name of the saved state of this tool, see `RunState`.
+TOOL = "dist_based_nt_partitioning"
+
+
+# Create service area polygon for given facilities from a network
+def service_area(fac_ids, output, facilities, backend, max_cost, point_barriers = None):
+    backend.service_area(facilities.select(fac_ids), output, max_cost,
+                         barriers = point_barriers)
+
+
+# Create boundary points between target point and other points,
+# such that for each boundary points the impedence to target point
+# and closest point is equal. Points in the partitions of the facilities
+# `claimed_ids`, solved before, are left out.
+def create_boundary_points(target_id, others_id_list, points, backend, claimed_ids = None):
+    claimed = points.select(claimed_ids) if claimed_ids else None
+    return backend.boundary_points(points.select([target_id]),
+                                   points.select(others_id_list), claimed)
+
+
+# Partition the network among the facilities and write the partitions,
+# joined with the facilities' attributes, to `output` in the workspace.
+# With a `session`, its network settings and backend are used (and
+# `st_network`, `mode`, `direction` and `engine` are ignored), so that
+# many runs share one loaded network.
+#
+# With a `state_folder`, the GRAPH engine and the VORONOI method, the
+# network labels of the run are saved there. If the folder holds the state
+# of a run with the same network, settings and output, only the part of
+# the network the added and removed facilities touch is searched again and
+# their partitions, and those of their neighbours, are replaced in `output`.
+#
+# With an `output_type` of LINES, the partitions are written as the street
+# lines each facility is nearest to, labelled with its FacilityID, from one
+# solve and without boundary points. HULLS and BUFFERS also make polygons
+# of those lines (convex hulls, or buffers of `buffer_distance`), and keep
+# the lines in `<output>_lines`.
+#
+# With a `checkpoint_folder`, the boundary points found so far are saved
+# there every minute or so and when all are found. A run with `resume` and
+# the same inputs solves only the facilities the interrupted run had not.
+def dist_based_nt_partitioning(facilities, st_network, output,
+                        mode = "Driving Time",
+                        direction = "FROM_FACILITIES",
+                        max_cost = 1000000,
+                        engine = "NETWORK_ANALYST",
+                        method = "ITERATIVE",
+                        workers = 1,
+                        session = None,
+                        state_folder = None,
+                        output_type = "POLYGONS",
+                        buffer_distance = "50 Meters",
+                        checkpoint_folder = None,
+                        resume = False):
+    if session is None:
+        with Session(st_network, mode, direction, engine) as session:
+            return dist_based_nt_partitioning(facilities, st_network, output,
+                max_cost = max_cost, method = method, workers = workers,
+                session = session, state_folder = state_folder,
+                output_type = output_type, buffer_distance = buffer_distance,
+                checkpoint_folder = checkpoint_folder, resume = resume)
+
+    arcpy = get_arcpy()
+    session.activate()
+    workspace = arcpy.env.workspace
+
+    # Initialize
+    add_message(" ... initializing names")
+    partitions = "Partitions"
+
+    # Facilities on a feature layer of the session.
+    fac_points = session.facilities(facilities)
+    fac_layer = fac_points.source
+
+    # Network Analyst solves, or the in-process graph engine.
+    backend = session.backend
+
+    # Create a list of all facilities' ID for loop through
+    all_ids = fac_points.ids.tolist()
+
+    if output_type != "POLYGONS":
+        if state_folder:
+            add_message(" ... incremental updates need polygon partitions; no state is saved")
+        _partition_lines(facilities, fac_points, backend, os.path.join(workspace, output),
+                         max_cost, output_type, buffer_distance)
+        return
+
+    if state_folder and not isinstance(backend, GraphBackend):
+        add_message(" ... incremental updates need the GRAPH engine; no state is saved")
+        state_folder = None
+    if state_folder and method != "VORONOI":
+        add_message(" ... incremental updates need the VORONOI method; "
+                    "running in full and saving no state")
+        state_folder = None
+    if state_folder:
+        settings = {"network": dataset_stamp(session.network),
+                    "cost_field": session.cost_field,
+                    "oneway_field": session.oneway_field,
+                    "travel_direction": session.travel_direction,
+                    "facilities": str(facilities), "output": str(output),
+                    "max_cost": float(max_cost), "method": method}
+        state = RunState.load(state_folder, TOOL)
+        if state is not None and state.matches(settings) and \
+                arcpy.Exists(os.path.join(workspace, output)):
+            add_message(" ... updating partitions of the previous run")
+            _update_partitions(state, backend, fac_points, fac_layer,
+                               os.path.join(workspace, output), max_cost).save(state_folder)
+            return
+
+    if method == "VORONOI":
+        # Label the whole network with its nearest facility in one
+        # multi-source search and build partitions directly from it.
+        add_message(" ... solving network voronoi partitions")
+        with profiler().stage("partition") as stage:
+            stage.rows = len(backend.partition(fac_points.select(all_ids),
+                                               partitions, max_cost))
+        with profiler().stage("spatial_join"):
+            arcpy.SpatialJoin_analysis(partitions, fac_layer,
+                                       os.path.join(workspace, output))
+        try:
+            arcpy.Delete_management(partitions)
+        except: pass
+        if state_folder: _state(settings, backend, fac_points, max_cost).save(state_folder)
+        return
+    # Create a list of remain facilities' ID
+    remain_ids = all_ids.copy()
+
+    checkpoint = None
+    if checkpoint_folder:
+        checkpoint = Checkpoint(checkpoint_folder, TOOL, {
+            "network": dataset_stamp(session.network), "engine": session.engine,
+            "cost_field": session.cost_field, "oneway_field": session.oneway_field,
+            "travel_mode": session.travel_mode,
+            "travel_direction": session.travel_direction,
+            "facilities": str(facilities), "facilities_digest": fac_points.digest()},
+            resume)
+    backend.clear_boundary_points()
+    progress = _BoundaryProgress(backend, checkpoint)
+
+    add_message(" ... starting network partitioning")
+
+    # For each loop, find all boundary points for current facility
+    # and add them to boundary_points
+    with profiler().stage("boundary_points") as stage:
+        if workers > 1:
+            # Solve facilities on a pool of processes, each with its own
+            # backend and scratch workspace.
+            add_message(" ... solving partitions with {0} workers".format(workers))
+            parallel_boundary_points(backend, fac_points, all_ids, workers,
+                                     skip = progress.found, on_found = progress.add)
+        else:
+            for i, current_id in enumerate(all_ids):
+                if current_id == all_ids[-1]: break    # skip the last facility
+                remain_ids.remove(current_id)   # remove current_id from remain_ids list
+                if current_id in progress.found: continue   # solved before a restart
+                add_message(" ...... solving partition of facility: " + str(current_id))
+
+                # Create boundary points for current facility and add them to boundary_points
+                found = create_boundary_points(current_id, remain_ids, fac_points, backend,
+                                               all_ids[:i])
+                profiler().record("barrier_points", current_id, len(found))
+                progress.add(current_id, found)
+        boundary_points = progress.points(all_ids)
+        progress.save()
+        stage.rows = len(boundary_points)
+
+
+    # Solve partitions for all facilities with boundary point
+    # from previous step as barriers
+    with profiler().stage("service_area"):
+        service_area(all_ids, partitions, fac_points, backend,
+                     max_cost, point_barriers = boundary_points)
+    # Join the facilities information back to partitions and create output file.
+    with profiler().stage("spatial_join"):
+        arcpy.SpatialJoin_analysis(partitions, fac_layer,
+                                   os.path.join(workspace, output))
+    try:
+        arcpy.Delete_management(partitions)
+    except: pass
+    if checkpoint is not None: checkpoint.clear()
+
+
+# Write the lines of the network nearest to each facility to `output`, or
+# to `<output>_lines` and their hulls or buffers to `output`, and join the
+# facilities' attributes on FacilityID.
+def _partition_lines(facilities, fac_points, backend, output, max_cost,
+                     output_type, buffer_distance):
+    arcpy = get_arcpy()
+    lines = output
+    if output_type != "LINES":
+        base, ext = os.path.splitext(output)
+        lines = base + "_lines" + ext
+
+    add_message(" ... solving network partition lines")
+    with profiler().stage("partition") as stage:
+        stage.rows = backend.partition_lines(fac_points, lines, max_cost)
+
+    if output_type == "HULLS":
+        add_message(" ... creating convex hulls of partition lines")
+        arcpy.Delete_management(output)
+        arcpy.MinimumBoundingGeometry_management(lines, output, "CONVEX_HULL",
+                                                 "LIST", ["FacilityID"])
+    elif output_type == "BUFFERS":
+        add_message(" ... buffering partition lines")
+        arcpy.Delete_management(output)
+        arcpy.Buffer_analysis(lines, output, buffer_distance,
+                              dissolve_option = "LIST", dissolve_field = ["FacilityID"])
+
+    # Facility IDs are the object IDs of the facilities, so their
+    # attributes join by field instead of by location.
+    with profiler().stage("attribute_join"):
+        oid_field = arcpy.Describe(facilities).OIDFieldName
+        arcpy.JoinField_management(output, "FacilityID", facilities, oid_field)
+
+
+class _BoundaryProgress(object):
+    # Boundary points found so far, by facility ID, saved to `checkpoint`
+    # as they come in whenever it is due. Points of a resumed run are
+    # loaded from it and carried over to `backend`.
+    def __init__(self, backend, checkpoint = None):
+        self.backend = backend
+        self.checkpoint = checkpoint
+        self.found = {}
+        arrays = checkpoint.load("boundary_points") if checkpoint is not None else None
+        if arrays is not None:
+            points = [tuple(p) for p in arrays["points"].tolist()]
+            for fac_id in arrays["done"].tolist():
+                self.found[fac_id] = []
+            for point, fac_id in zip(points, arrays["owner"].tolist()):
+                self.found[fac_id].append(point)
+            backend.restore_boundary_points(points, arrays)
+            add_message(" ... resuming with the boundary points of {0} facilities"
+                        .format(len(self.found)))
+
+    def add(self, fac_id, points):
+        self.found[fac_id] = list(points)
+        if self.checkpoint is not None and self.checkpoint.due():
+            self.save()
+
+    # Points of facilities `ids`, in that order.
+    def points(self, ids):
+        return [point for fac_id in ids for point in self.found.get(fac_id, [])]
+
+    def save(self):
+        if self.checkpoint is None: return
+        done = list(self.found)
+        points = self.points(done)
+        arrays = {"done": np.array(done, dtype = np.int64),
+                  "points": np.array(points, dtype = np.float64).reshape(-1, 2),
+                  "owner": np.repeat(np.array(done, dtype = np.int64),
+                                     [len(self.found[i]) for i in done])}
+        arrays.update(self.backend.save_boundary_state(points))
+        self.checkpoint.save("boundary_points", arrays)
+
+
+# State of a VORONOI run: the facilities and the labels of the network
+# Voronoi diagram of their partitions.
+def _state(settings, backend, facilities, max_cost):
+    voronoi = backend.voronoi(facilities, max_cost)
+    return RunState(TOOL, settings, {"facility_ids": facilities.ids,
+                                     "facility_xy": facilities.xy,
+                                     "dist": voronoi.dist, "label": voronoi.label})
+
+
+# Update the partitions in `output` of the run saved in `state` for the
+# current facilities: search again the network of removed facilities and
+# the region added ones take over, and replace the partitions of the
+# facilities whose part of the network changed. Returns the new state.
+def _update_partitions(state, backend, fac_points, fac_layer, output, max_cost):
+    arcpy = get_arcpy()
+    a = state.arrays
+    graph = backend.graph
+    diff = FacilityDiff.between(a["facility_ids"], a["facility_xy"],
+                                fac_points.ids, fac_points.xy)
+    add_message(" ...... facilities: " + str(diff))
+    dist, label = a["dist"].copy(), a["label"].copy()
+    if not len(diff):
+        return RunState(TOOL, state.settings, dict(a))
+
+    position = dict((i, p) for p, i in enumerate(fac_points.ids.tolist()))
+    removed = set(diff.removed.tolist())
+    old_to_new = np.array([-1 if i in removed else position.get(i, -1)
+                           for i in a["facility_ids"].tolist()], dtype = np.int64)
+    owned = label >= 0
+    old_label = label.copy()
+    old_label[owned] = old_to_new[label[owned]]
+
+    with profiler().stage("partition") as stage:
+        changed = update_labels(graph, dist, label, old_to_new, graph.snap(fac_points.xy),
+                                [position[i] for i in diff.added.tolist()],
+                                backend.reverse, max_cost)
+        touched = touched_facilities(graph, old_label, label, changed)
+        stage.rows = len(changed)
+
+    with profiler().stage("spatial_join"):
+        partitions = "Partitions"
+        joined = os.path.join(arcpy.env.workspace, "partitions_join")
+        voronoi = NetworkVoronoi(graph, graph.snap(fac_points.xy), backend.reverse,
+                                 max_cost, search = (dist, label))
+        backend.write_partitions(voronoi, fac_points, partitions, touched)
+        arcpy.SpatialJoin_analysis(partitions, fac_layer, joined)
+        ids = set(fac_points.ids[sorted(touched)].tolist()) | removed
+        replace_rows(output, "FacilityID", ids, joined)
+        arcpy.Delete_management(partitions)
+        arcpy.Delete_management(joined)
+
+    return RunState(TOOL, state.settings, {"facility_ids": fac_points.ids,
+                                           "facility_xy": fac_points.xy,
+                                           "dist": dist, "label": label})
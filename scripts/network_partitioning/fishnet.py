@@ -0,0 +1,319 @@
+"""
+Fishnet cells computed on a regular grid with NumPy. Cell centres are
+derived from the zone extent, kept if they fall inside a zone and near a
+street, and only the cells kept are written out. Cells can be split into
+quadrants, level by level, where a finer fishnet is needed, and are
+dissolved by tracing their outlines on the grid.
+"""
+
+import math
+import numpy as np
+
+from ._arcpy import get_arcpy
+from .geometry import grid_cells_in_polygon, grid_outlines, near_segments, points_in_polygon
+from .table import write_points, write_polygons
+
+# Metres per degree of latitude, for distances in geographic coordinates.
+_METERS_PER_DEGREE = 111320.0
+
+
+class Fishnet(object):
+    # Square cells on a grid of side `size` with its first cell centred at
+    # `origin`. `row` and `col` locate each kept cell on the grid of its
+    # `level`, which splits every cell of the level above into four (level
+    # 0 by default), `zone` is the object ID of the zone containing its
+    # centre and `value` its share of the zone's burden. `accept` tells
+    # which cells (centres, zones) may be kept when cells are subdivided.
+    def __init__(self, origin, size, row, col, zone, value, spatial_reference = None,
+                 level = None, accept = None):
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.size = float(size)
+        self.row = np.asarray(row, dtype = np.int64)
+        self.col = np.asarray(col, dtype = np.int64)
+        self.zone = np.asarray(zone, dtype = np.int64)
+        self.value = np.asarray(value, dtype = np.float64)
+        self.spatial_reference = spatial_reference
+        self.level = np.zeros(len(self.row), dtype = np.int64) if level is None else \
+                     np.asarray(level, dtype = np.int64)
+        self.accept = accept
+
+    # Cells covering the extent of `zones` whose centres lie in a zone and
+    # within `near_meters` of `streets`. Every zone's `burden_field` is
+    # shared equally among its cells.
+    @classmethod
+    def from_zones(cls, zones, burden_field, streets, size, near_meters = 200):
+        zone_list, sr, extent, scale = read_zones(zones, burden_field)
+        starts, ends = _segments(streets, sr)
+        return cls.from_geometry(zone_list, starts, ends, extent, size, near_meters,
+                                 scale, sr)
+
+    # Same from arrays: `zones` as (object ID, ring edges (x1, y1, x2, y2),
+    # burden) tuples, street segments from `starts` to `ends`, the extent
+    # (xmin, ymin, xmax, ymax) and the factors taking x and y to metres.
+    @classmethod
+    def from_geometry(cls, zones, starts, ends, extent, size, near_meters = 200,
+                      scale = (1.0, 1.0), spatial_reference = None):
+        xmin, ymin, xmax, ymax = extent
+        size = float(size)
+        num_cols = max(int(math.ceil((xmax - xmin) / size)), 1)
+        num_rows = max(int(math.ceil((ymax - ymin) / size)), 1)
+        x0, y0 = xmin + size / 2, ymin + size / 2
+
+        # Zone membership by scanlines over each zone's rows; the first zone
+        # containing a centre wins where zones overlap.
+        cell_keys, cell_zones = [], []
+        burden = {}
+        for oid, edges, value in zones:
+            burden[oid] = value
+            if len(edges[0]) == 0: continue
+            ys = np.concatenate([edges[1], edges[3]])
+            r_lo = max(int(math.ceil((ys.min() - y0) / size)), 0)
+            r_hi = min(int(math.floor((ys.max() - y0) / size)), num_rows - 1)
+            rows, cols = grid_cells_in_polygon(edges, x0, y0, size,
+                                               np.arange(r_lo, r_hi + 1), num_cols)
+            cell_keys.append(rows * num_cols + cols)
+            cell_zones.append(np.full(len(rows), oid, dtype = np.int64))
+
+        keys = np.concatenate(cell_keys) if cell_keys else np.zeros(0, dtype = np.int64)
+        zone = np.concatenate(cell_zones) if cell_zones else np.zeros(0, dtype = np.int64)
+        keys, first = np.unique(keys, return_index = True)
+        zone = zone[first]
+        row, col = keys // num_cols, keys % num_cols
+
+        # Keep centres near streets, measured in metres.
+        xy = np.column_stack([x0 + col * size, y0 + row * size])
+        accept = _CellFilter(dict((oid, edges) for oid, edges, _ in zones),
+                             starts, ends, near_meters, scale)
+        near = accept.near(xy)
+        row, col, zone = row[near], col[near], zone[near]
+
+        # Share each zone's burden among its cells.
+        zone_ids, inverse, counts = np.unique(zone, return_inverse = True,
+                                              return_counts = True)
+        zone_burden = np.array([burden[z] for z in zone_ids.tolist()], dtype = np.float64)
+        value = (zone_burden / counts)[inverse] if len(zone) else np.zeros(0)
+        return cls((x0, y0), size, row, col, zone, value, spatial_reference,
+                   accept = accept)
+
+    def __len__(self):
+        return len(self.row)
+
+    # Side of every cell.
+    def sizes(self):
+        return self.size / (1 << self.level)
+
+    # Cell centres as an (n, 2) array. Offsets are counted in cells of
+    # level 0 so that their centres are exactly `origin + col * size`.
+    def centroids(self):
+        split = (1 << self.level).astype(np.float64)
+        return np.column_stack([
+            self.origin[0] + ((self.col + 0.5) / split - 0.5) * self.size,
+            self.origin[1] + ((self.row + 0.5) / split - 0.5) * self.size])
+
+    # The cells where `mask` is set.
+    def subset(self, mask):
+        return Fishnet(self.origin, self.size, self.row[mask], self.col[mask],
+                       self.zone[mask], self.value[mask], self.spatial_reference,
+                       self.level[mask], self.accept)
+
+    # Index of the cell containing each point (x, y), -1 for none.
+    def locate(self, xy):
+        xy = np.asarray(xy, dtype = np.float64).reshape(-1, 2)
+        found = np.full(len(xy), -1, dtype = np.int64)
+        corner = np.array(self.origin) - self.size / 2
+        for level in np.unique(self.level).tolist():
+            cells = np.nonzero(self.level == level)[0]
+            keys = (self.row[cells] << 32) + self.col[cells]
+            order = np.argsort(keys)
+            keys, cells = keys[order], cells[order]
+            col, row = np.floor((xy - corner) * (1 << level) / self.size).astype(np.int64).T
+            valid = (row >= 0) & (col >= 0) & (col < 1 << 32)
+            point_keys = np.where(valid, (row << 32) + col, -1)
+            pos = np.minimum(np.searchsorted(keys, point_keys), len(keys) - 1)
+            hit = valid & (keys[pos] == point_keys) & (found < 0)
+            found[hit] = cells[pos[hit]]
+        return found
+
+    # Pairs (i, j) of adjacent cells: j holds the point just across the
+    # middle of a side of i. A cell next to smaller ones sees only the one
+    # at the middle of each side, but each of those sees it.
+    def neighbours(self):
+        if len(self) == 0:
+            empty = np.zeros(0, dtype = np.int64)
+            return empty, empty
+        xy = self.centroids()
+        reach = self.sizes() / 2 + self.size / (1 << (int(self.level.max()) + 2))
+        first, second = [], []
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            j = self.locate(xy + np.column_stack([dx * reach, dy * reach]))
+            i = np.nonzero(j >= 0)[0]
+            first.append(i)
+            second.append(j[i])
+        return np.concatenate(first), np.concatenate(second)
+
+    # Replace the cells where `mask` is set by their four children on the
+    # next level, keeping the children that `accept` keeps. A cell's value
+    # is shared equally among its children kept, which have the same area,
+    # and a cell with none kept stays whole. Cells that stay come first, in
+    # order, then the children. Returns the new fishnet and, for each of
+    # its cells, the index of the cell it comes from and whether it is a
+    # child.
+    def subdivide(self, mask):
+        split = np.nonzero(mask)[0]
+        parent = np.repeat(split, 4)
+        position = np.repeat(np.arange(len(split)), 4)
+        children = Fishnet(self.origin, self.size,
+                           2 * self.row[parent] + np.tile([0, 0, 1, 1], len(split)),
+                           2 * self.col[parent] + np.tile([0, 1, 0, 1], len(split)),
+                           self.zone[parent], np.zeros(len(parent)),
+                           self.spatial_reference, self.level[parent] + 1, self.accept)
+        keep = np.ones(len(parent), dtype = bool)
+        if self.accept is not None and len(parent):
+            keep = self.accept(children.centroids(), children.zone)
+        counts = np.bincount(position[keep], minlength = len(split))
+        children.value = self.value[parent] / np.maximum(counts[position], 1)
+        children = children.subset(keep)
+
+        stay = np.ones(len(self), dtype = bool)
+        stay[split[counts > 0]] = False
+        fishnet = Fishnet(self.origin, self.size,
+                          np.concatenate([self.row[stay], children.row]),
+                          np.concatenate([self.col[stay], children.col]),
+                          np.concatenate([self.zone[stay], children.zone]),
+                          np.concatenate([self.value[stay], children.value]),
+                          self.spatial_reference,
+                          np.concatenate([self.level[stay], children.level]), self.accept)
+        source = np.concatenate([np.nonzero(stay)[0], parent[keep]])
+        is_child = np.arange(len(fishnet)) >= stay.sum()
+        return fishnet, source, is_child
+
+    # Write the cell centres with `ZoneID` and `VALUE` fields to `points_fc`.
+    def write_points(self, points_fc):
+        write_points(points_fc, self.centroids(),
+                     {"ZoneID": self.zone, "VALUE": self.value}, self.spatial_reference)
+
+    # Write the cell squares to `cells_fc`, with attribute `columns` (field
+    # name -> array) if given.
+    def write_cells(self, cells_fc, columns = None):
+        half = self.sizes()[:, None] / 2
+        x, y = self.centroids().T
+        x, y = x[:, None], y[:, None]
+        corners = np.stack([np.hstack([x - half, x - half, x + half, x + half, x - half]),
+                            np.hstack([y - half, y + half, y + half, y - half, y - half])],
+                           axis = 2)
+        write_polygons(cells_fc, ([ring] for ring in corners), columns,
+                       self.spatial_reference)
+
+    # Dissolve the cells by `keys`, one per cell, into polygons in `output`:
+    # one feature per key, with the key in `field` and numeric `columns`
+    # (field name -> {key: value}, null where a key is missing). Outlines
+    # are traced on the grid of the finest level rather than unioned, and
+    # the features are written with one insert cursor. Returns the number
+    # of features.
+    def dissolve(self, output, field, keys, columns = None):
+        keys = np.asarray(keys)
+        columns = columns or {}
+        finest = int(self.level.max()) if len(self) else 0
+        width = 1 << (finest - self.level)
+        labels, outlines = grid_outlines(self.col * width, self.row * width, width, keys)
+        unit = self.size / (1 << finest)
+        corner = np.array(self.origin) - self.size / 2
+
+        values = {field: labels}
+        for column, by_key in columns.items():
+            values[column] = np.array([by_key.get(key, np.nan) for key in labels.tolist()],
+                                      dtype = np.float64)
+        return write_polygons(output, ([corner + ring * unit for ring in rings]
+                                       for rings in outlines),
+                              values, self.spatial_reference)
+
+
+class _CellFilter(object):
+    # The test `Fishnet.from_geometry` keeps cells by: centre within
+    # `near_meters` of a street segment and inside its zone, given as ring
+    # edges by zone object ID.
+    def __init__(self, zone_edges, starts, ends, near_meters, scale):
+        self.zone_edges = zone_edges
+        self.scale = np.asarray(scale, dtype = np.float64)
+        self.starts = np.asarray(starts, dtype = np.float64).reshape(-1, 2) * self.scale
+        self.ends = np.asarray(ends, dtype = np.float64).reshape(-1, 2) * self.scale
+        self.near_meters = near_meters
+
+    def near(self, xy):
+        return near_segments(np.asarray(xy) * self.scale, self.starts, self.ends,
+                             self.near_meters)
+
+    def __call__(self, xy, zone):
+        keep = self.near(xy)
+        for oid in np.unique(zone[keep]).tolist():
+            cells = np.nonzero(keep & (zone == oid))[0]
+            edges = self.zone_edges.get(oid)
+            keep[cells] = points_in_polygon(xy[cells], edges) if edges is not None else False
+        return keep
+
+
+# Zones as `Fishnet.from_geometry` takes them, with their spatial
+# reference, extent (xmin, ymin, xmax, ymax) and metre scale.
+def read_zones(zones, burden_field):
+    arcpy = get_arcpy()
+    desc = arcpy.Describe(zones)
+    sr = desc.spatialReference
+    extent = desc.extent
+    zone_list = []
+    with arcpy.da.SearchCursor(zones, ["OID@", "SHAPE@", burden_field]) as search_rows:
+        for oid, shape, value in search_rows:
+            if shape is None: continue
+            zone_list.append((oid, _ring_edges(shape), value or 0.0))
+    return (zone_list, sr, (extent.XMin, extent.YMin, extent.XMax, extent.YMax),
+            _meter_scale(sr, extent))
+
+
+# Edges (x1, y1, x2, y2) of all rings of a polygon geometry. Rings within a
+# part are separated by None in arcpy's point arrays.
+def _ring_edges(shape):
+    starts, ends = [], []
+    for part in shape:
+        ring = []
+        for point in list(part) + [None]:
+            if point is not None:
+                ring.append((point.X, point.Y))
+                continue
+            if len(ring) > 1:
+                if ring[0] != ring[-1]: ring.append(ring[0])
+                ring = np.array(ring)
+                starts.append(ring[:-1])
+                ends.append(ring[1:])
+            ring = []
+    if not starts:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+# Segments of a polyline feature class as (starts, ends) arrays, in the
+# coordinate system `sr`.
+def _segments(fc, sr):
+    arcpy = get_arcpy()
+    starts, ends = [], []
+    with arcpy.da.SearchCursor(fc, ["SHAPE@"], spatial_reference = sr) as search_rows:
+        for row in search_rows:
+            if row[0] is None: continue
+            for part in row[0]:
+                vertices = np.array([(p.X, p.Y) for p in part if p])
+                if len(vertices) < 2: continue
+                starts.append(vertices[:-1])
+                ends.append(vertices[1:])
+    if not starts:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+# Factors taking x and y coordinates to metres: the linear unit of a
+# projected system, or degrees scaled at the middle latitude of `extent`.
+def _meter_scale(sr, extent):
+    if sr is not None and sr.type == "Geographic":
+        lat = math.radians((extent.YMin + extent.YMax) / 2)
+        return np.array([_METERS_PER_DEGREE * math.cos(lat), _METERS_PER_DEGREE])
+    meters = getattr(sr, "metersPerUnit", None) or 1.0
+    return np.array([meters, meters])
@@ -0,0 +1,219 @@
+"""
+Small planar geometry helpers on NumPy coordinate arrays.
+"""
+
+import numpy as np
+
+
+# Cells of a regular grid whose centres fall inside a polygon given by the
+# edges (x1, y1, x2, y2) of all its rings, by even-odd scanlines. Centres
+# are at `x0 + col * size`, `y0 + row * size` for `rows` (array of row
+# numbers) and columns 0 .. num_cols - 1. Returns (row, col) arrays.
+def grid_cells_in_polygon(edges, x0, y0, size, rows, num_cols, chunk = 1024):
+    x1, y1, x2, y2 = (np.asarray(a, dtype = np.float64) for a in edges)
+    rows = np.asarray(rows, dtype = np.int64)
+    out_rows, out_cols = [], []
+    for start in range(0, len(rows), chunk):
+        r = rows[start:start + chunk]
+        y = y0 + r * size
+        crosses = (y1[None, :] <= y[:, None]) != (y2[None, :] <= y[:, None])
+        ri, ei = np.nonzero(crosses)
+        if len(ri) == 0: continue
+        x = x1[ei] + (y[ri] - y1[ei]) * (x2[ei] - x1[ei]) / (y2[ei] - y1[ei])
+        order = np.lexsort((x, ri))
+        ri, x = ri[order], x[order]
+
+        # Closed rings cross every scanline an even number of times, so
+        # consecutive crossings pair up into inside intervals.
+        lo = np.maximum(np.ceil((x[0::2] - x0) / size), 0).astype(np.int64)
+        hi = np.minimum(np.ceil((x[1::2] - x0) / size) - 1, num_cols - 1).astype(np.int64)
+        length = np.maximum(hi - lo + 1, 0)
+        first = np.repeat(np.cumsum(length) - length, length)
+        out_rows.append(np.repeat(r[ri[0::2]], length))
+        out_cols.append(np.repeat(lo, length) + np.arange(length.sum()) - first)
+    if not out_rows:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    return np.concatenate(out_rows), np.concatenate(out_cols)
+
+
+# Whether each point lies inside a polygon given by the edges (x1, y1, x2,
+# y2) of all its rings, by the even-odd rule: a ray to the right of the
+# point crosses an odd number of edges.
+def points_in_polygon(points, edges, chunk = 1 << 20):
+    points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+    x1, y1, x2, y2 = (np.asarray(a, dtype = np.float64)[None, :] for a in edges)
+    inside = np.zeros(len(points), dtype = bool)
+    if len(points) == 0 or x1.size == 0: return inside
+    step = max(chunk // x1.size, 1)
+    for start in range(0, len(points), step):
+        px = points[start:start + step, 0:1]
+        py = points[start:start + step, 1:2]
+        crosses = (y1 <= py) != (y2 <= py)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + step] = (crosses & (x > px)).sum(axis = 1) % 2 == 1
+    return inside
+
+
+# Whether each point lies within `radius` of any of the segments from
+# `starts` to `ends`. Segments are bucketed on a grid of `radius` cells, so
+# each point is only measured against segments of its own bucket.
+def near_segments(points, starts, ends, radius, chunk = 1 << 20):
+    points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+    starts = np.asarray(starts, dtype = np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype = np.float64).reshape(-1, 2)
+    near = np.zeros(len(points), dtype = bool)
+    if len(points) == 0 or len(starts) == 0: return near
+
+    bucket = radius if radius > 0 else 1.0
+    origin = np.minimum(starts.min(axis = 0), ends.min(axis = 0)) - radius
+    lo = np.floor((np.minimum(starts, ends) - radius - origin) / bucket).astype(np.int64)
+    hi = np.floor((np.maximum(starts, ends) + radius - origin) / bucket).astype(np.int64)
+    span = hi - lo + 1
+    width = int(hi[:, 0].max()) + 2
+
+    # One entry per (bucket, segment) the segment's padded box covers.
+    count = span[:, 0] * span[:, 1]
+    seg = np.repeat(np.arange(len(starts)), count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    keys = (lo[seg, 1] + k // span[seg, 0]) * width + lo[seg, 0] + k % span[seg, 0]
+    order = np.argsort(keys, kind = "stable")
+    keys, seg = keys[order], seg[order]
+
+    cell = np.floor((points - origin) / bucket).astype(np.int64)
+    inside = (cell >= 0).all(axis = 1) & (cell[:, 0] < width)
+    point_keys = np.where(inside, cell[:, 1] * width + cell[:, 0], -1)
+    first = np.searchsorted(keys, point_keys, side = "left")
+    last = np.searchsorted(keys, point_keys, side = "right")
+    num = np.where(inside, last - first, 0)
+
+    # Measure (point, segment) pairs a chunk at a time.
+    ends_at = np.cumsum(num)
+    begin = 0
+    while begin < len(points):
+        base = ends_at[begin - 1] if begin else 0
+        end = max(int(np.searchsorted(ends_at, base + chunk, side = "right")), begin + 1)
+        n = num[begin:end]
+        p = np.repeat(np.arange(begin, end), n)
+        s = seg[np.repeat(first[begin:end], n) + np.arange(n.sum()) -
+                np.repeat(np.cumsum(n) - n, n)]
+        a, d = starts[s], ends[s] - starts[s]
+        length2 = np.maximum((d ** 2).sum(axis = 1), 1e-300)
+        t = np.clip(((points[p] - a) * d).sum(axis = 1) / length2, 0, 1)
+        dist2 = ((a + d * t[:, None] - points[p]) ** 2).sum(axis = 1)
+        near[p[dist2 <= radius * radius]] = True
+        begin = end
+    return near
+
+
+# Cells of a grid of square cells of side `size`, with the lower left
+# corner of cell (0, 0) at `origin`, within `radius` cells of the segments
+# from `starts` to `ends`. Each takes the label of the nearest point of the
+# segments, sampled every half cell; every cell has one label, so the
+# regions of different labels never overlap. Returns the column, row and
+# label of every cell, for `grid_outlines`.
+def label_grid(starts, ends, labels, origin, size, radius = 2):
+    starts = np.asarray(starts, dtype = np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype = np.float64).reshape(-1, 2)
+    labels = np.asarray(labels)
+    if len(starts) == 0:
+        empty = np.zeros(0, dtype = np.int64)
+        return empty, empty, labels[:0]
+
+    # Samples along the segments, in grid units, and the cell they fall in.
+    n = np.ceil(np.hypot(*(ends - starts).T) * 2 / size).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(starts)), n)
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(n) - n, n)) / np.maximum(n[seg] - 1, 1)
+    xy = (starts[seg] + (ends - starts)[seg] * t[:, None] - origin) / size
+    label = labels[seg]
+
+    # Cells around every sample, nearest sample (then smallest label) first.
+    dx, dy = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1))
+    within = dx ** 2 + dy ** 2 <= radius ** 2
+    dx, dy = dx[within], dy[within]
+    col = (np.floor(xy[:, 0]).astype(np.int64)[:, None] + dx).ravel()
+    row = (np.floor(xy[:, 1]).astype(np.int64)[:, None] + dy).ravel()
+    dist = ((col + 0.5 - np.repeat(xy[:, 0], len(dx))) ** 2 +
+            (row + 0.5 - np.repeat(xy[:, 1], len(dx))) ** 2)
+    label = np.repeat(label, len(dx))
+    order = np.lexsort((label, dist, row, col))
+    col, row, label = col[order], row[order], label[order]
+    first = np.ones(len(col), dtype = bool)
+    first[1:] = (col[1:] != col[:-1]) | (row[1:] != row[:-1])
+    return col[first], row[first], label[first]
+
+
+# Directions of the unit edges traced by `grid_outlines`, in clockwise
+# order: up, right, down, left.
+_DX = np.array([0, 1, 0, -1])
+_DY = np.array([1, 0, -1, 0])
+
+
+# Outlines of the regions of equal label on a grid. Cell i is the square of
+# integer side `width[i]` with its lower left corner at (x[i], y[i]); cells
+# do not overlap. Every cell contributes its sides as clockwise unit edges,
+# edges shared by two cells of the same label cancel, and the rest are
+# linked into rings. Returns the sorted labels and, for each, a list of
+# rings as closed (m, 2) integer arrays: outer rings clockwise and holes
+# counterclockwise, without collinear vertices.
+def grid_outlines(x, y, width, labels):
+    x, y, width = (np.asarray(a, dtype = np.int64) for a in (x, y, width))
+    names, label = np.unique(np.asarray(labels), return_inverse = True)
+    label = label.reshape(-1).astype(np.int64)
+    if len(x) == 0:
+        return names, []
+
+    # Unit edges: up the left side, along the top, down the right side and
+    # back along the bottom of every cell.
+    cell = np.repeat(np.arange(len(x)), width)
+    k = np.arange(len(cell)) - np.repeat(np.cumsum(width) - width, width)
+    cx, cy, cw = x[cell], y[cell], width[cell]
+    sx = np.concatenate([cx, cx + k, cx + cw, cx + cw - k])
+    sy = np.concatenate([cy + k, cy + cw, cy + cw - k, cy])
+    d = np.repeat(np.arange(4), len(cell))
+    lab = np.tile(label[cell], 4)
+    ex, ey = sx + _DX[d], sy + _DY[d]
+
+    # Drop edges that two cells of one label share, met once each way.
+    px, py, vertical = np.minimum(sx, ex), np.minimum(sy, ey), d % 2 == 0
+    order = np.lexsort((vertical, px, py, lab))
+    same = (lab[order][1:] == lab[order][:-1]) & (py[order][1:] == py[order][:-1]) & \
+           (px[order][1:] == px[order][:-1]) & (vertical[order][1:] == vertical[order][:-1])
+    shared = np.zeros(len(order), dtype = bool)
+    shared[1:] |= same
+    shared[:-1] |= same
+    keep = np.sort(order[~shared])
+    sx, sy, ex, ey, d, lab = sx[keep], sy[keep], ex[keep], ey[keep], d[keep], lab[keep]
+
+    # Next edge of every edge: the one leaving its end point. Where two
+    # leave (regions touching at a corner), take the right turn, which
+    # keeps to the region's own cells.
+    w = int(max(sx.max(), ex.max())) + 2
+    h = int(max(sy.max(), ey.max())) + 2
+    start_key = (lab * h + sy) * w + sx
+    end_key = (lab * h + ey) * w + ex
+    by_start = np.argsort(start_key, kind = "stable")
+    first = np.searchsorted(start_key[by_start], end_key, side = "left")
+    nxt = by_start[first]
+    second = by_start[np.minimum(first + 1, len(by_start) - 1)]
+    two = (first + 1 < len(by_start)) & (start_key[second] == end_key)
+    right = (d + 1) % 4
+    nxt = np.where(two & (d[second] == right), second, nxt)
+
+    # Walk the rings, keeping the vertices where the direction turns.
+    outlines = [[] for _ in range(len(names))]
+    visited = np.zeros(len(d), dtype = bool)
+    nxt, dl = nxt.tolist(), d.tolist()
+    for e in range(len(dl)):
+        if visited[e]: continue
+        ring, i = [], e
+        while not visited[i]:
+            visited[i] = True
+            ring.append(i)
+            i = nxt[i]
+        ring = np.array(ring)
+        turn = d[ring] != np.roll(d[ring], 1)
+        ring = ring[turn]
+        vertices = np.column_stack([sx[ring], sy[ring]])
+        outlines[lab[e]].append(np.vstack([vertices, vertices[:1]]))
+    return names, outlines
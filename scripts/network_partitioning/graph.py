@@ -0,0 +1,315 @@
+"""
+In-process street network graph. The network is loaded once into compressed
+sparse-row (CSR) adjacency arrays and searched with Dijkstra, so distances can
+be computed without a Network Analyst solve.
+"""
+
+import heapq
+import numpy as np
+
+from ._arcpy import get_arcpy
+
+INF = float("inf")
+
+_ONEWAY_VALUES = ("Y", "YES", "FT", "T", "TRUE", "1")
+
+
+class Graph(object):
+    # Every vertex of the input polylines is a node and every segment is an
+    # edge, so positions along an edge are a straight interpolation.
+    def __init__(self, node_xy, edge_u, edge_v, edge_cost, oneway = None,
+                 spatial_reference = None):
+        self.node_xy = np.asarray(node_xy, dtype = np.float64).reshape(-1, 2)
+        self.edge_u = np.asarray(edge_u, dtype = np.int64)
+        self.edge_v = np.asarray(edge_v, dtype = np.int64)
+        self.edge_cost = np.asarray(edge_cost, dtype = np.float64)
+        if oneway is None:
+            oneway = np.zeros(len(self.edge_u), dtype = bool)
+        self.oneway = np.asarray(oneway, dtype = bool)
+        # Well-known text of the coordinate system, if known.
+        self.spatial_reference = spatial_reference
+        self._csr = {}
+        self._adjacency_lists = {}
+        self._snap_grid = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_xy)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_u)
+
+    # Build a graph from polylines given as sequences of (x, y) vertices.
+    # The cost of a line is spread over its segments by length; without
+    # costs, the segment length is used.
+    @classmethod
+    def from_polylines(cls, lines, costs = None, oneway = None,
+                       tolerance = 1e-9, spatial_reference = None):
+        seg_start, seg_end, seg_cost, seg_oneway = [], [], [], []
+        for i, line in enumerate(lines):
+            line = np.asarray(line, dtype = np.float64).reshape(-1, 2)
+            if len(line) < 2: continue
+            lengths = np.hypot(*(line[1:] - line[:-1]).T)
+            if costs is None:
+                line_cost = lengths
+            elif lengths.sum() > 0:
+                line_cost = costs[i] * lengths / lengths.sum()
+            else:
+                line_cost = np.full(len(lengths), costs[i] / len(lengths))
+            seg_start.append(line[:-1])
+            seg_end.append(line[1:])
+            seg_cost.append(line_cost)
+            seg_oneway.append(np.full(len(lengths),
+                              bool(oneway[i]) if oneway is not None else False))
+
+        if not seg_start:
+            raise ValueError("No polylines to build a network from.")
+        seg_start = np.concatenate(seg_start)
+        seg_end = np.concatenate(seg_end)
+        num_seg = len(seg_start)
+
+        # Merge vertices with equal coordinates into one node.
+        keys = np.round(np.concatenate([seg_start, seg_end]) / tolerance)
+        _, first, inverse = np.unique(keys, axis = 0,
+                                      return_index = True, return_inverse = True)
+        inverse = inverse.ravel()
+        node_xy = np.concatenate([seg_start, seg_end])[first]
+        edge_u, edge_v = inverse[:num_seg], inverse[num_seg:]
+
+        keep = edge_u != edge_v
+        return cls(node_xy, edge_u[keep], edge_v[keep],
+                   np.concatenate(seg_cost)[keep],
+                   np.concatenate(seg_oneway)[keep],
+                   spatial_reference = spatial_reference)
+
+    # Build a graph from a polyline feature class. Uses the shape length as
+    # cost unless a cost field is given.
+    @classmethod
+    def from_feature_class(cls, fc, cost_field = None, oneway_field = None):
+        arcpy = get_arcpy()
+        fields = ["SHAPE@"]
+        if cost_field: fields.append(cost_field)
+        if oneway_field: fields.append(oneway_field)
+
+        lines, costs, oneway = [], [], []
+        with arcpy.da.SearchCursor(fc, fields) as search_rows:
+            for row in search_rows:
+                shape = row[0]
+                if shape is None or shape.length == 0: continue
+                for part in shape:
+                    vertices = np.array([(p.X, p.Y) for p in part if p])
+                    part_length = np.hypot(*(vertices[1:] - vertices[:-1]).T).sum()
+                    lines.append(vertices)
+                    if cost_field:
+                        costs.append(row[1] * part_length / shape.length)
+                    else:
+                        costs.append(part_length)
+                    oneway.append(oneway_field is not None and
+                                  str(row[-1]).upper() in _ONEWAY_VALUES)
+
+        sr = arcpy.Describe(fc).spatialReference
+        return cls.from_polylines(lines, costs, oneway,
+                                  spatial_reference = sr.exportToString())
+
+    # Save the graph arrays to a .npz file.
+    def save(self, path):
+        np.savez(path, node_xy = self.node_xy, edge_u = self.edge_u,
+                 edge_v = self.edge_v, edge_cost = self.edge_cost,
+                 oneway = self.oneway,
+                 spatial_reference = np.array(self.spatial_reference or ""))
+
+    # Load a graph saved with `save`.
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            sr = str(data["spatial_reference"]) or None
+            return cls(data["node_xy"], data["edge_u"], data["edge_v"],
+                       data["edge_cost"], data["oneway"], spatial_reference = sr)
+
+    # CSR adjacency (indptr, heads, costs, arc_edge) for travelling along
+    # the edges, or against them when `reverse` is set.
+    def csr(self, reverse = False):
+        if reverse not in self._csr:
+            both = np.nonzero(~self.oneway)[0]
+            tail = np.concatenate([self.edge_u, self.edge_v[both]])
+            head = np.concatenate([self.edge_v, self.edge_u[both]])
+            arc_edge = np.concatenate([np.arange(self.num_edges), both])
+            if reverse: tail, head = head, tail
+
+            order = np.argsort(tail, kind = "stable")
+            indptr = np.zeros(self.num_nodes + 1, dtype = np.int64)
+            np.cumsum(np.bincount(tail, minlength = self.num_nodes),
+                      out = indptr[1:])
+            self._csr[reverse] = (indptr, head[order],
+                                  self.edge_cost[arc_edge[order]],
+                                  arc_edge[order])
+        return self._csr[reverse]
+
+    # The CSR arrays as Python lists, which are much faster to index one
+    # element at a time inside the search loops.
+    def _adjacency(self, reverse):
+        if reverse not in self._adjacency_lists:
+            indptr, heads, costs, arc_edge = self.csr(reverse)
+            self._adjacency_lists[reverse] = (indptr.tolist(), heads.tolist(),
+                                              costs.tolist(), arc_edge.tolist())
+        return self._adjacency_lists[reverse]
+
+    # Multi-source Dijkstra. Returns the cost to the nearest source and the
+    # index (into `sources`) of that source for every node; -1 if unreached.
+    def dijkstra(self, sources, reverse = False, max_cost = INF,
+                 blocked_edges = None):
+        indptr, heads, costs, arc_edge = self._adjacency(reverse)
+        dist = [INF] * self.num_nodes
+        label = [-1] * self.num_nodes
+        blocked = blocked_edges or ()
+
+        heap = [(0.0, int(node), i) for i, node in enumerate(sources)]
+        heapq.heapify(heap)
+        while heap:
+            d, u, s = heapq.heappop(heap)
+            if label[u] != -1: continue
+            dist[u] = d
+            label[u] = s
+            for a in range(indptr[u], indptr[u + 1]):
+                v = heads[a]
+                nd = d + costs[a]
+                if label[v] != -1 or nd > max_cost or nd >= dist[v]: continue
+                if blocked and arc_edge[a] in blocked: continue
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v, s))
+
+        return np.array(dist), np.array(label, dtype = np.int64)
+
+    # Continue the search of `dijkstra` from `seeds`, (cost, node, label)
+    # tuples, on its `dist` and `label` arrays, which are updated in place.
+    # Only nodes the seeds reach at a lower cost change, so a new source
+    # costs a search of the region it takes over. Returns the changed nodes.
+    def improve(self, dist, label, seeds, reverse = False, max_cost = INF):
+        indptr, heads, costs, arc_edge = self._adjacency(reverse)
+        node_dist = dist.tolist()
+        node_label = label.tolist()
+
+        heap = []
+        for d, node, s in seeds:
+            node = int(node)
+            if d < node_dist[node] and d <= max_cost:
+                node_dist[node] = d
+                node_label[node] = int(s)
+                heap.append((d, node, int(s)))
+        heapq.heapify(heap)
+        changed = set()
+        while heap:
+            d, u, s = heapq.heappop(heap)
+            if d > node_dist[u]: continue
+            changed.add(u)
+            for a in range(indptr[u], indptr[u + 1]):
+                v = heads[a]
+                nd = d + costs[a]
+                if nd < node_dist[v] and nd <= max_cost:
+                    node_dist[v] = nd
+                    node_label[v] = s
+                    heapq.heappush(heap, (nd, v, s))
+
+        dist[:] = node_dist
+        label[:] = node_label
+        return np.array(sorted(changed), dtype = np.int64)
+
+    # k-nearest sources for every node in one batched search: a node is
+    # settled once per distinct source, up to `k` times. Returns (n, k)
+    # arrays of costs and source indices, sorted by cost, padded with
+    # inf / -1.
+    def k_nearest(self, sources, k, reverse = False, max_cost = INF):
+        indptr, heads, costs, arc_edge = self._adjacency(reverse)
+        found = [[] for _ in range(self.num_nodes)]
+        found_cost = [[] for _ in range(self.num_nodes)]
+
+        heap = [(0.0, int(node), i) for i, node in enumerate(sources)]
+        heapq.heapify(heap)
+        while heap:
+            d, u, s = heapq.heappop(heap)
+            settled = found[u]
+            if len(settled) >= k or s in settled: continue
+            settled.append(s)
+            found_cost[u].append(d)
+            for a in range(indptr[u], indptr[u + 1]):
+                v = heads[a]
+                nd = d + costs[a]
+                if nd > max_cost: continue
+                other = found[v]
+                if len(other) < k and s not in other:
+                    heapq.heappush(heap, (nd, v, s))
+
+        dist = np.full((self.num_nodes, k), INF)
+        label = np.full((self.num_nodes, k), -1, dtype = np.int64)
+        for u in range(self.num_nodes):
+            n = len(found[u])
+            if n:
+                dist[u, :n] = found_cost[u]
+                label[u, :n] = found[u]
+        return dist, label
+
+    # Position at fraction `t` along each edge.
+    def edge_point(self, edges, t):
+        start = self.node_xy[self.edge_u[edges]]
+        end = self.node_xy[self.edge_v[edges]]
+        return start + (end - start) * np.asarray(t, dtype = np.float64)[..., None]
+
+    # Index of the nearest node for every point, using a uniform grid over
+    # the nodes.
+    def snap(self, xy):
+        xy = np.asarray(xy, dtype = np.float64).reshape(-1, 2)
+        origin, size, shape, order, cells = self._grid()
+        node_xy = self.node_xy
+        cell_xy = np.floor((xy - origin) / size).astype(np.int64)
+
+        nearest = np.empty(len(xy), dtype = np.int64)
+        for i, (cx, cy) in enumerate(cell_xy):
+            best, best_dist = -1, INF
+            outside = max(-cx, cx - shape[0] + 1, -cy, cy - shape[1] + 1, 0)
+            for ring in range(int(max(shape) + outside) + 1):
+                for key in _ring_cells(cx, cy, ring, shape):
+                    span = cells.get(key)
+                    if span is None: continue
+                    candidates = order[span[0]:span[1]]
+                    d = np.hypot(*(node_xy[candidates] - xy[i]).T)
+                    j = int(np.argmin(d))
+                    if d[j] < best_dist:
+                        best, best_dist = int(candidates[j]), d[j]
+                if best != -1 and best_dist <= ring * size:
+                    break
+            nearest[i] = best
+        return nearest
+
+    # Lazily build the snapping grid: nodes sorted by cell, with the span
+    # of every non-empty cell in the sorted order.
+    def _grid(self):
+        if self._snap_grid is None:
+            lower = self.node_xy.min(axis = 0)
+            extent = max(float((self.node_xy.max(axis = 0) - lower).max()), 1e-12)
+            size = extent / max(1.0, np.sqrt(self.num_nodes / 4.0))
+            node_cells = np.floor((self.node_xy - lower) / size).astype(np.int64)
+            shape = tuple(node_cells.max(axis = 0) + 1)
+            keys = node_cells[:, 0] * shape[1] + node_cells[:, 1]
+            order = np.argsort(keys, kind = "stable")
+            uniq, start, count = np.unique(keys[order], return_index = True,
+                                           return_counts = True)
+            cells = {(int(k) // shape[1], int(k) % shape[1]): (s, s + c)
+                     for k, s, c in zip(uniq, start, count)}
+            self._snap_grid = (lower, size, shape, order, cells)
+        return self._snap_grid
+
+
+# Grid cells at Chebyshev distance `ring` from (cx, cy), inside the grid.
+def _ring_cells(cx, cy, ring, shape):
+    if ring == 0:
+        return [(cx, cy)]
+    keys = []
+    for x in range(cx - ring, cx + ring + 1):
+        if x < 0 or x >= shape[0]: continue
+        if x in (cx - ring, cx + ring):
+            ys = range(cy - ring, cy + ring + 1)
+        else:
+            ys = (cy - ring, cy + ring)
+        keys.extend((x, y) for y in ys if 0 <= y < shape[1])
+    return keys
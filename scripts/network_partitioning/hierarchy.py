@@ -0,0 +1,344 @@
+"""
+Contraction hierarchy of a street network graph, built once and saved with
+the graph. Queries search upward from the sources only, then sweep down
+the hierarchy level by level with NumPy, restricted to the part of it
+above the targets, so repeated cost lookups skip most of the network.
+"""
+
+import heapq
+import numpy as np
+
+from ._arcpy import add_message
+from .graph import Graph, INF
+
+# Prefix of the hierarchy's arrays in a saved graph file.
+_PREFIX = "ch_"
+
+
+class ContractionHierarchy(object):
+    # Arcs of a graph whose nodes were contracted in `rank` order, with the
+    # shortcuts this added, as CSR arrays (indptr, heads, costs): `up` from
+    # every node to higher ranked ones, `down` into every node from higher
+    # ranked ones (the heads are the tails of the arcs). `level` is the
+    # depth of a node below the top of the hierarchy, which orders the
+    # sweeps.
+    def __init__(self, rank, level, up, down):
+        self.rank = np.asarray(rank, dtype = np.int64)
+        self.level = np.asarray(level, dtype = np.int64)
+        self.up = tuple(np.asarray(a) for a in up)
+        self.down = tuple(np.asarray(a) for a in down)
+        self._lists = {}
+        self._sweeps = {}
+
+    @property
+    def num_nodes(self):
+        return len(self.rank)
+
+    @property
+    def num_arcs(self):
+        return len(self.up[1]) + len(self.down[1])
+
+    # Contract the nodes of `graph`, least important first: the one whose
+    # contraction adds the fewest shortcuts for the arcs it removes. A
+    # shortcut u -> w replaces u -> v -> w unless a search from u that
+    # avoids v and settles at most `settle_limit` nodes finds a path no
+    # longer.
+    @classmethod
+    def build(cls, graph, settle_limit = 64):
+        n = graph.num_nodes
+        indptr, heads, costs, _ = graph.csr()
+        tails = np.repeat(np.arange(n), np.diff(indptr))
+        out = [dict() for _ in range(n)]
+        inc = [dict() for _ in range(n)]
+        for u, v, c in zip(tails.tolist(), heads.tolist(), costs.tolist()):
+            if u != v and c < out[u].get(v, INF):
+                out[u][v] = c
+                inc[v][u] = c
+
+        def witness(source, skip, limit, targets, settle_limit):
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            left = set(targets)
+            while heap and left and settled < settle_limit:
+                d, u = heapq.heappop(heap)
+                if d > dist.get(u, INF): continue
+                if d > limit: break
+                left.discard(u)
+                settled += 1
+                for v, c in out[u].items():
+                    nd = d + c
+                    if v != skip and nd < dist.get(v, INF):
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+            return dist
+
+        def shortcuts(v, settle_limit = settle_limit):
+            found = []
+            for u, cu in inc[v].items():
+                targets = dict((w, cu + cw) for w, cw in out[v].items() if w != u)
+                if not targets: continue
+                dist = witness(u, v, max(targets.values()), targets, settle_limit)
+                found.extend((u, w, c) for w, c in targets.items() if dist.get(w, INF) > c)
+            return found
+
+        # Priority: shortcuts added less arcs removed, counted with shorter
+        # witness searches, plus the contracted neighbours and the depth
+        # below them, which spread contraction evenly over the network.
+        estimate_limit = max(settle_limit // 4, 1)
+        deleted = [0] * n
+        depth = [0] * n
+        def priority(v):
+            edge_difference = len(shortcuts(v, estimate_limit)) - len(inc[v]) - len(out[v])
+            return 2 * edge_difference + deleted[v] + depth[v]
+
+        current = [priority(v) for v in range(n)]
+        heap = [(p, v) for v, p in enumerate(current)]
+        heapq.heapify(heap)
+        rank = np.full(n, -1, dtype = np.int64)
+        up, down = [None] * n, [None] * n
+        next_rank = 0
+        while heap:
+            p, v = heapq.heappop(heap)
+            if rank[v] >= 0 or p != current[v]: continue
+            current[v] = p = priority(v)
+            if heap and p > heap[0][0]:
+                heapq.heappush(heap, (p, v))
+                continue
+            found = shortcuts(v)
+            rank[v] = next_rank
+            next_rank += 1
+            up[v], down[v] = out[v], inc[v]
+            neighbours = set(inc[v]) | set(out[v])
+            for u in inc[v]:
+                del out[u][v]
+            for w in out[v]:
+                del inc[w][v]
+            for u, w, c in found:
+                if c < out[u].get(w, INF):
+                    out[u][w] = c
+                    inc[w][u] = c
+            out[v], inc[v] = {}, {}
+            # Only the cheap terms of the neighbours change here; their
+            # shortcuts are counted again when they come up.
+            for u in neighbours:
+                raised = max(depth[u], depth[v] + 1) - depth[u] + 1
+                deleted[u] += 1
+                depth[u] += raised - 1
+                current[u] += raised
+                heapq.heappush(heap, (current[u], u))
+
+        # Levels from the top: below every higher ranked neighbour.
+        level = np.zeros(n, dtype = np.int64)
+        node_level = level.tolist()
+        for v in np.argsort(-rank).tolist():
+            above = [node_level[u] + 1 for u in up[v]] + [node_level[u] + 1 for u in down[v]]
+            node_level[v] = max(above) if above else 0
+        level[:] = node_level
+        return cls(rank, level, _csr(up), _csr(down))
+
+    # Save the hierarchy into the .npz file of `graph`.
+    def save(self, path, graph):
+        arrays = {"node_xy": graph.node_xy, "edge_u": graph.edge_u,
+                  "edge_v": graph.edge_v, "edge_cost": graph.edge_cost,
+                  "oneway": graph.oneway,
+                  "spatial_reference": np.array(graph.spatial_reference or "")}
+        for name, value in (("rank", self.rank), ("level", self.level)):
+            arrays[_PREFIX + name] = value
+        for side, csr in (("up", self.up), ("down", self.down)):
+            for name, value in zip(("indptr", "heads", "costs"), csr):
+                arrays[_PREFIX + side + "_" + name] = value
+        np.savez(path, **arrays)
+
+    # The hierarchy saved in a graph file, or None if it has none.
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if _PREFIX + "rank" not in data.files: return None
+            def csr(side):
+                return tuple(data[_PREFIX + side + "_" + name]
+                             for name in ("indptr", "heads", "costs"))
+            return cls(data[_PREFIX + "rank"], data[_PREFIX + "level"],
+                       csr("up"), csr("down"))
+
+    # Cost from the nearest of `sources` (node indices) to every node, and
+    # the index of that source, -1 if unreached; costs to the sources with
+    # `reverse`. Same as `Graph.dijkstra`, with ties broken either way.
+    def one_to_all(self, sources, reverse = False, max_cost = INF):
+        dist = np.full(self.num_nodes, INF)
+        label = np.full(self.num_nodes, -1, dtype = np.int64)
+        nodes, costs, labels = self._upward(sources, reverse, max_cost)
+        order = np.lexsort((costs, nodes))
+        first = np.ones(len(order), dtype = bool)
+        first[1:] = nodes[order][1:] != nodes[order][:-1]
+        dist[nodes[order][first]] = costs[order][first]
+        label[nodes[order][first]] = labels[order][first]
+
+        for heads, tails, costs, starts in self._sweep(reverse):
+            cand = dist[tails] + costs
+            best = np.minimum.reduceat(cand, starts)
+            group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(cand))))
+            improve = best < dist[heads[starts]]
+            hit = improve[group] & (cand == best[group])
+            dist[heads[starts][improve]] = best[improve]
+            label[heads[hit]] = label[tails[hit]]
+        unreached = dist > max_cost
+        dist[unreached] = INF
+        label[unreached] = -1
+        return dist, label
+
+    # The `k` nearest of `sources` to every node of `targets`, as (targets,
+    # k) arrays of costs and source indices sorted by cost, padded with inf
+    # / -1; costs to the sources with `reverse`. Same as `Graph.k_nearest`
+    # at the target nodes. Every node keeps its `k` best (cost, source)
+    # pairs, up the hierarchy and down the sweep: a source that `k` others
+    # beat at a node cannot be among the `k` nearest through it.
+    def k_nearest(self, sources, targets, k, reverse = False, max_cost = INF):
+        targets = np.asarray(targets, dtype = np.int64)
+        sweep, index = self._restricted(targets, reverse)
+        position = np.full(self.num_nodes, -1, dtype = np.int64)
+        position[index] = np.arange(len(index))
+
+        dist = np.full((len(index), k), INF)
+        label = np.full((len(index), k), -1, dtype = np.int64)
+        nodes, costs, labels = self._upward(sources, reverse, max_cost, k)
+        keep = position[nodes] >= 0
+        nodes, costs, labels = position[nodes[keep]], costs[keep], labels[keep]
+        order = np.lexsort((costs, nodes))
+        nodes, costs, labels = nodes[order], costs[order], labels[order]
+        slot = np.arange(len(nodes)) - np.searchsorted(nodes, nodes)
+        dist[nodes, slot], label[nodes, slot] = costs, labels
+
+        for heads, tails, costs, starts in sweep:
+            rows = heads[starts]
+            num_arcs, num_rows = len(heads), len(rows)
+            node = np.concatenate([np.repeat(heads, k), np.repeat(rows, k)])
+            cost = np.concatenate([(dist[tails] + costs[:, None]).ravel(), dist[rows].ravel()])
+            source = np.concatenate([label[tails].ravel(), label[rows].ravel()])
+            found = (source >= 0) & (cost <= max_cost)
+            node, cost, source = node[found], cost[found], source[found]
+
+            # Best cost per (node, source), then the k best per node.
+            order = np.lexsort((cost, source, node))
+            node, cost, source = node[order], cost[order], source[order]
+            first = np.ones(len(node), dtype = bool)
+            first[1:] = (node[1:] != node[:-1]) | (source[1:] != source[:-1])
+            node, cost, source = node[first], cost[first], source[first]
+            order = np.lexsort((cost, node))
+            node, cost, source = node[order], cost[order], source[order]
+            slot = np.arange(len(node)) - np.searchsorted(node, node)
+            top = slot < k
+            dist[rows], label[rows] = INF, -1
+            dist[node[top], slot[top]] = cost[top]
+            label[node[top], slot[top]] = source[top]
+
+        return dist[position[targets]], label[position[targets]]
+
+    # Upward Dijkstra from every source at once, each node settled once
+    # for each of its `k` nearest sources. Returns the (node, cost, source
+    # index) entries settled.
+    def _upward(self, sources, reverse, max_cost, k = 1):
+        indptr, heads, costs = self._lists_for(reverse)
+        heap = [(0.0, int(node), i) for i, node in enumerate(sources)]
+        heapq.heapify(heap)
+        found = {}
+        nodes, dists, labels = [], [], []
+        while heap:
+            d, u, s = heapq.heappop(heap)
+            settled = found.setdefault(u, [])
+            if len(settled) >= k or s in settled: continue
+            settled.append(s)
+            nodes.append(u)
+            dists.append(d)
+            labels.append(s)
+            for a in range(indptr[u], indptr[u + 1]):
+                nd = d + costs[a]
+                if nd > max_cost: continue
+                other = found.get(heads[a])
+                if other is None or (len(other) < k and s not in other):
+                    heapq.heappush(heap, (nd, heads[a], s))
+        return (np.array(nodes, dtype = np.int64), np.array(dists),
+                np.array(labels, dtype = np.int64))
+
+    # The upward arcs searched from the sources as Python lists: `up`, or
+    # `down` against the arcs with `reverse`.
+    def _lists_for(self, reverse):
+        if reverse not in self._lists:
+            indptr, heads, costs = self.down if reverse else self.up
+            self._lists[reverse] = (indptr.tolist(), heads.tolist(), costs.tolist())
+        return self._lists[reverse]
+
+    # Steps of the sweep down the hierarchy, one per level from the top:
+    # (heads, tails, costs, starts) of the arcs into the nodes of the
+    # level, grouped by head with `starts` the first arc of every group.
+    def _sweep(self, reverse, mask = None):
+        key = reverse if mask is None else None
+        if key is not None and key in self._sweeps:
+            return self._sweeps[key]
+        indptr, tails, costs = self.up if reverse else self.down
+        heads = np.repeat(np.arange(self.num_nodes), np.diff(indptr))
+        if mask is not None:
+            keep = mask[heads]
+            heads, tails, costs = heads[keep], tails[keep], costs[keep]
+        order = np.lexsort((heads, self.level[heads]))
+        heads, tails, costs = heads[order], tails[order], costs[order]
+        levels = self.level[heads]
+        steps = []
+        bounds = np.flatnonzero(np.diff(levels)) + 1
+        for lo, hi in zip(np.append(0, bounds).tolist(), np.append(bounds, len(heads)).tolist()):
+            h = heads[lo:hi]
+            starts = np.append(0, np.flatnonzero(np.diff(h)) + 1)
+            steps.append((h, tails[lo:hi], costs[lo:hi], starts))
+        if key is not None: self._sweeps[key] = steps
+        return steps
+
+    # The sweep restricted to the nodes that the costs at `targets` depend
+    # on, renumbered by their position in the returned node index.
+    def _restricted(self, targets, reverse):
+        indptr, tails, _ = self.up if reverse else self.down
+        needed = np.zeros(self.num_nodes, dtype = bool)
+        needed[targets] = True
+        heads = np.repeat(np.arange(self.num_nodes), np.diff(indptr))
+        order = np.argsort(-self.level[heads], kind = "stable")
+        heads, arc_tails = heads[order], tails[order]
+        levels = self.level[heads]
+        bounds = np.flatnonzero(np.diff(levels)) + 1
+        for lo, hi in zip(np.append(0, bounds).tolist(), np.append(bounds, len(heads)).tolist()):
+            hit = needed[heads[lo:hi]]
+            needed[arc_tails[lo:hi][hit]] = True
+
+        index = np.flatnonzero(needed)
+        position = np.full(self.num_nodes, -1, dtype = np.int64)
+        position[index] = np.arange(len(index))
+        steps = [(position[h], position[t], c, s)
+                 for h, t, c, s in self._sweep(reverse, needed)]
+        return steps, index
+
+
+# Build the contraction hierarchy of a street network, a polyline feature
+# class (cost = length, or `cost_field`) or a graph saved as .npz, and save
+# graph and hierarchy to `output` (.npz), to give as `network` to the GRAPH
+# engine.
+def build_index(source, output, cost_field = None, oneway_field = None):
+    add_message(" ... loading network graph")
+    if str(source).lower().endswith(".npz"):
+        graph = Graph.load(source)
+    else:
+        graph = Graph.from_feature_class(source, cost_field, oneway_field)
+    add_message(" ... contracting {0} nodes".format(graph.num_nodes))
+    hierarchy = ContractionHierarchy.build(graph)
+    add_message(" ...... {0} arcs, {1} levels".format(hierarchy.num_arcs,
+                                                     int(hierarchy.level.max()) + 1))
+    hierarchy.save(output, graph)
+    return hierarchy
+
+
+# CSR arrays (indptr, heads, costs) of per-node {head: cost} dicts.
+def _csr(arcs):
+    counts = np.array([len(a) for a in arcs], dtype = np.int64)
+    indptr = np.zeros(len(arcs) + 1, dtype = np.int64)
+    np.cumsum(counts, out = indptr[1:])
+    heads = np.fromiter((v for a in arcs for v in a), dtype = np.int64, count = int(counts.sum()))
+    costs = np.fromiter((c for a in arcs for c in a.values()), dtype = np.float64,
+                        count = int(counts.sum()))
+    return indptr, heads, costs
@@ -0,0 +1,222 @@
+"""
+Incremental re-partitioning. A run saves its state (facilities, candidate
+matrix and assignment, or network labels) to a folder. A later run compares
+the current facilities with it and only recomputes what the added, removed
+or resized facilities touch, then replaces their partitions in the output.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from ._arcpy import get_arcpy
+from .candidates import CandidateMatrix
+from .graph import INF
+
+_STATE_FILE = "state.json"
+_ARRAYS_FILE = "arrays.npz"
+
+
+class FacilityDiff(object):
+    # IDs of the facilities added, removed and resized (capacity changed)
+    # between two runs. A facility that moved counts as removed and added.
+    def __init__(self, added, removed, resized):
+        self.added = np.asarray(added, dtype = np.int64)
+        self.removed = np.asarray(removed, dtype = np.int64)
+        self.resized = np.asarray(resized, dtype = np.int64)
+
+    # Compare the (IDs, coordinates, capacities) of the previous facilities
+    # with the current ones; capacities may be None.
+    @classmethod
+    def between(cls, old_ids, old_xy, new_ids, new_xy, old_capacity = None,
+                new_capacity = None):
+        old_ids = np.asarray(old_ids, dtype = np.int64)
+        new_ids = np.asarray(new_ids, dtype = np.int64)
+        old_pos = dict((i, p) for p, i in enumerate(old_ids.tolist()))
+        added, removed, resized = [], [], []
+        kept = set()
+        for p, i in enumerate(new_ids.tolist()):
+            q = old_pos.get(i)
+            if q is None or not np.allclose(old_xy[q], new_xy[p]):
+                added.append(i)
+                if q is not None: removed.append(i)
+                continue
+            kept.add(i)
+            if old_capacity is not None and old_capacity[q] != new_capacity[p]:
+                resized.append(i)
+        removed.extend(i for i in old_ids.tolist() if i not in kept and i not in added)
+        return cls(added, sorted(removed), resized)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.resized)
+
+    def __str__(self):
+        return "{0} added, {1} removed, {2} resized".format(
+            len(self.added), len(self.removed), len(self.resized))
+
+
+class RunState(object):
+    # What a run leaves for the next one: `settings` that must match for an
+    # incremental update (JSON values) and NumPy `arrays`.
+    def __init__(self, tool, settings, arrays):
+        self.tool = tool
+        self.settings = settings
+        self.arrays = arrays
+
+    # Write the state to `folder`, replacing any state there. The files are
+    # written to a scratch folder first, so that a half-written state is
+    # never loaded.
+    def save(self, folder):
+        parent = os.path.dirname(os.path.abspath(folder))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        scratch = tempfile.mkdtemp(dir = parent, prefix = ".tmp")
+        np.savez(os.path.join(scratch, _ARRAYS_FILE), **self.arrays)
+        with open(os.path.join(scratch, _STATE_FILE), "w") as f:
+            json.dump({"tool": self.tool, "settings": self.settings}, f, indent = 2)
+        shutil.rmtree(folder, ignore_errors = True)
+        os.rename(scratch, folder)
+
+    # The state saved in `folder` by `tool`, or None.
+    @classmethod
+    def load(cls, folder, tool):
+        try:
+            with open(os.path.join(folder, _STATE_FILE)) as f:
+                header = json.load(f)
+            with np.load(os.path.join(folder, _ARRAYS_FILE)) as data:
+                arrays = dict((name, data[name]) for name in data.files)
+        except (IOError, OSError, ValueError):
+            return None
+        if header.get("tool") != tool: return None
+        return cls(tool, header["settings"], arrays)
+
+    # True if the state was saved with these `settings`.
+    def matches(self, settings):
+        return self.settings == json.loads(json.dumps(settings))
+
+
+# Candidate matrix for the facilities `fac_ids`, patched from `matrix` of
+# the previous run. Candidates of `removed` facilities are dropped; the
+# `added` rows (cell index, facility ID, cost) are inserted where they are
+# no farther than the last candidate the cell had, or anywhere in a list
+# that held every reachable facility, so that every list is still a prefix
+# of the cell's closest facilities. Returns the matrix and a mask of the
+# cells whose lists changed.
+def patch_matrix(matrix, fac_ids, removed, added, num_to_find):
+    cells = matrix.row_cells()
+    row_ids = matrix.fac_ids[matrix.fac]
+    dropped = np.isin(row_ids, removed)
+
+    add_cells, add_ids, add_costs = added
+    add_cells = np.asarray(add_cells, dtype = np.int64)
+    threshold = insert_threshold(matrix, num_to_find)
+    keep = np.asarray(add_costs) <= threshold[add_cells]
+    add_cells = add_cells[keep]
+
+    changed = np.zeros(matrix.num_cells, dtype = bool)
+    changed[cells[dropped]] = True
+    changed[add_cells] = True
+    patched = CandidateMatrix.from_triples(
+        matrix.cell_ids, fac_ids,
+        np.concatenate([matrix.cell_ids[cells[~dropped]], matrix.cell_ids[add_cells]]),
+        np.concatenate([row_ids[~dropped], np.asarray(add_ids)[keep]]),
+        np.concatenate([matrix.cost[~dropped], np.asarray(add_costs)[keep]]))
+    return patched, changed
+
+
+# Cost up to which a new facility can join each cell's list: the cost of
+# its last candidate, or infinity if the list holds every facility the
+# solve could find.
+def insert_threshold(matrix, num_to_find):
+    counts = matrix.counts
+    last = np.full(matrix.num_cells, INF)
+    has = counts > 0
+    last[has] = matrix.cost[matrix.offsets[1:][has] - 1]
+    complete = (counts < min(num_to_find, matrix.num_facilities)) | \
+               (counts >= matrix.num_facilities)
+    return np.where(complete, INF, last)
+
+
+# Candidate position of every cell's previous facility (`facility_ids`, -1
+# for none) in `matrix`, to restart the assignment from. Cells whose
+# facility was removed start at their nearest candidate instead, and cells
+# with one of the facilities `pull_ids` (added, or with room for more
+# burden than before) ahead of their previous one start at the first of
+# those, so that the assignment moves them back where they now fit.
+def initial_ranks(matrix, facility_ids, pull_ids):
+    facility_ids = np.asarray(facility_ids, dtype = np.int64)
+    cells = matrix.row_cells()
+    row_ids = matrix.fac_ids[matrix.fac]
+    rank = np.full(matrix.num_cells, -1, dtype = np.int64)
+
+    match = np.nonzero(row_ids == facility_ids[cells])[0]
+    first = np.ones(len(match), dtype = bool)
+    first[1:] = cells[match[1:]] != cells[match[:-1]]
+    match = match[first]
+    rank[cells[match]] = match - matrix.offsets[cells[match]]
+    rank[(rank < 0) & (matrix.counts > 0)] = 0
+
+    position = np.arange(len(row_ids)) - matrix.offsets[cells]
+    pull = np.nonzero(np.isin(row_ids, pull_ids) & (position < rank[cells]))[0]
+    first = np.ones(len(pull), dtype = bool)
+    first[1:] = cells[pull[1:]] != cells[pull[:-1]]
+    pull = pull[first]
+    rank[cells[pull]] = position[pull]
+    return rank
+
+
+# Update the labels of a network Voronoi search (`dist`, and `label` as
+# index into the facilities) in place for a new set of facilities.
+# `old_to_new` maps the previous facility positions to the new ones (-1 if
+# removed) and `sources` are the snapped nodes of the new facilities, of
+# which those at positions `added` are new. The nodes of removed facilities
+# are searched again from the partitions around them, and new facilities
+# take over the nodes they are closer to. Returns the changed nodes.
+def update_labels(graph, dist, label, old_to_new, sources, added, reverse = False,
+                  max_cost = INF):
+    old_to_new = np.asarray(old_to_new, dtype = np.int64)
+    owned = label >= 0
+    label[owned] = old_to_new[label[owned]]
+    freed = owned & (label < 0)
+    dist[freed] = INF
+
+    # Seeds: every facility at its own node, and the arcs from the remaining
+    # partitions into the freed nodes.
+    sources = np.asarray(sources, dtype = np.int64)
+    seeds = [(0.0, node, i) for i, node in enumerate(sources.tolist())]
+    indptr, heads, costs, _ = graph.csr(reverse)
+    tails = np.repeat(np.arange(graph.num_nodes), np.diff(indptr))
+    entry = freed[heads] & (label[tails] >= 0)
+    seeds.extend(zip((dist[tails[entry]] + costs[entry]).tolist(),
+                     heads[entry].tolist(), label[tails[entry]].tolist()))
+
+    changed = graph.improve(dist, label, seeds, reverse, max_cost)
+    return np.union1d(changed, np.nonzero(freed)[0])
+
+
+# Facility positions whose partition polygons change with the `changed`
+# nodes: their owners before (`old_label`, mapped to the new positions) and
+# after, and the owners of their neighbours, whose shared edges are split
+# anew.
+def touched_facilities(graph, old_label, label, changed):
+    mask = np.zeros(graph.num_nodes, dtype = bool)
+    mask[changed] = True
+    near = mask[graph.edge_u] | mask[graph.edge_v]
+    owners = np.concatenate([old_label[changed], label[changed],
+                             label[graph.edge_u[near]], label[graph.edge_v[near]]])
+    return set(np.unique(owners[owners >= 0]).tolist())
+
+
+# Replace the rows of `output` whose `key_field` is one of `keys` with the
+# features of `new_fc`, which has the same fields.
+def replace_rows(output, key_field, keys, new_fc):
+    arcpy = get_arcpy()
+    keys = set(keys)
+    with arcpy.da.UpdateCursor(output, [key_field]) as update_rows:
+        for row in update_rows:
+            if row[0] in keys:
+                update_rows.deleteRow()
+    if new_fc is not None:
+        arcpy.Append_management(new_fc, output, "NO_TEST")
@@ -0,0 +1,147 @@
+"""
+Multilevel assignment for very large fishnets. Adjacent cells are merged
+into super-cells, level by level, by burden and zone; the assignment is
+solved on the coarsest level and projected down, and on every finer level
+only the cells on the partition boundaries are solved and moved again.
+"""
+
+import numpy as np
+
+from .candidates import CandidateMatrix
+
+
+class CellHierarchy(object):
+    # Super-cells of the cells of a fishnet. On level l (0 = the fishnet's
+    # cells), `owner[l]` gives the super-cell of every fishnet cell,
+    # `burden[l]` the summed burden and `rep[l]` the representative fishnet
+    # cell of every super-cell (the one nearest its burden-weighted centre,
+    # so that it is near a street), and `edges[l]` the pairs of adjacent
+    # super-cells. `parent[l]` maps the super-cells of level l to those of
+    # level l + 1.
+    def __init__(self, owner, parent, burden, rep, edges):
+        self.owner = owner
+        self.parent = parent
+        self.burden = burden
+        self.rep = rep
+        self.edges = edges
+
+    @property
+    def num_levels(self):
+        return len(self.owner)
+
+    def sizes(self):
+        return [len(b) for b in self.burden]
+
+    # Super-cells of level `level` with an adjacent super-cell of another
+    # `label`, or without one (-1).
+    def boundary(self, level, label):
+        i, j = self.edges[level]
+        mask = label < 0
+        differ = label[i] != label[j]
+        mask[i[differ]] = True
+        mask[j[differ]] = True
+        return mask
+
+
+# Merge the cells of `fishnet` up to `levels` times. On every level, each
+# super-cell is paired with at most one adjacent one, preferring a
+# neighbour in the same zone and then the smallest combined burden, as long
+# as that stays within `max_burden`. Pairs are agreed by handshake in a few
+# vectorised `passes`. Stops early when a level would still have more than
+# `shrink` of the super-cells of the level below, or at most `min_cells`.
+def coarsen(fishnet, levels, max_burden, min_cells = 1, passes = 3, shrink = 0.9):
+    xy = fishnet.centroids()
+    value = np.asarray(fishnet.value, dtype = np.float64)
+    i, j = fishnet.neighbours()
+    edges = [_symmetric(i, j)]
+    owner = [np.arange(len(fishnet))]
+    burden = [value]
+    zone = np.asarray(fishnet.zone)
+    rep = [owner[0]]
+    parent = []
+    for level in range(levels):
+        n = len(burden[-1])
+        if n <= min_cells: break
+        mate = _match(n, edges[-1], burden[-1], zone, max_burden, passes)
+        leader = np.where(mate >= 0, np.minimum(np.arange(n), mate), np.arange(n))
+        leaders, up = np.unique(leader, return_inverse = True)
+        if len(leaders) > shrink * n: break
+
+        parent.append(up)
+        owner.append(up[owner[-1]])
+        burden.append(np.bincount(up, burden[-1], minlength = len(leaders)))
+        zone = zone[leaders]
+        edges.append(_symmetric(up[edges[-1][0]], up[edges[-1][1]]))
+        rep.append(_representatives(owner[-1], xy, value, len(leaders)))
+    return CellHierarchy(owner, parent, burden, rep, edges)
+
+
+# Fishnet cell of each of `count` groups (`owner` of every cell) nearest the
+# burden-weighted centre of the group.
+def _representatives(owner, xy, value, count):
+    weight = np.maximum(value, 0) + 1e-12
+    total = np.bincount(owner, weight, minlength = count)
+    centre = np.column_stack([np.bincount(owner, weight * xy[:, 0], minlength = count),
+                              np.bincount(owner, weight * xy[:, 1], minlength = count)])
+    centre /= total[:, None]
+    dist = ((xy - centre[owner]) ** 2).sum(axis = 1)
+    order = np.lexsort((dist, owner))
+    first = np.ones(len(order), dtype = bool)
+    first[1:] = owner[order[1:]] != owner[order[:-1]]
+    return order[first]
+
+
+# Unique pairs (i, j) and (j, i) of distinct adjacent super-cells.
+def _symmetric(i, j):
+    i, j = np.concatenate([i, j]), np.concatenate([j, i])
+    keep = i != j
+    pairs = np.unique(np.column_stack([i[keep], j[keep]]), axis = 0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+# Mate of each of `n` super-cells (-1 for none). Every super-cell proposes
+# to its best free neighbour, and proposals made both ways are matched. A
+# hash of the pair breaks ties the same way from both sides, so that a
+# uniform grid still finds many mutual proposals.
+def _match(n, edges, burden, zone, max_burden, passes):
+    i, j = edges
+    combined = burden[i] + burden[j]
+    ok = combined <= max_burden
+    i, j, combined = i[ok], j[ok], combined[ok]
+    other_zone = zone[i] != zone[j]
+    low, high = np.minimum(i, j), np.maximum(i, j)
+    tie = (low * 2654435761 + high * 40503) % 2147483647
+
+    mate = np.full(n, -1, dtype = np.int64)
+    for _ in range(passes):
+        free = (mate[i] < 0) & (mate[j] < 0)
+        if not free.any(): break
+        fi, fj = i[free], j[free]
+        order = np.lexsort((tie[free], combined[free], other_zone[free], fi))
+        fi, fj = fi[order], fj[order]
+        first = np.ones(len(fi), dtype = bool)
+        first[1:] = fi[1:] != fi[:-1]
+        best = np.full(n, -1, dtype = np.int64)
+        best[fi[first]] = fj[first]
+        proposing = np.nonzero(best >= 0)[0]
+        mutual = proposing[best[best[proposing]] == proposing]
+        if not len(mutual): break
+        mate[mutual] = best[mutual]
+    return mate
+
+
+# Candidate matrix of cells `cell_ids` whose lists are those of their
+# `parent` super-cells in `matrix`, except the cells in `solved`, whose
+# rows (cell index, facility ID, cost) replace them.
+def project(matrix, parent, cell_ids, solved, rows):
+    solved = np.asarray(solved, dtype = bool)
+    copied = np.nonzero(~solved)[0]
+    counts = matrix.counts[parent[copied]]
+    starts = matrix.offsets[parent[copied]]
+    total = int(counts.sum())
+    index = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    cells, fac_ids, costs = rows
+    return CandidateMatrix.from_triples(cell_ids, matrix.fac_ids,
+        np.concatenate([cell_ids[np.repeat(copied, counts)], cell_ids[cells]]),
+        np.concatenate([matrix.fac_ids[matrix.fac[index]], fac_ids]),
+        np.concatenate([matrix.cost[index], costs]))
@@ -0,0 +1,146 @@
+"""
+Boundary point solves on a pool of worker processes. Facilities are dealt
+out to the workers, each with its own routing backend and scratch
+workspace, and the points are merged back in facility order.
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+from ._arcpy import get_arcpy, add_message
+from .profiling import Profiler, profiler
+from .routing import PointSet, GraphBackend, make_backend, GRAPH, NETWORK_ANALYST
+
+# Backend and facilities of the current worker process.
+_worker = {}
+
+
+# Boundary points between every facility in `all_ids` and the facilities
+# after it, as the tool's loop finds them one facility at a time. Every
+# facility is solved on its own, with the facilities before it as
+# `claimed` rather than the barriers they left, so that its points do not
+# depend on which worker solved which facility before. The facilities are
+# split into interleaved chunks, several per worker so that
+# uneven solves even out, and the points are returned in facility order
+# whatever order the chunks finish in. Facilities in `skip` are not
+# solved; `on_found(facility ID, points)` is called for the others as
+# their points come in.
+def parallel_boundary_points(backend, points, all_ids, workers, chunks_per_worker = 4,
+                             skip = (), on_found = None):
+    all_ids = list(all_ids)
+    skip = set(skip)
+    tasks = [(all_ids[i], all_ids[i + 1:], all_ids[:i]) for i in range(len(all_ids) - 1)
+             if all_ids[i] not in skip]
+    if not tasks: return []
+
+    scratch = tempfile.mkdtemp(prefix = "partitioning_")
+    try:
+        num_chunks = min(len(tasks), workers * chunks_per_worker)
+        chunks = [[(i,) + tasks[i] for i in range(j, len(tasks), num_chunks)]
+                  for j in range(num_chunks)]
+        initargs = (_backend_spec(backend, scratch), points.ids, points.xy,
+                    _point_source(backend, points), scratch)
+
+        context = multiprocessing.get_context("spawn")
+        _set_python_executable(context)
+        results = {}
+        with ProcessPoolExecutor(max_workers = workers, mp_context = context,
+                                 initializer = _init_worker,
+                                 initargs = initargs) as pool:
+            futures = [pool.submit(_solve_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                chunk_results, counters = future.result()
+                for i, found, state in chunk_results:
+                    results[i] = found
+                    backend.merge_boundary_state(state)
+                    if on_found is not None: on_found(tasks[i][0], found)
+                for name, n in counters.items():
+                    profiler().count(name, n)
+                add_message(" ...... solved partitions of {0} of {1} facilities"
+                            .format(len(results), len(tasks)))
+    finally:
+        shutil.rmtree(scratch, ignore_errors = True)
+
+    boundary_points = []
+    for i in range(len(tasks)):
+        found = results[i]
+        boundary_points.extend(found)
+        profiler().record("barrier_points", tasks[i][0], len(found))
+    return boundary_points
+
+
+# What a worker needs to build a backend like `backend`: engine, network,
+# travel mode and direction. A graph, with its hierarchy if any, is saved
+# to the scratch folder once for all workers to load.
+def _backend_spec(backend, scratch):
+    if isinstance(backend, GraphBackend):
+        path = os.path.join(scratch, "graph.npz")
+        if backend.hierarchy is not None:
+            backend.hierarchy.save(path, backend.graph)
+        else:
+            backend.graph.save(path)
+        return (GRAPH, path, None, backend.direction)
+    return (NETWORK_ANALYST, backend.network, backend.mode, backend.direction)
+
+
+# Dataset the facilities were read from, for Network Analyst workers to
+# load locations from; graph workers only need the coordinates.
+def _point_source(backend, points):
+    if isinstance(backend, GraphBackend) or points.source is None:
+        return None
+    return get_arcpy().Describe(points.source).catalogPath
+
+
+# Inside ArcGIS Pro, sys.executable is the application itself, so workers
+# are started with the Python interpreter of its environment instead.
+def _set_python_executable(context):
+    if os.path.basename(sys.executable).lower().startswith("python"): return
+    for name in ("python.exe", "pythonw.exe", os.path.join("bin", "python")):
+        path = os.path.join(sys.exec_prefix, name)
+        if os.path.isfile(path):
+            context.set_executable(path)
+            return
+
+
+# Set up a worker process: a scratch folder (and file geodatabase for
+# Network Analyst) of its own, the facilities and a backend, which is
+# closed when the process exits.
+def _init_worker(spec, ids, xy, source, scratch):
+    engine, network, mode, direction = spec
+    folder = tempfile.mkdtemp(dir = scratch, prefix = "worker_")
+    if source is not None:
+        arcpy = get_arcpy()
+        arcpy.env.overwriteOutput = True
+        arcpy.CreateFileGDB_management(folder, "scratch.gdb")
+        arcpy.env.workspace = os.path.join(folder, "scratch.gdb")
+        arcpy.env.scratchWorkspace = arcpy.env.workspace
+        layer = "WorkerFacilities"
+        arcpy.MakeFeatureLayer_management(source, layer)
+        points = PointSet(ids, xy, layer)
+    else:
+        points = PointSet(ids, xy)
+
+    backend = make_backend(engine, network, mode, direction)
+    Finalize(backend, backend.close, exitpriority = 10)
+    _worker["backend"] = backend
+    _worker["points"] = points
+
+
+# Solve the (task index, target ID, other IDs, claimed IDs) tasks of a
+# chunk. Returns the results and the counters of the solves, for the
+# parent's profiler.
+def _solve_chunk(chunk):
+    backend, points = _worker["backend"], _worker["points"]
+    results = []
+    with Profiler("worker", memory = False) as trace:
+        for i, target_id, others, claimed in chunk:
+            backend.clear_boundary_points()
+            found = backend.boundary_points(points.select([target_id]), points.select(others),
+                                            points.select(claimed) if claimed else None)
+            results.append((i, found, backend.boundary_state(found)))
+    return results, trace.counters
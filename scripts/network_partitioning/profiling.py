@@ -0,0 +1,239 @@
+"""
+Stage timing and solve counters for the partitioning tools. A `Profiler`
+records wall time, process peak memory and row counts per stage, plus named
+counters, and writes them as a JSON trace and in Chrome trace format.
+While no profiler is active, `profiler()` returns one that does nothing.
+"""
+
+import contextlib
+import ctypes
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from ._arcpy import add_message
+
+
+class _Stage(object):
+    # A timed stage; set `rows` to the number of rows it handled.
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.rows = None
+        self.start = 0.0
+        self.duration = 0.0
+        self.peak = 0
+        self.peak_rss = None
+        self.rss_growth = None
+        self._start_rss = None
+        self.depth = 0
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.depth = len(profiler._stack)
+        if profiler._memory:
+            # The parent's peak so far is kept before measuring this stage.
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, "reset_peak"): tracemalloc.reset_peak()
+        profiler._stack.append(self)
+        self._start_rss = peak_rss()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        profiler = self.profiler
+        self.duration = time.time() - self.start
+        profiler._stack.pop()
+        self.peak_rss = peak_rss()
+        if self.peak_rss is not None and self._start_rss is not None:
+            self.rss_growth = self.peak_rss - self._start_rss
+        if profiler._memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent.peak = max(parent.peak, self.peak)
+        profiler.stages.append(self)
+        return False
+
+
+class _NullStage(object):
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler(object):
+    # Stands in while profiling is off; every call does nothing.
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, n = 1):
+        pass
+
+    def record(self, name, key, value):
+        pass
+
+
+_null = NullProfiler()
+_active = _null
+
+
+# The active profiler, or one that does nothing.
+def profiler():
+    return _active
+
+
+class Profiler(object):
+    # Trace of one run of `tool`. Every stage records the peak resident
+    # memory of the process so far, which is cumulative, and how much the
+    # stage raised it; a stage that stays under an earlier peak shows no
+    # growth. With `memory`, tracemalloc is started and the peak of Python
+    # and NumPy allocations within each stage is also measured, which slows
+    # allocations down.
+    def __init__(self, tool, memory = False):
+        self.tool = tool
+        self.stages = []
+        self.counters = {}
+        self.series = {}
+        self._memory = memory
+        self._stack = []
+        self._started_tracemalloc = False
+        self._previous = None
+        self.start_time = None
+
+    # Make this the active profiler.
+    def start(self):
+        global _active
+        self._previous = _active
+        _active = self
+        self.start_time = time.time()
+        if self._memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    # Restore the previously active profiler.
+    def stop(self):
+        global _active
+        _active = self._previous or _null
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    # Context manager timing the stage `name`.
+    def stage(self, name):
+        return _Stage(self, name)
+
+    # Add `n` to the counter `name`.
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # Record `value` for `key` in the series `name`, e.g. barrier points
+    # per facility.
+    def record(self, name, key, value):
+        self.series.setdefault(name, {})[str(key)] = value
+
+    def to_dict(self):
+        origin = self.start_time or 0.0
+        return {
+            "tool": self.tool,
+            "stages": [{"name": s.name, "start": s.start - origin,
+                        "duration": s.duration, "depth": s.depth,
+                        "rows": s.rows, "process_peak_rss_bytes": s.peak_rss,
+                        "peak_rss_growth_bytes": s.rss_growth,
+                        "peak_bytes": s.peak if self._memory else None}
+                       for s in sorted(self.stages, key = lambda s: s.start)],
+            "counters": dict(self.counters),
+            "series": dict(self.series),
+        }
+
+    # Chrome trace format (chrome://tracing, Perfetto): one complete event
+    # per stage and the counters at the end of the run.
+    def to_chrome(self):
+        origin = self.start_time or 0.0
+        events = []
+        for s in self.stages:
+            args = {"rows": s.rows, "process_peak_rss_bytes": s.peak_rss,
+                    "peak_rss_growth_bytes": s.rss_growth}
+            if self._memory: args["peak_bytes"] = s.peak
+            events.append({"name": s.name, "ph": "X", "pid": 1, "tid": 1,
+                           "ts": (s.start - origin) * 1e6, "dur": s.duration * 1e6,
+                           "args": args})
+        end = max([s.start + s.duration - origin for s in self.stages] + [0.0])
+        for name, value in sorted(self.counters.items()):
+            events.append({"name": name, "ph": "C", "pid": 1, "tid": 1,
+                           "ts": end * 1e6, "args": {name: value}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # Write the trace to `path` as JSON, and in Chrome trace format next to
+    # it (`<name>.chrome.json`).
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent = 2)
+        chrome_path = os.path.splitext(path)[0] + ".chrome.json"
+        with open(chrome_path, "w") as f:
+            json.dump(self.to_chrome(), f)
+        return path, chrome_path
+
+
+# Profile the enclosed run as `tool` and write the trace to `path`, even if
+# the run fails. Without a path nothing is recorded.
+@contextlib.contextmanager
+def traced(path, tool):
+    if not path:
+        yield None
+        return
+    trace = Profiler(tool).start()
+    try:
+        yield trace
+    finally:
+        trace.stop()
+        add_message(" ... writing trace to " + ", ".join(trace.write(path)))
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t)]
+
+
+# Peak resident memory of the process in bytes, or None if unknown.
+def peak_rss():
+    if sys.platform == "win32":
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.c_void_p(ctypes.windll.kernel32.GetCurrentProcess())
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters),
+                                                    counters.cb):
+            return int(counters.PeakWorkingSetSize)
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return int(peak if sys.platform == "darwin" else peak * 1024)
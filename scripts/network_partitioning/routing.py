@@ -0,0 +1,621 @@
+"""
+Routing backends used by the partitioning tools. A backend answers the
+closest-facility, boundary point and service area queries of both tools,
+either through Network Analyst solves or with the in-process graph engine.
+"""
+
+import os
+import numpy as np
+
+from ._arcpy import get_arcpy, add_message
+from .cache import array_digest
+from .geometry import grid_outlines, label_grid
+from .graph import Graph, INF
+from .hierarchy import ContractionHierarchy
+from .profiling import profiler
+from .table import read_columns, write_lines, write_points, write_polygons, _positions
+from .voronoi import NetworkVoronoi
+
+NETWORK_ANALYST = "NETWORK_ANALYST"
+GRAPH = "GRAPH"
+
+# Incidents per Network Analyst closest facility solve.
+INCIDENT_CHUNK = 50000
+
+
+class PointSet(object):
+    # Facilities or incidents with their source IDs and coordinates.
+    # `source` is the feature layer they were read from, `id_field` a field
+    # on it holding the same IDs (used to map Network Analyst locations back
+    # to their source), and `subset` tells whether only some of its features
+    # are included.
+    def __init__(self, ids, xy, source = None, id_field = None, subset = False):
+        self.ids = np.asarray(ids, dtype = np.int64)
+        self.xy = np.asarray(xy, dtype = np.float64).reshape(-1, 2)
+        self.source = source
+        self.id_field = id_field
+        self.subset = subset
+
+    # Read the object IDs and coordinates of a point feature class or layer.
+    @classmethod
+    def from_feature_class(cls, fc, id_field = None):
+        columns = read_columns(fc, ["OID@", "SHAPE@X", "SHAPE@Y"])
+        return cls(columns["OID@"], np.column_stack([columns["SHAPE@X"], columns["SHAPE@Y"]]),
+                   fc, id_field)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Hex digest of the IDs and coordinates.
+    def digest(self):
+        return array_digest(self.ids, self.xy)
+
+    # The points whose IDs are in `ids`.
+    def select(self, ids):
+        mask = np.isin(self.ids, np.asarray(list(ids), dtype = np.int64))
+        return PointSet(self.ids[mask], self.xy[mask], self.source,
+                        self.id_field, subset = True)
+
+
+class RoutingBackend(object):
+    # Cost from every incident to its `num_to_find` closest facilities, as
+    # three arrays (incident IDs, facility IDs, costs), grouped by incident
+    # and in order of cost. Facilities farther than `max_cost` may be left
+    # out.
+    def closest_facilities(self, incidents, facilities, num_to_find, max_cost = INF):
+        raise NotImplementedError
+
+    # Points on the network where the cost to `target` equals the cost to
+    # the closest of `others`, which together cut `target` off from them.
+    # The facilities `claimed`, whose points were found before, are
+    # searched too, and no point is placed where one of them is closest:
+    # their partitions are bounded already. Returns a list of (x, y).
+    def boundary_points(self, target, others, claimed = None):
+        raise NotImplementedError
+
+    # Forget the points of earlier `boundary_points` calls, as at the start
+    # of a run.
+    def clear_boundary_points(self):
+        pass
+
+    # Whatever `boundary_points` keeps about the given points for later
+    # solves, so that points found by another backend (in a worker process)
+    # can be carried over with `merge_boundary_state`.
+    def boundary_state(self, points):
+        return None
+
+    def merge_boundary_state(self, state):
+        pass
+
+    # Arrays to save with `points` found by `boundary_points`, so that a
+    # resumed run can carry them over with `restore_boundary_points`.
+    def save_boundary_state(self, points):
+        return {}
+
+    # Carry `points` found by an interrupted run, with the arrays saved by
+    # `save_boundary_state`, over to later solves.
+    def restore_boundary_points(self, points, arrays):
+        pass
+
+    # Create service area polygons for `facilities` in `output`, reaching
+    # at most `max_cost` and stopped at the barrier points (x, y).
+    def service_area(self, facilities, output, max_cost, barriers = None):
+        raise NotImplementedError
+
+    # Partition the network among `facilities` in one multi-source search,
+    # writing the partitions to `output` and returning the boundary points.
+    def partition(self, facilities, output, max_cost):
+        raise NotImplementedError(
+            "Single-pass partitioning requires the GRAPH routing engine.")
+
+    # Write the network within `max_cost` of `facilities` to `output` as
+    # lines, each labelled with the source ID of its nearest facility in a
+    # FacilityID field. Returns the number of lines.
+    def partition_lines(self, facilities, output, max_cost):
+        raise NotImplementedError
+
+    # Release analysis layers and other resources.
+    def close(self):
+        pass
+
+
+class NetworkAnalystBackend(RoutingBackend):
+    # Network Analyst closest facility and service area solves on a network
+    # dataset. Requires the Network Analyst extension. Closest facilities
+    # are solved for at most `chunk_size` incidents at a time.
+    def __init__(self, network, mode = "Driving Time",
+                 direction = "FROM_FACILITIES", chunk_size = INCIDENT_CHUNK):
+        arcpy = get_arcpy()
+        # Check out Network Analyst license if available.
+        # Fail if the Network Analyst license is not available.
+        if arcpy.CheckExtension("network") == "Available":
+            arcpy.CheckOutExtension("network")
+        else:
+            raise arcpy.ExecuteError("Network Analyst Extension license is not available.")
+
+        self.network = network
+        self.mode = mode
+        self.direction = direction
+        self.chunk_size = chunk_size
+        self._cf_layers = {}
+        self._loaded_facilities = {}
+        self._fac_maps = {}
+        self._boundary_layer = None
+        self._sa_layers = {}
+
+    # Closest facility analysis layer finding `num_to_find` facilities. Only
+    # the costs of its routes are read, so no route shapes are made.
+    def _closest_facility_layer(self, num_to_find):
+        if num_to_find not in self._cf_layers:
+            arcpy = get_arcpy()
+            add_message(" ... initializing closest facility analysis")
+            self._cf_layers[num_to_find] = arcpy.na.MakeClosestFacilityAnalysisLayer(
+                self.network, "Closest_Facility",
+                self.mode, self.direction,
+                number_of_facilities_to_find = num_to_find,
+                line_shape = "NO_LINES").getOutput(0)
+        return self._cf_layers[num_to_find]
+
+    # Load `points` into `sublayer` of `layer`, replacing its locations,
+    # with every location named by its point's source ID. All points of a
+    # source with an ID field are loaded from it; a subset, or points
+    # without one, from an in-memory copy of their IDs and coordinates, so
+    # that no selection query is built. Returns the map from location
+    # object IDs to source IDs.
+    def _load(self, layer, sublayer, points):
+        arcpy = get_arcpy()
+        mappings = arcpy.na.NAClassFieldMappings(layer, sublayer)
+        if points.source is not None and points.id_field and not points.subset:
+            arcpy.SelectLayerByAttribute_management(points.source, "CLEAR_SELECTION")
+            mappings["Name"].mappedFieldName = points.id_field
+            arcpy.na.AddLocations(layer, sublayer, points.source, mappings, append = "CLEAR")
+        else:
+            sr = arcpy.Describe(points.source if points.source is not None
+                                else self.network).spatialReference
+            source = write_points("in_memory/na_locations", points.xy,
+                                  {"SourceID": points.ids}, sr)
+            mappings["Name"].mappedFieldName = "SourceID"
+            arcpy.na.AddLocations(layer, sublayer, source, mappings, append = "CLEAR")
+            arcpy.Delete_management(source)
+        return _LocationMap(sublayer)
+
+    # Solves are not cut off at `max_cost`. Incidents are loaded and solved
+    # in chunks, and only the IDs and costs of each chunk's routes are kept.
+    def closest_facilities(self, incidents, facilities, num_to_find, max_cost = INF):
+        arcpy = get_arcpy()
+        layer = self._closest_facility_layer(num_to_find)
+        # Sublayer names
+        sublayer_names = arcpy.na.GetNAClassNames(layer)
+        cf_fac_lyr_name = sublayer_names["Facilities"]
+        cf_incidents_lyr_name = sublayer_names["Incidents"]
+        cf_routes_lyr_name = sublayer_names["CFRoutes"]
+
+        # Load facilities, unless they are already loaded in this layer.
+        if self._loaded_facilities.get(num_to_find) is not facilities:
+            self._fac_maps[num_to_find] = self._load(layer, cf_fac_lyr_name, facilities)
+            self._loaded_facilities[num_to_find] = facilities
+
+        cell_ids, fac_ids, costs = [], [], []
+        for start in range(0, max(len(incidents), 1), self.chunk_size):
+            chunk = incidents
+            if len(incidents) > self.chunk_size:
+                end = start + self.chunk_size
+                chunk = PointSet(incidents.ids[start:end], incidents.xy[start:end],
+                                 incidents.source, incidents.id_field, subset = True)
+            incident_map = self._load(layer, cf_incidents_lyr_name, chunk)
+
+            profiler().count("network_solves")
+            arcpy.na.Solve(layer)
+
+            # Routes refer to locations by object ID; map them to source IDs.
+            columns = read_columns(cf_routes_lyr_name, ["IncidentID", "FacilityID",
+                                                        "Total_Length"])
+            cell_ids.append(incident_map(columns["IncidentID"]))
+            fac_ids.append(self._fac_maps[num_to_find](columns["FacilityID"]))
+            costs.append(columns["Total_Length"].astype(np.float64))
+
+        cell_ids, fac_ids, costs = (np.concatenate(a) for a in (cell_ids, fac_ids, costs))
+        order = np.lexsort((costs, cell_ids))
+        return cell_ids[order], fac_ids[order], costs[order]
+
+    # Closest facility layer of the boundary point solves, made on first use.
+    def _boundary_closest_facility_layer(self):
+        if self._boundary_layer is None:
+            add_message(" ... initializing closest facility analysis")
+            self._boundary_layer = get_arcpy().na.MakeClosestFacilityAnalysisLayer(
+                self.network, "Closest_Facility",
+                self.mode, self.direction,
+                number_of_facilities_to_find = 1).getOutput(0)
+        return self._boundary_layer
+
+    # For each loop, find route to closest facility with previous mid_points
+    # as barriers, add new mid_point to barriers. Stop until can't find new
+    # route. Barriers are kept in the layer between calls, until
+    # `clear_boundary_points`, so that the points of earlier facilities
+    # fence their partitions off. Mid points of routes to `claimed`
+    # facilities only become barriers.
+    def boundary_points(self, target, others, claimed = None):
+        arcpy = get_arcpy()
+        layer = self._boundary_closest_facility_layer()
+        # Sublayer names
+        sublayer_names = arcpy.na.GetNAClassNames(layer)
+        cfFacilities_lyr_name = sublayer_names["Facilities"]
+        cfIncidents_lyr_name = sublayer_names["Incidents"]
+        cfBarriers_lyr_name = sublayer_names["Barriers"]
+
+        # Load facilities and incidents, replacing those of the last call.
+        facilities = others
+        claimed_ids = set()
+        if claimed is not None and len(claimed):
+            facilities = PointSet(np.concatenate([others.ids, claimed.ids]),
+                                  np.concatenate([others.xy, claimed.xy]),
+                                  others.source, others.id_field, subset = True)
+            claimed_ids = set(claimed.ids.tolist())
+        fac_map = self._load(layer, cfFacilities_lyr_name, facilities)
+        self._load(layer, cfIncidents_lyr_name, target)
+
+        mid_point = "mid_point"
+        points = []
+        route = None
+        while True:
+            # Slove route to the closest facility
+            profiler().count("network_solves")
+            try: arcpy.na.Solve(layer)
+            except: break
+
+            # Find mid_point of new route
+            route = arcpy.SearchCursor(layer.listLayers()[3]).next()
+            new_mid_point = arcpy.PointGeometry(
+                route.Shape.positionAlongLine(0.50,True).firstPoint)
+            new_mid_point = route.Shape.queryPointAndDistance(new_mid_point)[0]
+            if int(fac_map([route.FacilityID])[0]) not in claimed_ids:
+                points.append((new_mid_point.firstPoint.X, new_mid_point.firstPoint.Y))
+
+            # Copy new_mid_point geometry to mid_point feature class
+            arcpy.CopyFeatures_management(new_mid_point, mid_point)
+
+            # Add mid point as barrier
+            arcpy.na.AddLocations(layer, cfBarriers_lyr_name, mid_point)
+
+        del route
+        arcpy.Delete_management(mid_point)
+        return points
+
+    def clear_boundary_points(self):
+        arcpy = get_arcpy()
+        layer = self._boundary_closest_facility_layer()
+        arcpy.DeleteFeatures_management(arcpy.na.GetNAClassNames(layer)["Barriers"])
+
+    # Points of an interrupted run become barriers of the layer again.
+    def restore_boundary_points(self, points, arrays):
+        if not len(points): return
+        arcpy = get_arcpy()
+        layer = self._boundary_closest_facility_layer()
+        barriers = arcpy.na.GetNAClassNames(layer)["Barriers"]
+        sr = arcpy.Describe(self.network).spatialReference
+        barrier_fc = write_points("in_memory/restored_barriers", points, spatial_reference = sr)
+        arcpy.na.AddLocations(layer, barriers, barrier_fc)
+        arcpy.Delete_management(barrier_fc)
+
+    def service_area(self, facilities, output, max_cost, barriers = None):
+        arcpy = get_arcpy()
+        if max_cost not in self._sa_layers:
+            add_message(" ... initializing service area analysis")
+            self._sa_layers[max_cost] = arcpy.na.MakeServiceAreaAnalysisLayer(
+                self.network, "Service_Area", self.mode,
+                self.direction, [max_cost],
+                geometry_at_overlaps = "SPLIT").getOutput(0)
+        sa_layer_obj = self._sa_layers[max_cost]
+
+        # SublyerNames
+        sublayer_names = arcpy.na.GetNAClassNames(sa_layer_obj)
+        sa_fac_lyr_name = sublayer_names["Facilities"]
+        sa_barriers_lyr_name = sublayer_names["Barriers"]
+        sa_polygons_lyr_name = sublayer_names["SAPolygons"]
+        sa_polygons = sa_layer_obj.listLayers(sa_polygons_lyr_name)[0]
+
+        # Reset
+        arcpy.Delete_management(output)
+        arcpy.DeleteFeatures_management(sa_barriers_lyr_name)
+
+        # Load facilities.
+        self._load(sa_layer_obj, sa_fac_lyr_name, facilities)
+
+        # Load barriers.
+        if barriers:
+            sr = arcpy.Describe(self.network).spatialReference
+            barrier_fc = write_points("in_memory/sa_barriers", barriers, spatial_reference = sr)
+            arcpy.na.AddLocations(sa_layer_obj, sa_barriers_lyr_name, barrier_fc)
+            arcpy.Delete_management(barrier_fc)
+
+        # Solve service area
+        profiler().count("network_solves")
+        arcpy.na.Solve(sa_layer_obj)
+
+        # Copy service area to output feature class
+        arcpy.CopyFeatures_management(sa_polygons, output)
+
+    # One service area solve for lines, with overlapping lines split
+    # between the facilities, so that each piece of street goes to the
+    # facility nearest to it. No boundary points or barriers are needed.
+    def partition_lines(self, facilities, output, max_cost):
+        arcpy = get_arcpy()
+        key = ("LINES", max_cost)
+        if key not in self._sa_layers:
+            add_message(" ... initializing service area lines analysis")
+            self._sa_layers[key] = arcpy.na.MakeServiceAreaAnalysisLayer(
+                self.network, "Service_Area_Lines", self.mode,
+                self.direction, [max_cost], output_type = "LINES",
+                geometry_at_overlaps = "SPLIT").getOutput(0)
+        layer = self._sa_layers[key]
+        sublayer_names = arcpy.na.GetNAClassNames(layer)
+        fac_map = self._load(layer, sublayer_names["Facilities"], facilities)
+
+        profiler().count("network_solves")
+        arcpy.na.Solve(layer)
+
+        shapes, fac_oids = [], []
+        with arcpy.da.SearchCursor(sublayer_names["SALines"],
+                                   ["SHAPE@", "FacilityID"]) as search_rows:
+            for shape, fac_oid in search_rows:
+                shapes.append(shape)
+                fac_oids.append(fac_oid)
+        sr = arcpy.Describe(self.network).spatialReference
+        return write_lines(output, shapes, {"FacilityID": fac_map(fac_oids)}, sr)
+
+    def close(self):
+        arcpy = get_arcpy()
+        layers = list(self._cf_layers.values()) + list(self._sa_layers.values())
+        if self._boundary_layer is not None:
+            layers.append(self._boundary_layer)
+        for layer in layers:
+            arcpy.Delete_management(layer)
+        arcpy.Delete_management(os.path.join(arcpy.env.workspace, "ClosestFacility"))
+        self._cf_layers, self._sa_layers, self._fac_maps = {}, {}, {}
+        self._loaded_facilities = {}
+        self._boundary_layer = None
+
+
+class _LocationMap(object):
+    # Object IDs of the locations of a Network Analyst sublayer and the
+    # source IDs in their names, read once after loading. Every location
+    # keeps its own ID, also where several snap to the same place.
+    def __init__(self, sublayer):
+        columns = read_columns(sublayer, ["OID@", "Name"])
+        self.oids = np.asarray(columns["OID@"], dtype = np.int64)
+        self.ids = np.array([int(name) for name in columns["Name"].tolist()],
+                            dtype = np.int64)
+
+    # Source IDs of locations `oids`.
+    def __call__(self, oids):
+        return self.ids[_positions(self.oids, oids)]
+
+
+class GraphBackend(RoutingBackend):
+    # In-process engine on a `Graph`. Locations are snapped to their nearest
+    # network node; costs are the edge costs of the graph. With a
+    # `hierarchy` of the graph, closest facilities and boundary points are
+    # looked up in it instead of searching the whole graph.
+    def __init__(self, graph, direction = "FROM_FACILITIES", hierarchy = None):
+        self.graph = graph
+        self.hierarchy = hierarchy
+        self.direction = direction
+        # Searches start at the facilities, so travelling to them means
+        # searching against the edge direction.
+        self.reverse = direction == "TO_FACILITIES"
+        # Boundary points created so far, (x, y) -> (edge, fraction).
+        self._cuts = {}
+
+    # Load the network from a graph saved as .npz, with its contraction
+    # hierarchy if it is an index from `build_index`, or from a polyline
+    # feature class of streets (cost = length, or `cost_field`, with the
+    # one-way streets of `oneway_field`).
+    @classmethod
+    def from_source(cls, source, direction = "FROM_FACILITIES", cost_field = None,
+                    oneway_field = None):
+        add_message(" ... loading network graph")
+        hierarchy = None
+        if str(source).lower().endswith(".npz"):
+            graph = Graph.load(source)
+            hierarchy = ContractionHierarchy.load(source)
+            if hierarchy is not None:
+                add_message(" ... using the network's contraction hierarchy")
+        else:
+            graph = Graph.from_feature_class(source, cost_field, oneway_field)
+        return cls(graph, direction, hierarchy)
+
+    def closest_facilities(self, incidents, facilities, num_to_find, max_cost = INF):
+        k = min(num_to_find, len(facilities))
+        profiler().count("network_solves")
+        sources = self.graph.snap(facilities.xy)
+        nodes = self.graph.snap(incidents.xy)
+        if self.hierarchy is not None:
+            targets, inverse = np.unique(nodes, return_inverse = True)
+            dist, label = self.hierarchy.k_nearest(sources, targets, k, self.reverse,
+                                                   max_cost)
+            dist, label = dist[inverse.ravel()], label[inverse.ravel()]
+        else:
+            dist, label = self.graph.k_nearest(sources, k, self.reverse, max_cost)
+            dist, label = dist[nodes], label[nodes]
+        found = label >= 0
+        return (np.repeat(incidents.ids, found.sum(axis = 1)),
+                facilities.ids[label[found]], dist[found])
+
+    # Points are placed on the edges from a node whose nearest facility is
+    # `target` to one whose nearest is one of `others`, nearest among all
+    # facilities, so that they only bound the network Voronoi partitions.
+    def boundary_points(self, target, others, claimed = None):
+        graph = self.graph
+        profiler().count("network_solves", 2)
+        dist_t, _ = self._search(graph.snap(target.xy))
+        dist_o, _ = self._search(graph.snap(others.xy))
+        near_t = np.isfinite(dist_t) & (dist_t <= dist_o)
+        near_o = dist_o < dist_t
+        if claimed is not None and len(claimed):
+            profiler().count("network_solves")
+            dist_c, _ = self._search(graph.snap(claimed.xy))
+            near_t &= dist_t <= dist_c
+            near_o &= dist_o < dist_c
+
+        # A one-way edge belongs whole to the partition at the end it is
+        # entered from, so it needs no point.
+        u, v, w = graph.edge_u, graph.edge_v, graph.edge_cost
+        forward = near_t[u] & near_o[v] & ~graph.oneway
+        backward = near_o[u] & near_t[v] & ~graph.oneway
+        edges = np.nonzero(forward | backward)[0]
+
+        # Fraction along each edge where both costs are equal.
+        w_e = np.where(w[edges] > 0, w[edges], 1.0)
+        t = np.where(forward[edges],
+                     (dist_o[v[edges]] + w[edges] - dist_t[u[edges]]) / (2 * w_e),
+                     1 - (dist_o[u[edges]] + w[edges] - dist_t[v[edges]]) / (2 * w_e))
+        t = np.clip(np.where(w[edges] > 0, t, 0.5), 0.0, 1.0)
+
+        # Equal-cost points on nodes are shared by several edges.
+        points = {}
+        for edge, frac, xy in zip(edges, t, graph.edge_point(edges, t)):
+            point = (float(xy[0]), float(xy[1]))
+            self._cuts[point] = (int(edge), float(frac))
+            points[point] = True
+        return list(points)
+
+    # Cost from the nearest of the `sources` nodes to every node, and the
+    # index of that source.
+    def _search(self, sources, max_cost = INF):
+        if self.hierarchy is not None:
+            return self.hierarchy.one_to_all(sources, self.reverse, max_cost)
+        return self.graph.dijkstra(sources, self.reverse, max_cost)
+
+    # Edge and fraction along it of each of `points`.
+    def boundary_state(self, points):
+        return dict((point, self._cuts[point]) for point in points)
+
+    def merge_boundary_state(self, state):
+        self._cuts.update(state or {})
+
+    def save_boundary_state(self, points):
+        cuts = [self._cuts[tuple(point)] for point in points]
+        return {"cut_edge": np.array([c[0] for c in cuts], dtype = np.int64),
+                "cut_frac": np.array([c[1] for c in cuts], dtype = np.float64)}
+
+    def restore_boundary_points(self, points, arrays):
+        self._cuts.update(zip([tuple(p) for p in points],
+                              zip(arrays["cut_edge"].tolist(), arrays["cut_frac"].tolist())))
+
+    # Edge and fraction along it of a barrier point.
+    def _locate(self, point):
+        if tuple(point) in self._cuts:
+            return self._cuts[tuple(point)]
+        graph = self.graph
+        node = graph.snap([point])[0]
+        edges = np.nonzero((graph.edge_u == node) | (graph.edge_v == node))[0]
+        start = graph.node_xy[graph.edge_u[edges]]
+        delta = graph.node_xy[graph.edge_v[edges]] - start
+        length2 = np.maximum((delta ** 2).sum(axis = 1), 1e-24)
+        t = np.clip(((np.asarray(point) - start) * delta).sum(axis = 1) / length2, 0, 1)
+        d = np.hypot(*(start + delta * t[:, None] - point).T)
+        i = int(np.argmin(d))
+        return int(edges[i]), float(t[i])
+
+    # Network Voronoi diagram of `facilities` up to `max_cost`, stopped at
+    # the barrier points (x, y).
+    def voronoi(self, facilities, max_cost = INF, barriers = None):
+        graph = self.graph
+        cut_lo, cut_hi, search = None, None, None
+        if barriers:
+            cut_lo = np.ones(graph.num_edges)
+            cut_hi = np.zeros(graph.num_edges)
+            for point in barriers:
+                edge, frac = self._locate(point)
+                cut_lo[edge] = min(cut_lo[edge], frac)
+                cut_hi[edge] = max(cut_hi[edge], frac)
+        profiler().count("network_solves")
+        sources = graph.snap(facilities.xy)
+        if not barriers and self.hierarchy is not None:
+            search = self._search(sources, max_cost)
+        return NetworkVoronoi(graph, sources, self.reverse, max_cost, cut_lo, cut_hi,
+                              search)
+
+    def service_area(self, facilities, output, max_cost, barriers = None):
+        self.write_partitions(self.voronoi(facilities, max_cost, barriers),
+                               facilities, output)
+
+    def partition(self, facilities, output, max_cost):
+        voronoi = self.voronoi(facilities, max_cost)
+        self.write_partitions(voronoi, facilities, output)
+        return [tuple(xy) for xy in voronoi.boundary_points().tolist()]
+
+    # Write the area around every facility's part of the network to
+    # `output`, or only of the facilities at positions `only`. The pieces of
+    # the edges each facility owns label a grid of cells of half the median
+    # edge length up to two cells away, and the outline of every label is
+    # traced on the grid, so partitions share their borders and never
+    # overlap; the borders follow the grid, not the streets.
+    def write_partitions(self, voronoi, facilities, output, only = None):
+        graph = self.graph
+        edges, start, end, owner = voronoi.edge_pieces()
+        size = self.outline_size
+        origin = graph.node_xy.min(axis = 0) - 4 * size
+        col, row, label = label_grid(graph.edge_point(edges, start),
+                                     graph.edge_point(edges, end), owner, origin, size)
+        names, outlines = grid_outlines(col, row, np.ones(len(col)), label)
+        keep = [k for k, i in enumerate(names.tolist()) if only is None or i in only]
+        write_polygons(output, [[origin + ring * size for ring in outlines[k]] for k in keep],
+                       {"FacilityID": facilities.ids[names[keep]]}, self._spatial_reference())
+
+    # Side of the grid cells partitions are traced on.
+    @property
+    def outline_size(self):
+        graph = self.graph
+        length = np.hypot(*(graph.node_xy[graph.edge_v] - graph.node_xy[graph.edge_u]).T)
+        length = length[length > 0]
+        return float(np.median(length)) / 2 if len(length) else 1.0
+
+    # The pieces of the edges owned by each facility in its network Voronoi
+    # partition, with the edge's index in the graph (EdgeID) and the
+    # fractions of the edge (FromPos, ToPos) they cover.
+    def partition_lines(self, facilities, output, max_cost):
+        graph = self.graph
+        edges, start, end, owner = self.voronoi(facilities, max_cost).edge_pieces()
+        starts, ends = graph.edge_point(edges, start), graph.edge_point(edges, end)
+        return write_lines(output, zip(starts.tolist(), ends.tolist()),
+                           {"FacilityID": facilities.ids[owner], "EdgeID": edges,
+                            "FromPos": start, "ToPos": end}, self._spatial_reference())
+
+    # The graph's spatial reference as an ArcGIS object, or None.
+    def _spatial_reference(self):
+        if not self.graph.spatial_reference:
+            return None
+        sr = get_arcpy().SpatialReference()
+        sr.loadFromString(self.graph.spatial_reference)
+        return sr
+
+
+# Choose a routing backend. The Network Analyst engine solves on the network
+# dataset; the graph engine loads `streets` (a polyline feature class, with
+# `cost_field` and `oneway_field` if given) or a saved .npz graph or index
+# given as `network`. The graph engine has no travel modes: the costs are
+# those of the .npz, or of the streets.
+def make_backend(engine, network, mode = "Driving Time",
+                 direction = "FROM_FACILITIES", streets = None,
+                 cost_field = None, oneway_field = None):
+    engine = (engine or NETWORK_ANALYST).upper()
+    if engine == NETWORK_ANALYST:
+        return NetworkAnalystBackend(network, mode, direction)
+    if engine == GRAPH:
+        if not str(network).lower().endswith(".npz"):
+            if streets is not None:
+                network = streets
+            if cost_field is None and mode and not _length_mode(mode):
+                add_message(" ... travel mode '{0}' is not used by the GRAPH engine, "
+                            "costs are street lengths; give a cost field or an .npz "
+                            "index built with one".format(mode))
+        return GraphBackend.from_source(network, direction, cost_field, oneway_field)
+    raise ValueError("Unknown routing engine: " + str(engine))
+
+
+# Whether a travel mode measures distance, which the graph engine's street
+# lengths stand in for.
+def _length_mode(mode):
+    name = str(mode).lower()
+    return "distance" in name or "length" in name
@@ -0,0 +1,88 @@
+"""
+Solver sessions. A `Session` keeps what partitioning runs in one process
+can share: the routing backend, with its loaded network or Network Analyst
+license and analysis layers, and the facilities read so far. Passing one
+session to many `cap_based_nt_partitioning` or `dist_based_nt_partitioning`
+calls pays the startup cost once instead of once per run.
+"""
+
+from ._arcpy import get_arcpy
+from .routing import PointSet, make_backend, NETWORK_ANALYST
+
+
+class Session(object):
+    # Network settings of the runs sharing this session. The backend is
+    # created on first use; `workspace`, if given, is made the arcpy
+    # workspace of every run. `cost_field` and `oneway_field` of `streets`
+    # are used by the GRAPH engine when it loads the streets.
+    def __init__(self, network, travel_mode = "Driving Time",
+                 travel_direction = "FROM_FACILITIES", engine = NETWORK_ANALYST,
+                 streets = None, workspace = None, cost_field = None,
+                 oneway_field = None):
+        self.network = network
+        self.travel_mode = travel_mode
+        self.travel_direction = travel_direction
+        self.engine = (engine or NETWORK_ANALYST).upper()
+        self.streets = streets
+        self.workspace = workspace
+        self.cost_field = cost_field
+        self.oneway_field = oneway_field
+        self._backend = None
+        # (facilities, ID field) -> PointSet on a feature layer of the session.
+        self._facilities = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = make_backend(self.engine, self.network, self.travel_mode,
+                                         self.travel_direction, self.streets,
+                                         self.cost_field, self.oneway_field)
+        return self._backend
+
+    # Set up the geoprocessing environment for a run.
+    def activate(self):
+        arcpy = get_arcpy()
+        arcpy.env.overwriteOutput = True
+        if self.workspace:
+            arcpy.env.workspace = self.workspace
+
+    # The points of a facility feature class or layer, on a feature layer
+    # kept by the session. While their IDs and locations stay the same, the
+    # same PointSet is returned, so a backend that has them loaded already
+    # does not load them again.
+    def facilities(self, fc, id_field = None):
+        arcpy = get_arcpy()
+        points = PointSet.from_feature_class(fc, id_field)
+        key = (str(fc), id_field)
+        cached = self._facilities.get(key)
+        if cached is not None and cached.digest() == points.digest():
+            arcpy.SelectLayerByAttribute_management(cached.source, "CLEAR_SELECTION")
+            return cached
+
+        if cached is not None:
+            layer = cached.source
+            arcpy.Delete_management(layer)
+        else:
+            layer = "SessionFacilities{0}".format(len(self._facilities))
+        arcpy.MakeFeatureLayer_management(fc, layer)
+        points.source = layer
+        self._facilities[key] = points
+        return points
+
+    # Release the backend and the facility layers.
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+        if self._facilities:
+            arcpy = get_arcpy()
+            for points in self._facilities.values():
+                arcpy.Delete_management(points.source)
+            self._facilities = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
@@ -0,0 +1,337 @@
+"""
+Scenario sweeps of the capacity tool. A grid of parameter values is
+expanded into scenarios, and the stages they need are planned as a DAG
+keyed by the parameters each stage depends on:
+
+    fishnet   cell_size
+    session   travel_mode, travel_direction
+    capacity  fac_cap_field
+    matrix    cell_size, travel_mode, travel_direction (fishnet, session)
+    assign    every scenario (matrix, capacity)
+
+so that a fishnet is made once per cell size and a cost matrix solved once
+per cell size and network setting, for the largest `num_to_find` of the
+scenarios sharing it. Scenarios with fewer take the first candidates of
+each cell. The assignments fan out to a pool of worker processes as soon as
+their matrix is solved, and the results are compared in one table.
+"""
+
+import csv
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+import numpy as np
+
+from ._arcpy import get_arcpy, add_message
+from .cache import MatrixCache, dataset_stamp
+from .capacity import (FACILITY_FIELD, assign, create_fishnet, dist_matrix,
+                       facility_columns, facility_keys)
+from .parallel import _backend_spec, _set_python_executable
+from .profiling import Profiler, profiler
+from .routing import PointSet, GraphBackend, make_backend, NETWORK_ANALYST
+from .session import Session
+from .table import read_values
+
+# Parameters a sweep can vary, with their defaults.
+PARAMETERS = OrderedDict([
+    ("cell_size", 0.003),
+    ("num_to_find", 5),
+    ("fac_cap_field", None),
+    ("travel_mode", "Driving Time"),
+    ("travel_direction", "FROM_FACILITIES"),
+    ("assignment", "GREEDY"),
+])
+
+# Worker state: scratch folder and backends by spec.
+_worker = {}
+
+
+class SweepPlan(object):
+    # Scenarios of `grid` (parameter -> list of values), with the other
+    # parameters from `base`, and the stages they need: an ordered mapping
+    # of stage keys to the keys of the stages they depend on, in an order
+    # where every stage follows its dependencies.
+    def __init__(self, grid, base = None):
+        unknown = set(grid) - set(PARAMETERS)
+        if unknown:
+            raise ValueError("Unknown sweep parameters: " + ", ".join(sorted(unknown)))
+        settings = OrderedDict(PARAMETERS)
+        settings.update(base or {})
+        names = list(grid)
+        self.scenarios = []
+        for values in itertools.product(*[list(grid[name]) for name in names]):
+            scenario = OrderedDict(settings)
+            scenario.update(zip(names, values))
+            if not scenario["fac_cap_field"]:
+                raise ValueError("A capacity field is needed for every scenario.")
+            self.scenarios.append(scenario)
+
+        self.stages = OrderedDict()
+        self.num_to_find = {}
+        for i, s in enumerate(self.scenarios):
+            fishnet = self._add(("fishnet", s["cell_size"]))
+            session = self._add(("session", s["travel_mode"], s["travel_direction"]))
+            capacity = self._add(("capacity", s["fac_cap_field"]))
+            matrix = self._add(("matrix", s["cell_size"], s["travel_mode"],
+                                s["travel_direction"]), fishnet, session)
+            self.num_to_find[matrix] = max(self.num_to_find.get(matrix, 0),
+                                           int(s["num_to_find"]))
+            self._add(("assign", i), matrix, capacity)
+
+    def _add(self, key, *deps):
+        if key not in self.stages:
+            self.stages[key] = list(deps)
+        return key
+
+    # Keys of the stages of `kind`.
+    def keys(self, kind):
+        return [key for key in self.stages if key[0] == kind]
+
+    # Stage key of `kind` that scenario `i` depends on.
+    def stage_of(self, i, kind):
+        deps = self.stages[("assign", i)]
+        if kind == "assign": return ("assign", i)
+        matrix, capacity = deps
+        if kind == "capacity": return capacity
+        if kind == "matrix": return matrix
+        return dict((d[0], d) for d in self.stages[matrix])[kind]
+
+    def __str__(self):
+        return "{0} scenarios: {1} fishnets, {2} matrices, {3} capacity fields".format(
+            len(self.scenarios), len(self.keys("fishnet")), len(self.keys("matrix")),
+            len(self.keys("capacity")))
+
+
+# Run the capacity tool for every scenario of `grid` (see `SweepPlan`) on the
+# same facilities, zones, streets and network, sharing the stages that
+# scenarios have in common, and write the comparison `table` (CSV): one row
+# per scenario and facility with its burden, assigned burden, number of
+# cells and their total cost. A summary per scenario is written next to it
+# (`<table>_summary.csv`) and returned. With `output_prefix`, the service
+# areas of scenario `i` are written to `<output_prefix>_<i>` in the
+# workspace. Assignments run on `workers` processes. `cost_field` and
+# `oneway_field` of the streets are used by the GRAPH engine, see `Session`.
+def capacity_sweep(facilities, zones, zones_burden_field, streets, network, table, grid,
+                   base = None, engine = NETWORK_ANALYST, workers = 1,
+                   output_prefix = None, cache_folder = None, cost_field = None,
+                   oneway_field = None):
+    arcpy = get_arcpy()
+    arcpy.env.overwriteOutput = True
+    workspace = arcpy.env.workspace
+    plan = SweepPlan(grid, base)
+    add_message(" ... sweeping " + str(plan))
+
+    scratch = tempfile.mkdtemp(prefix = "sweep_")
+    matrices = MatrixCache(os.path.join(scratch, "matrices"), max_bytes = float("inf"))
+    cache = MatrixCache(cache_folder or None)
+    zones_lyr = os.path.join(workspace, "sweep_zones_lyr")
+    arcpy.MakeFeatureLayer_management(zones, zones_lyr)
+    done, pending = {}, {}
+    pool = None
+    if workers > 1:
+        context = multiprocessing.get_context("spawn")
+        _set_python_executable(context)
+        pool = ProcessPoolExecutor(max_workers = workers, mp_context = context,
+                                   initializer = _init_worker, initargs = (scratch,))
+    try:
+        for key, deps in plan.stages.items():
+            kind = key[0]
+            if kind == "fishnet":
+                with profiler().stage("create_fishnet") as stage:
+                    points_fc = os.path.join(workspace, "sweep_points_{0}".format(
+                        plan.keys("fishnet").index(key)))
+                    fishnet = create_fishnet(zones_lyr, streets, points_fc, key[1],
+                                             zones_burden_field)
+                    stage.rows = len(fishnet)
+                done[key] = (fishnet, points_fc)
+            elif kind == "session":
+                session = Session(network, key[1], key[2], engine, streets,
+                                  cost_field = cost_field, oneway_field = oneway_field)
+                session.activate()
+                done[key] = (session, session.facilities(facilities, "FacID"))
+            elif kind == "capacity":
+                fac_points = done[plan.keys("session")[0]][1]
+                done[key] = read_values(fac_points.source, key[1], fac_points.ids)
+            elif kind == "matrix":
+                (fishnet, points_fc), (session, fac_points) = done[deps[0]], done[deps[1]]
+                k = plan.num_to_find[key]
+                with profiler().stage("dist_matrix") as stage:
+                    add_message(" ...... {0}, {1}, cell size {2}, {3} closest".format(
+                        key[2], key[3], key[1], k))
+                    matrix, cells = dist_matrix(fac_points, session.backend, points_fc, k,
+                        cache, (session.engine, dataset_stamp(session.network),
+                                dataset_stamp(session.streets), session.cost_field,
+                                session.oneway_field, session.travel_mode,
+                                session.travel_direction, key[1]))
+                    stage.rows = len(matrix.fac)
+                matrix_key = MatrixCache.key(*key)
+                matrices.store(matrix_key, matrix)
+                done[key] = (matrix_key, cells)
+                # Fan out the assignments of this matrix.
+                for i in [i for i in range(len(plan.scenarios))
+                          if plan.stage_of(i, "matrix") == key]:
+                    task = _task(plan, i, done, fishnet, session, fac_points, scratch)
+                    if pool is not None:
+                        pending[i] = pool.submit(_assign_scenario, task)
+                    else:
+                        pending[i] = _assign(task, matrices.load(matrix_key), cells,
+                                             fac_points, session.backend)
+            elif kind == "assign":
+                continue
+
+        # Collect the assignments in scenario order.
+        results = []
+        with profiler().stage("assign_points") as stage:
+            for i in range(len(plan.scenarios)):
+                result = pending[i].result() if pool is not None else pending[i]
+                for name, n in result.pop("counters", {}).items():
+                    profiler().count(name, n)
+                results.append(result)
+            stage.rows = len(results)
+    finally:
+        if pool is not None: pool.shutdown()
+        for key in plan.keys("session"):
+            if key in done: done[key][0].close()
+
+    summary = _write_tables(table, plan, results, done)
+    if output_prefix:
+        with profiler().stage("dissolve"):
+            for i, result in enumerate(results):
+                fishnet = done[plan.stage_of(i, "fishnet")][0]
+                fac_ids = done[plan.keys("session")[0]][1].ids
+                assigned = np.where(result["facility"] >= 0,
+                                    fac_ids[np.maximum(result["facility"], 0)], -1)
+                fishnet.dissolve("{0}_{1}".format(output_prefix, i), FACILITY_FIELD,
+                                 facility_keys(assigned),
+                                 facility_columns(fac_ids, result["burden"], result["load"]))
+
+    for key in plan.keys("fishnet"):
+        arcpy.Delete_management(done[key][1])
+    arcpy.Delete_management(zones_lyr)
+    shutil.rmtree(scratch, ignore_errors = True)
+    return summary
+
+
+# What a worker needs to assign scenario `i`: the matrix key and number of
+# candidates, burden of cells and capacity of facilities, the cells and
+# facilities (IDs, coordinates and, for Network Analyst, the datasets
+# they are loaded from) and the backend spec for expanding candidate lists.
+def _task(plan, i, done, fishnet, session, fac_points, scratch):
+    arcpy = get_arcpy()
+    scenario = plan.scenarios[i]
+    matrix_key, cells = done[plan.stage_of(i, "matrix")]
+    capacity = done[plan.stage_of(i, "capacity")]
+    burden = fishnet.value
+    na = not isinstance(session.backend, GraphBackend)
+    return {
+        "index": i, "matrix": matrix_key, "k": int(scenario["num_to_find"]),
+        "method": scenario["assignment"], "burden": burden,
+        "capacity": capacity * burden.sum() / capacity.sum(),
+        "cells": (cells.ids, cells.xy, arcpy.Describe(cells.source).catalogPath if na
+                  else None, cells.id_field),
+        "facilities": (fac_points.ids, fac_points.xy,
+                       arcpy.Describe(fac_points.source).catalogPath if na else None,
+                       fac_points.id_field),
+        "backend": _backend_spec(session.backend, scratch),
+    }
+
+
+# Set up a worker process with the sweep's scratch folder; backends are
+# made on first use.
+def _init_worker(scratch):
+    _worker["scratch"] = tempfile.mkdtemp(dir = scratch, prefix = "worker_")
+    _worker["backends"] = {}
+
+
+# Backend of a worker for `spec`, with a scratch geodatabase for Network
+# Analyst.
+def _worker_backend(spec):
+    backends = _worker["backends"]
+    if spec not in backends:
+        engine, network, mode, direction = spec
+        if engine == NETWORK_ANALYST:
+            arcpy = get_arcpy()
+            arcpy.env.overwriteOutput = True
+            gdb = os.path.join(_worker["scratch"], "scratch.gdb")
+            if not arcpy.Exists(gdb):
+                arcpy.CreateFileGDB_management(_worker["scratch"], "scratch.gdb")
+            arcpy.env.workspace = arcpy.env.scratchWorkspace = gdb
+        backends[spec] = make_backend(engine, network, mode, direction)
+        Finalize(backends[spec], backends[spec].close, exitpriority = 10)
+    return backends[spec]
+
+
+# Points of a task, on a feature layer of their dataset if they have one.
+def _points(ids, xy, source, id_field, name):
+    if source is None:
+        return PointSet(ids, xy)
+    layer = "Sweep" + name
+    get_arcpy().MakeFeatureLayer_management(source, layer)
+    return PointSet(ids, xy, layer, id_field)
+
+
+# Assign the cells of a scenario in a worker process.
+def _assign_scenario(task):
+    matrices = MatrixCache(os.path.join(os.path.dirname(_worker["scratch"]), "matrices"),
+                           max_bytes = float("inf"))
+    return _assign(task, matrices.load(task["matrix"]),
+                   _points(*(task["cells"] + ("Cells",))),
+                   _points(*(task["facilities"] + ("Facilities",))),
+                   _worker_backend(task["backend"]))
+
+
+# Assign the cells of a scenario over the first candidates of `matrix`.
+# Returns the facility index and cost of every cell, facility burden and
+# loads, and the counters of the run.
+def _assign(task, matrix, cells, facilities, backend):
+    with Profiler("sweep", memory = False) as trace:
+        matrix = matrix.first(task["k"])
+        result = assign(matrix, task["burden"], task["capacity"], cells, facilities,
+                        backend, task["method"])
+    cost = np.where(result.row >= 0, matrix.cost[np.maximum(result.row, 0)], 0.0)
+    return {"index": task["index"], "facility": result.facility, "cost": cost,
+            "burden": task["capacity"], "load": result.load,
+            "total_cost": result.cost, "max_overload": result.max_overload,
+            "counters": trace.counters}
+
+
+# Write the comparison table and the summary per scenario. Returns the
+# summary rows.
+def _write_tables(table, plan, results, done):
+    fac_ids = done[plan.keys("session")[0]][1].ids
+    names = list(PARAMETERS)
+    summary = []
+    with open(table, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scenario"] + names + ["facility_id", "burden",
+                        "assigned_burden", "cells", "cost"])
+        for i, (scenario, result) in enumerate(zip(plan.scenarios, results)):
+            facility = result["facility"]
+            has = facility >= 0
+            cells = np.bincount(facility[has], minlength = len(fac_ids))
+            cost = np.bincount(facility[has], weights = result["cost"][has],
+                               minlength = len(fac_ids))
+            params = [scenario[name] for name in names]
+            for f_id, b, a, n, c in zip(fac_ids.tolist(), result["burden"].tolist(),
+                                        result["load"].tolist(), cells.tolist(),
+                                        cost.tolist()):
+                writer.writerow([i] + params + [f_id, b, a, n, c])
+            summary.append(OrderedDict([("scenario", i)] + list(zip(names, params)) + [
+                ("total_cost", result["total_cost"]),
+                ("max_overload", result["max_overload"]),
+                ("unassigned_cells", int((~has).sum()))]))
+            add_message(" ...... scenario {0}: total cost {1:.2f}, max overload {2:.2f}"
+                        .format(i, result["total_cost"], result["max_overload"]))
+
+    with open(os.path.splitext(table)[0] + "_summary.csv", "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(summary[0]) if summary else ["scenario"])
+        for row in summary:
+            writer.writerow(list(row.values()))
+    return summary
@@ -0,0 +1,168 @@
+"""
+Column-wise attribute access. Whole fields are read into NumPy arrays and
+written back by object ID in one bulk operation, instead of row-by-row
+cursors. New point, line and polygon feature classes are written from
+arrays the same way.
+"""
+
+import itertools
+import json
+import os
+import numpy as np
+
+from ._arcpy import get_arcpy
+
+# ArcGIS field types of the NumPy types of `_field_dtype`.
+_FIELD_TYPES = {"i": "LONG", "f": "DOUBLE", "U": "TEXT"}
+
+
+# Read `fields` of a table, feature class or layer (honouring its
+# selection) as a dictionary of arrays. Geometry tokens such as SHAPE@X are
+# allowed. Nulls are replaced by `null_value` if given.
+def read_columns(table, fields, null_value = None):
+    arcpy = get_arcpy()
+    kwargs = {} if null_value is None else {"null_value": null_value}
+    if any(field.upper().startswith("SHAPE@") for field in fields):
+        array = arcpy.da.FeatureClassToNumPyArray(table, fields, **kwargs)
+    else:
+        array = arcpy.da.TableToNumPyArray(table, fields, **kwargs)
+    return dict((field, array[field]) for field in fields)
+
+
+# Values of a numeric field for the rows with object IDs `oids`, in that
+# order.
+def read_values(table, field, oids):
+    columns = read_columns(table, ["OID@", field])
+    return columns[field][_positions(columns["OID@"], oids)].astype(np.float64)
+
+
+# Sum of a numeric field.
+def sum_column(table, field):
+    return float(read_columns(table, [field])[field].sum())
+
+
+# Write `columns` (field name -> array) to the rows with object IDs `oids`
+# in one call. Missing fields are added; existing ones are updated.
+def write_columns(table, oids, columns):
+    arcpy = get_arcpy()
+    desc = arcpy.Describe(table)
+    dataset = getattr(desc, "catalogPath", None) or table
+
+    key = "_JOIN_OID"
+    names = list(columns)
+    arrays = [np.asarray(columns[name]) for name in names]
+    array = np.empty(len(oids), dtype = [(key, "<i4")] +
+                     [(name, _field_dtype(a)) for name, a in zip(names, arrays)])
+    array[key] = oids
+    for name, a in zip(names, arrays):
+        array[name] = a
+    arcpy.da.ExtendTable(dataset, desc.OIDFieldName, array, key, append_only = False)
+
+
+# Create a point feature class at `output` from (n, 2) coordinates and
+# attribute `columns` in one call.
+def write_points(output, xy, columns = None, spatial_reference = None):
+    arcpy = get_arcpy()
+    xy = np.asarray(xy, dtype = np.float64).reshape(-1, 2)
+    columns = columns or {}
+    names = list(columns)
+    arrays = [np.asarray(columns[name]) for name in names]
+    array = np.empty(len(xy), dtype = [("SHAPE_X", "<f8"), ("SHAPE_Y", "<f8")] +
+                     [(name, _field_dtype(a)) for name, a in zip(names, arrays)])
+    array["SHAPE_X"], array["SHAPE_Y"] = xy[:, 0], xy[:, 1]
+    for name, a in zip(names, arrays):
+        array[name] = a
+    arcpy.Delete_management(output)
+    arcpy.da.NumPyArrayToFeatureClass(array, output, ("SHAPE_X", "SHAPE_Y"),
+                                      spatial_reference)
+    return output
+
+
+# Write lines to a new feature class with attribute `columns` (field name
+# -> array). Lines are polyline geometries or lists of (x, y) vertices.
+# Returns the number of lines.
+def write_lines(output, lines, columns = None, spatial_reference = None):
+    arcpy = get_arcpy()
+    columns = columns or {}
+    fields = create_feature_class(output, "POLYLINE", columns, spatial_reference)
+    count = 0
+    with arcpy.da.InsertCursor(output, ["SHAPE@"] + fields) as insert_rows:
+        for line, values in zip(lines, _row_values(columns)):
+            if not isinstance(line, arcpy.Geometry):
+                line = arcpy.Polyline(arcpy.Array([arcpy.Point(*p) for p in line]),
+                                      spatial_reference)
+            insert_rows.insertRow([line] + list(values))
+            count += 1
+    return count
+
+
+# Write polygons, each a list of rings of (x, y) vertices (outer rings
+# clockwise, holes counterclockwise), to a new feature class with
+# attribute `columns` (field name -> array; NaN is written as null).
+# Returns the number of polygons.
+def write_polygons(output, polygons, columns = None, spatial_reference = None):
+    arcpy = get_arcpy()
+    columns = columns or {}
+    fields = create_feature_class(output, "POLYGON", columns, spatial_reference)
+    count = 0
+    with arcpy.da.InsertCursor(output, ["SHAPE@JSON"] + fields) as insert_rows:
+        for rings, values in zip(polygons, _row_values(columns)):
+            shape = {"rings": [np.asarray(ring).tolist() for ring in rings]}
+            insert_rows.insertRow([json.dumps(shape)] + list(values))
+            count += 1
+    return count
+
+
+# Create an empty feature class of `geometry_type` at `output`, replacing
+# any there, with a field for each of `columns` (field name -> array) by
+# the array's type. Returns the field names as created, since shapefiles
+# cut them short.
+def create_feature_class(output, geometry_type, columns, spatial_reference = None):
+    arcpy = get_arcpy()
+    arcpy.Delete_management(output)
+    path, name = split_output(output)
+    arcpy.CreateFeatureclass_management(path, name, geometry_type,
+                                        spatial_reference = spatial_reference)
+    for field, array in columns.items():
+        arcpy.AddField_management(output, field,
+                                  _FIELD_TYPES[_field_dtype(np.asarray(array))[1]])
+    fields = [f.name for f in arcpy.ListFields(output)]
+    return fields[len(fields) - len(columns):]
+
+
+# Split an output path into workspace and name.
+def split_output(output):
+    arcpy = get_arcpy()
+    path, name = os.path.split(output)
+    return (path or arcpy.env.workspace), name
+
+
+# Values of `columns` row by row, with NaN as None.
+def _row_values(columns):
+    arrays = [np.asarray(a).tolist() for a in columns.values()]
+    if not arrays:
+        return itertools.repeat(())
+    return (tuple(None if v != v else v for v in values) for values in zip(*arrays))
+
+
+# Positions of `oids` in `all_oids`.
+def _positions(all_oids, oids):
+    all_oids = np.asarray(all_oids, dtype = np.int64)
+    oids = np.asarray(oids, dtype = np.int64)
+    order = np.argsort(all_oids, kind = "stable")
+    pos = order[np.minimum(np.searchsorted(all_oids, oids, sorter = order),
+                           len(all_oids) - 1)]
+    if len(oids) and (all_oids[pos] != oids).any():
+        raise KeyError("Unknown object IDs.")
+    return pos
+
+
+# NumPy field type for an array: LONG for integers, DOUBLE for other
+# numbers, TEXT for strings.
+def _field_dtype(array):
+    if array.dtype.kind in "iub":
+        return "<i4"
+    if array.dtype.kind == "f":
+        return "<f8"
+    width = max([len(str(v)) for v in array.tolist()] + [1])
+    return "<U{0}".format(width)
@@ -0,0 +1,178 @@
+"""
+Tiled processing for region-scale runs of the capacity tool. The zone
+extent is cut into square tiles on the fishnet grid; the cells of each tile
+are made and solved on their own, against the facilities within a halo
+around the tile, and spilled to disk. The tiles are then stitched into one
+fishnet and a memory-mapped candidate matrix for the global assignment.
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from .candidates import CandidateMatrix
+from .fishnet import Fishnet
+
+
+class Tile(object):
+    # Block of `num_rows` by `num_cols` cells of the grid, starting at cell
+    # (`row0`, `col0`).
+    def __init__(self, index, row0, col0, num_rows, num_cols):
+        self.index = index
+        self.row0 = row0
+        self.col0 = col0
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+
+    # Extent (xmin, ymin, xmax, ymax) of the tile's cells on the grid whose
+    # first cell is centred at `origin`.
+    def bounds(self, origin, size):
+        xmin = origin[0] - size / 2 + self.col0 * size
+        ymin = origin[1] - size / 2 + self.row0 * size
+        return xmin, ymin, xmin + self.num_cols * size, ymin + self.num_rows * size
+
+    # Extent to make the tile's fishnet over: half a cell short of the far
+    # sides, so that it has exactly the tile's rows and columns whatever the
+    # rounding.
+    def grid_extent(self, origin, size):
+        xmin, ymin, xmax, ymax = self.bounds(origin, size)
+        return xmin, ymin, xmax - size / 2, ymax - size / 2
+
+
+# Tiles of about `tile_size` (in coordinate units, rounded to whole cells)
+# covering the fishnet grid of `extent` (xmin, ymin, xmax, ymax). Returns the
+# centre of the grid's first cell and the tiles.
+def make_tiles(extent, size, tile_size):
+    xmin, ymin, xmax, ymax = extent
+    size = float(size)
+    num_cols = max(int(math.ceil((xmax - xmin) / size)), 1)
+    num_rows = max(int(math.ceil((ymax - ymin) / size)), 1)
+    step = max(int(round(float(tile_size) / size)), 1)
+    tiles = []
+    for row0 in range(0, num_rows, step):
+        for col0 in range(0, num_cols, step):
+            tiles.append(Tile(len(tiles), row0, col0, min(step, num_rows - row0),
+                              min(step, num_cols - col0)))
+    return (xmin + size / 2, ymin + size / 2), tiles
+
+
+# Fishnet of every tile on the grid at `origin`, from zones and street
+# segments as `Fishnet.from_geometry` takes them. Only the zones and
+# segments near a tile are tested for its cells, and tiles without zones
+# are skipped. Yields (tile, fishnet) with rows and columns of the whole
+# grid; the fishnets' values are shares of the zones' burden within the
+# tile only, see `stitch`.
+def tile_fishnets(tiles, origin, zones, starts, ends, size, near_meters = 200,
+                  scale = (1.0, 1.0), spatial_reference = None):
+    boxes = np.array([_box(edges) for _, edges, _ in zones]).reshape(-1, 4)
+    starts = np.asarray(starts, dtype = np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype = np.float64).reshape(-1, 2)
+    low, high = np.minimum(starts, ends), np.maximum(starts, ends)
+    margin = near_meters / float(np.min(scale))
+    for tile in tiles:
+        xmin, ymin, xmax, ymax = tile.bounds(origin, size)
+        near_zones = np.nonzero((boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) &
+                                (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin))[0]
+        if not len(near_zones): continue
+        near_streets = ((low[:, 0] <= xmax + margin) & (high[:, 0] >= xmin - margin) &
+                        (low[:, 1] <= ymax + margin) & (high[:, 1] >= ymin - margin))
+        fishnet = Fishnet.from_geometry([zones[i] for i in near_zones.tolist()],
+                                        starts[near_streets], ends[near_streets],
+                                        tile.grid_extent(origin, size), size,
+                                        near_meters, scale, spatial_reference)
+        yield tile, Fishnet(origin, size, fishnet.row + tile.row0, fishnet.col + tile.col0,
+                            fishnet.zone, fishnet.value, spatial_reference)
+
+
+# The facilities (a PointSet) within `halo` of `bounds`. The halo is doubled
+# until at least `k` facilities are in it, or all of them.
+def halo_facilities(facilities, bounds, halo, k):
+    xmin, ymin, xmax, ymax = bounds
+    x, y = facilities.xy[:, 0], facilities.xy[:, 1]
+    halo = float(halo) or max(xmax - xmin, ymax - ymin)
+    while True:
+        inside = ((x >= xmin - halo) & (x <= xmax + halo) &
+                  (y >= ymin - halo) & (y <= ymax + halo))
+        if inside.sum() >= min(k, len(facilities)):
+            return facilities.select(facilities.ids[inside])
+        halo *= 2
+
+
+class TileSpill(object):
+    # Arrays of every tile saved as `.npy` files in `folder`, or in a new
+    # temporary folder that is removed on `close`.
+    def __init__(self, folder = None):
+        self.temporary = not folder
+        self.folder = tempfile.mkdtemp(prefix = "tiles_") if self.temporary else folder
+        if not os.path.isdir(self.folder): os.makedirs(self.folder)
+        self.tiles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _path(self, index, name):
+        return os.path.join(self.folder, "tile{0}_{1}.npy".format(index, name))
+
+    # Save `arrays` (name -> array) of `tile`.
+    def save(self, tile, arrays):
+        for name, array in arrays.items():
+            np.save(self._path(tile.index, name), np.asarray(array))
+        self.tiles.append(tile.index)
+
+    # Array `name` of every saved tile, in order, copied one tile at a time
+    # into a memory-mapped `.npy` file of the folder.
+    def concatenate(self, name, dtype):
+        parts = [np.load(self._path(index, name), mmap_mode = "r") for index in self.tiles]
+        total = sum(len(part) for part in parts)
+        out = np.lib.format.open_memmap(os.path.join(self.folder, name + ".npy"),
+                                        mode = "w+", dtype = dtype, shape = (total,))
+        position = 0
+        for part in parts:
+            out[position:position + len(part)] = part
+            position += len(part)
+        out.flush()
+        return out
+
+    def close(self):
+        if self.temporary:
+            shutil.rmtree(self.folder, ignore_errors = True)
+
+
+# Stitch the tiles saved in `spill` (cell `row`, `col`, `zone`, candidate
+# `counts`, and `fac` and `cost` rows with facilities indexed in `fac_ids`)
+# into one fishnet on the grid at `origin` and one candidate matrix, whose
+# cells are numbered from 1 in tile order until the caller gives them the
+# IDs of the features they are written to. Every zone's burden is shared
+# among its cells in all tiles. The matrix's rows stay on disk.
+def stitch(spill, origin, size, zones, fac_ids, spatial_reference = None, accept = None):
+    row = spill.concatenate("row", np.int64)
+    col = spill.concatenate("col", np.int64)
+    zone = spill.concatenate("zone", np.int64)
+
+    burden = dict((oid, value) for oid, _, value in zones)
+    zone_ids, inverse, counts = np.unique(zone, return_inverse = True, return_counts = True)
+    zone_burden = np.array([burden[z] for z in zone_ids.tolist()], dtype = np.float64)
+    value = (zone_burden / counts)[inverse] if len(zone) else np.zeros(0)
+    fishnet = Fishnet(origin, size, row, col, zone, value, spatial_reference,
+                      accept = accept)
+
+    offsets = np.zeros(len(zone) + 1, dtype = np.int64)
+    np.cumsum(spill.concatenate("counts", np.int64), out = offsets[1:])
+    matrix = CandidateMatrix(np.arange(1, len(zone) + 1), fac_ids, offsets,
+                             spill.concatenate("fac", np.int32),
+                             spill.concatenate("cost", np.float64))
+    return fishnet, matrix
+
+
+# Bounding box (xmin, ymin, xmax, ymax) of ring edges.
+def _box(edges):
+    if len(edges[0]) == 0:
+        return np.inf, np.inf, -np.inf, -np.inf
+    xs = np.concatenate([edges[0], edges[2]])
+    ys = np.concatenate([edges[1], edges[3]])
+    return xs.min(), ys.min(), xs.max(), ys.max()
@@ -0,0 +1,94 @@
+"""
+Multi-source network Voronoi diagram. One Dijkstra from all facilities at
+once labels every node with its nearest facility; edges whose end nodes have
+different owners are split at the point where both costs are equal.
+"""
+
+import numpy as np
+
+from .graph import INF
+
+
+class NetworkVoronoi(object):
+    # Partition of `graph` among `sources` (node indices). Labels are
+    # indices into `sources`, -1 for unreached parts of the network.
+    # `cut_lo`/`cut_hi` are, per edge, the lowest and highest fraction of a
+    # barrier on it (1 and 0 without barriers); travel stops there.
+    # `search` is the (dist, label) of a search done already, e.g. one
+    # updated with `Graph.improve`.
+    def __init__(self, graph, sources, reverse = False, max_cost = INF,
+                 cut_lo = None, cut_hi = None, search = None):
+        self.graph = graph
+        self.reverse = reverse
+        if cut_lo is None: cut_lo = np.ones(graph.num_edges)
+        if cut_hi is None: cut_hi = np.zeros(graph.num_edges)
+        if search is None:
+            blocked = set(np.nonzero(cut_lo <= cut_hi)[0].tolist())
+            search = graph.dijkstra(sources, reverse, max_cost, blocked)
+        self.dist, self.label = search
+
+        u, v, w = graph.edge_u, graph.edge_v, graph.edge_cost
+        self.owner_u, self.owner_v = self.label[u], self.label[v]
+
+        # Whether the search can run into the edge from either end.
+        from_u = ~graph.oneway | (not reverse)
+        from_v = ~graph.oneway | reverse
+        from_u &= self.owner_u >= 0
+        from_v &= self.owner_v >= 0
+
+        # How far along each edge the partition of either end node reaches:
+        # up to max_cost, the first barrier, or the equal-cost point with a
+        # neighbouring partition.
+        w_safe = np.where(w > 0, w, 1.0)
+        with np.errstate(invalid = "ignore"):
+            reach_u = np.clip((max_cost - self.dist[u]) / w_safe, 0, 1)
+            reach_v = np.clip((max_cost - self.dist[v]) / w_safe, 0, 1)
+            mid = np.clip((self.dist[v] + w - self.dist[u]) / (2 * w_safe), 0, 1)
+        mid = np.where(w > 0, mid, 0.5)
+        self.split = from_u & from_v & (self.owner_u != self.owner_v)
+        reach_u = np.where(self.split, np.minimum(reach_u, mid), reach_u)
+        reach_v = np.where(self.split, np.minimum(reach_v, 1 - mid), reach_v)
+        self.reach_u = np.where(from_u, np.minimum(reach_u, cut_lo), 0.0)
+        self.reach_v = np.where(from_v, np.minimum(reach_v, 1 - np.minimum(cut_hi, 1)), 0.0)
+
+    # Edges shared by two partitions.
+    def boundary_edges(self):
+        return np.nonzero((self.owner_u >= 0) & (self.owner_v >= 0) &
+                          (self.owner_u != self.owner_v))[0]
+
+    # Points where two partitions meet, as an (n, 2) array.
+    def boundary_points(self):
+        edges = self.boundary_edges()
+        t = np.where(self.reach_u[edges] > 0, self.reach_u[edges],
+                     1 - self.reach_v[edges])
+        return np.unique(self.graph.edge_point(edges, t), axis = 0)
+
+    # Reached pieces of the edges, as (edges, start fractions, end
+    # fractions, owners) arrays. Pieces of length zero are dropped.
+    def segments(self):
+        graph = self.graph
+        edges = np.arange(graph.num_edges)
+        side_u = self.reach_u > 0
+        side_v = self.reach_v > 0
+        return (np.concatenate([edges[side_u], edges[side_v]]),
+                np.concatenate([np.zeros(side_u.sum()), 1 - self.reach_v[side_v]]),
+                np.concatenate([self.reach_u[side_u], np.ones(side_v.sum())]),
+                np.concatenate([self.owner_u[side_u], self.owner_v[side_v]]))
+
+    # Pieces of the edges owned by each partition, as `segments` but with
+    # the two pieces of an edge reached from both ends by the same
+    # partition merged into one where they meet.
+    def edge_pieces(self):
+        edges = np.arange(self.graph.num_edges)
+        side_u = self.reach_u > 0
+        side_v = self.reach_v > 0
+        whole = (side_u & side_v & (self.owner_u == self.owner_v) &
+                 (self.reach_u + self.reach_v >= 1))
+        side_v &= ~whole
+        edges, start, end, owner = (
+            np.concatenate([edges[side_u], edges[side_v]]),
+            np.concatenate([np.zeros(side_u.sum()), 1 - self.reach_v[side_v]]),
+            np.concatenate([np.where(whole, 1.0, self.reach_u)[side_u], np.ones(side_v.sum())]),
+            np.concatenate([self.owner_u[side_u], self.owner_v[side_v]]))
+        order = np.lexsort((start, edges))
+        return edges[order], start[order], end[order], owner[order]
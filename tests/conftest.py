@@ -0,0 +1,35 @@
+"""
+Shared inputs of the tests: small synthetic street networks from the
+benchmarks, loaded as graphs. No ArcGIS is needed.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "scripts"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+from network_partitioning.graph import Graph
+
+import synthetic
+
+
+# A jittered street network of 12 x 12 intersections with random diagonals,
+# and a tenth of its streets one-way, so that searches in either direction
+# differ.
+@pytest.fixture
+def graph():
+    rng = np.random.default_rng(7)
+    lines = synthetic.random_network(12, rng)
+    oneway = rng.random(len(lines)) < 0.1
+    return Graph.from_polylines(lines, oneway = oneway)
+
+
+# Costs from each of `sources` (node indices) to every node, one plain
+# search per source, as a (sources, nodes) array.
+def source_costs(graph, sources, reverse = False):
+    return np.array([graph.dijkstra([s], reverse)[0] for s in sources])
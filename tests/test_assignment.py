@@ -0,0 +1,115 @@
+import numpy as np
+
+from network_partitioning.assignment import flow_assignment, greedy_assignment, local_search
+from network_partitioning.candidates import CandidateExpander
+
+from test_candidates import cells_and_facilities, closest, solver
+
+
+# With unit burdens and room for every cell, the flow assignment is solved
+# to optimality and no facility is overloaded, for any starting k: cells
+# whose lists run out get more candidates.
+def test_flow_respects_capacity_when_feasible(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 6)
+    burden = np.ones(len(cell_ids))
+    capacity = np.full(len(fac_ids), np.ceil(len(cell_ids) / len(fac_ids)) + 5)
+    capacity[0] = 5
+    assert (costs.argmin(axis = 0) == 0).sum() > capacity[0]
+    solve = solver(closest(cell_ids, fac_ids, costs, len(fac_ids)))
+    for k in (1, 2, len(fac_ids)):
+        matrix = closest(cell_ids, fac_ids, costs, k)
+        result = flow_assignment(matrix, burden, capacity, CandidateExpander(matrix, solve))
+        assert result.status == "optimal"
+        assert result.max_overload == 0
+        assert (result.load <= capacity).all()
+        assert (result.facility >= 0).all()
+        assert result.cost >= result.lower_bound - 1e-6
+        assert result.gap() < 1e-6
+
+
+# The unconstrained optimum: with room for every cell at every facility,
+# each cell goes to its nearest facility.
+def test_flow_without_binding_capacity_is_nearest(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 5)
+    matrix = closest(cell_ids, fac_ids, costs, 3)
+    burden = np.ones(len(cell_ids))
+    result = flow_assignment(matrix, burden, np.full(len(fac_ids), float(len(cell_ids))))
+    assert (result.facility == costs.argmin(axis = 0)).all()
+    np.testing.assert_allclose(result.cost, costs.min(axis = 0).sum())
+    np.testing.assert_allclose(result.cost, greedy_assignment(
+        matrix, burden, np.full(len(fac_ids), float(len(cell_ids)))).cost)
+
+
+# Capacity below the total burden leaves overload and no bound.
+def test_flow_reports_infeasible(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 4)
+    matrix = closest(cell_ids, fac_ids, costs, len(fac_ids))
+    result = flow_assignment(matrix, np.ones(len(cell_ids)), np.full(len(fac_ids), 10.0))
+    assert result.status == "infeasible"
+    assert result.max_overload > 0
+    assert result.gap() is None
+
+
+# Cells at random candidates with room for all of them at every facility:
+# local search moves each to its nearest, and never adds overload.
+def test_local_search_reaches_nearest_without_binding_capacity(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 5)
+    matrix = closest(cell_ids, fac_ids, costs, 3)
+    burden = np.ones(len(cell_ids))
+    capacity = np.full(len(fac_ids), float(len(cell_ids)))
+    start = greedy_assignment(matrix, burden, capacity, initial = np.random.default_rng(5)
+                              .integers(0, 3, len(cell_ids)))
+    result = local_search(matrix, burden, capacity, start)
+    np.testing.assert_allclose(result.cost, costs.min(axis = 0).sum())
+    assert result.cost < start.cost
+    assert result.max_overload == 0
+    trajectory_costs = [cost for _, cost, _, _ in result.trajectory]
+    assert trajectory_costs == sorted(trajectory_costs, reverse = True)
+
+
+# From the flow optimum under tight capacity, with the cut between
+# adjacent cells in the objective: every round lowers the objective and no
+# facility is overloaded.
+def test_local_search_improves_objective_within_capacity(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 6)
+    matrix = closest(cell_ids, fac_ids, costs, 4)
+    burden = np.random.default_rng(6).uniform(0.5, 1.5, len(cell_ids))
+    capacity = np.full(len(fac_ids), burden.sum() / len(fac_ids) * 1.05)
+    start = flow_assignment(matrix, burden, capacity)
+    assert start.max_overload == 0
+
+    cut_weight = 0.5
+    result = local_search(matrix, burden, capacity, start, (graph.edge_u, graph.edge_v),
+                          cut_weight = cut_weight)
+    cut_unit = cut_weight * start.cost / len(cell_ids)
+    objective = [cost + cut_unit * cut for _, cost, _, cut in result.trajectory]
+    assert all(b < a + 1e-9 for a, b in zip(objective, objective[1:]))
+    assert all(overload == 0 for _, _, overload, _ in result.trajectory)
+    assert result.max_overload == 0
+    assert result.status == start.status
+
+
+# Overload is never added, and moved off where a move allows.
+def test_local_search_reduces_overload(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 6)
+    matrix = closest(cell_ids, fac_ids, costs, len(fac_ids))
+    burden = np.ones(len(cell_ids))
+    capacity = np.full(len(fac_ids), np.ceil(len(cell_ids) / len(fac_ids)))
+    start = greedy_assignment(matrix, burden, np.full(len(fac_ids), float(len(cell_ids))))
+    assert (start.load > capacity).any()
+    result = local_search(matrix, burden, capacity, start)
+    overload = [o for _, _, o, _ in result.trajectory]
+    assert overload == sorted(overload, reverse = True)
+    assert overload[-1] < overload[0]
+
+
+# Without time, the assignment is returned as it was.
+def test_local_search_time_budget(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 5)
+    matrix = closest(cell_ids, fac_ids, costs, 3)
+    burden = np.ones(len(cell_ids))
+    capacity = np.full(len(fac_ids), 30.0)
+    start = greedy_assignment(matrix, burden, capacity)
+    result = local_search(matrix, burden, capacity, start, max_seconds = 0)
+    assert (result.row == start.row).all()
+    assert len(result.trajectory) == 1
@@ -0,0 +1,93 @@
+import numpy as np
+
+from network_partitioning.candidates import CandidateMatrix, CandidateExpander
+from network_partitioning.incremental import patch_matrix
+
+from conftest import source_costs
+
+
+# Cells at every node of the graph and facilities at `num` random nodes,
+# with IDs from 1, and the (facilities, cells) costs between them.
+def cells_and_facilities(graph, num, seed = 0):
+    sources = np.random.default_rng(seed).choice(graph.num_nodes, num, replace = False)
+    return np.arange(1, graph.num_nodes + 1), np.arange(1, num + 1), \
+           source_costs(graph, sources)
+
+
+# Matrix of the `k` closest of facilities `fac_ids` for every cell, from
+# their (facilities, cells) `costs`.
+def closest(cell_ids, fac_ids, costs, k):
+    order = np.argsort(costs, axis = 0)[:k]
+    cells = np.repeat(np.arange(len(cell_ids))[None, :], k, axis = 0)
+    return CandidateMatrix.from_triples(cell_ids, fac_ids, cell_ids[cells.ravel()],
+                                        fac_ids[order.ravel()], costs[order, cells].ravel())
+
+
+# `solve` of a `CandidateExpander`: the first k candidates of the cells
+# in `full`.
+def solver(full):
+    def solve(cells, k):
+        cell = full.row_cells()
+        rows = np.isin(cell, cells) & (np.arange(len(full.fac)) - full.offsets[cell] < k)
+        return cell[rows], full.fac[rows], full.cost[rows]
+    return solve
+
+
+def test_from_triples_groups_by_cell_in_order_of_cost():
+    matrix = CandidateMatrix.from_triples([10, 20, 30], [1, 2, 3],
+                                          [30, 10, 10, 30, 10], [1, 1, 2, 3, 3],
+                                          [5.0, 2.0, 1.0, 4.0, 3.0])
+    assert matrix.counts.tolist() == [3, 0, 2]
+    assert matrix.fac_ids[matrix.fac].tolist() == [2, 1, 3, 3, 1]
+    assert matrix.cost.tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert matrix.cell_index([30, 10]).tolist() == [2, 0]
+
+
+# New candidates go after a cell's existing ones, even when cheaper, and
+# facilities a cell lists already are skipped.
+def test_extend_keeps_positions():
+    matrix = CandidateMatrix.from_triples([1, 2], [1, 2, 3], [1, 2], [2, 1], [5.0, 7.0])
+    added = matrix.extend([0, 0, 1, 0], [0, 1, 2, 2], [1.0, 9.0, 8.0, 3.0])
+    assert added == 3
+    assert matrix.counts.tolist() == [3, 2]
+    assert matrix.fac.tolist() == [1, 0, 2, 0, 2]
+    assert matrix.cost.tolist() == [5.0, 1.0, 3.0, 7.0, 8.0]
+
+
+# The expander grows the lists of the cells given for twice their longest
+# list, and reports the cells that hold every facility.
+def test_expander_grows_lists(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 6)
+    matrix = closest(cell_ids, fac_ids, costs, 1)
+    expand = CandidateExpander(matrix, solver(closest(cell_ids, fac_ids, costs,
+                                                      len(fac_ids))))
+    cells = np.arange(0, len(cell_ids), 3)
+    assert expand(cells) == []
+    assert (matrix.counts[cells] == 2).all()
+    assert (matrix.counts[1::3] == 1).all()
+    expand(cells)
+    assert expand(cells) == cells.tolist()
+    assert (matrix.counts[cells] == len(fac_ids)).all()
+    assert expand.rounds == 3
+
+
+# After a facility is removed and two are added, every cell's list is still
+# a prefix of its closest facilities, in order of cost.
+def test_patch_matrix_keeps_prefixes(graph):
+    cell_ids, fac_ids, costs = cells_and_facilities(graph, 10)
+    k = 3
+    matrix = closest(cell_ids, fac_ids[:8], costs[:8], k)
+    current = fac_ids[1:]
+    added = np.nonzero(np.isfinite(costs[8:]))
+    patched, changed = patch_matrix(
+        matrix, current, [1], (added[1], fac_ids[8:][added[0]], costs[8:][added]), k)
+
+    best = np.sort(costs[1:], axis = 0)
+    for c in range(len(cell_ids)):
+        listed = patched.cost[patched.offsets[c]:patched.offsets[c + 1]]
+        np.testing.assert_allclose(listed, best[:len(listed), c])
+        row_ids = patched.fac_ids[patched.fac[patched.offsets[c]:patched.offsets[c + 1]]]
+        np.testing.assert_allclose(costs[row_ids - 1, c], listed)
+        before = matrix.fac_ids[matrix.fac[matrix.offsets[c]:matrix.offsets[c + 1]]]
+        if not changed[c]:
+            assert row_ids.tolist() == before.tolist()
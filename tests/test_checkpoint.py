@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+from network_partitioning.checkpoint import Checkpoint
+
+SETTINGS = {"network": ["streets.npz", 1.5], "cell_size": 0.003}
+
+
+# A run that saved the matrix, then the assignment, and was interrupted.
+def interrupted_run(folder):
+    checkpoint = Checkpoint(folder, "capacity", SETTINGS)
+    checkpoint.save("matrix", {"cost": np.arange(4.0)})
+    checkpoint.save("assignment", {"fac": np.array([0, 1, 1, 0])})
+    return checkpoint
+
+
+def test_resume_keeps_units_of_same_settings(tmp_path):
+    interrupted_run(str(tmp_path))
+    checkpoint = Checkpoint(str(tmp_path), "capacity", dict(SETTINGS), resume = True)
+    assert checkpoint.units == ["matrix", "assignment"]
+    np.testing.assert_array_equal(checkpoint.load("matrix")["cost"], np.arange(4.0))
+    unit, arrays = checkpoint.latest(["matrix", "assignment", "search"])
+    assert unit == "assignment"
+    np.testing.assert_array_equal(arrays["fac"], [0, 1, 1, 0])
+    assert checkpoint.latest(["search"]) == (None, None)
+
+    # A unit saved again is the latest.
+    checkpoint.save("matrix", {"cost": np.ones(4)})
+    resumed = Checkpoint(str(tmp_path), "capacity", SETTINGS, resume = True)
+    unit, arrays = resumed.latest(["matrix", "assignment"])
+    assert unit == "matrix"
+    np.testing.assert_array_equal(arrays["cost"], np.ones(4))
+
+
+def test_changed_settings_start_over(tmp_path):
+    interrupted_run(str(tmp_path))
+    changed = dict(SETTINGS, cell_size = 0.002)
+    checkpoint = Checkpoint(str(tmp_path), "capacity", changed, resume = True)
+    assert checkpoint.units == []
+    assert checkpoint.load("matrix") is None
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith("unit_")]
+
+    interrupted_run(str(tmp_path))
+    assert Checkpoint(str(tmp_path), "distance", SETTINGS, resume = True).units == []
+    interrupted_run(str(tmp_path))
+    assert Checkpoint(str(tmp_path), "capacity", SETTINGS).units == []
+
+
+# Units whose files are gone are not resumed, and a unit file left half
+# written does not replace the one saved before.
+def test_resume_skips_missing_and_partial_units(tmp_path):
+    interrupted_run(str(tmp_path))
+    os.remove(str(tmp_path / "unit_assignment.npz"))
+    with open(str(tmp_path / "unit_matrix.npz.tmp"), "wb") as f:
+        f.write(b"partial")
+    checkpoint = Checkpoint(str(tmp_path), "capacity", SETTINGS, resume = True)
+    assert checkpoint.units == ["matrix"]
+    np.testing.assert_array_equal(checkpoint.load("matrix")["cost"], np.arange(4.0))
+
+
+def test_progress_is_due_after_interval(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), "capacity", SETTINGS, interval = 60)
+    assert not checkpoint.due()
+    checkpoint._saved -= 61
+    assert checkpoint.due()
+    checkpoint.save("matrix", {"cost": np.zeros(1)})
+    assert not checkpoint.due()
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from network_partitioning.geometry import grid_outlines
+
+
+# Signed area of a closed ring, negative when clockwise.
+def signed_area(ring):
+    x, y = ring[:, 0].astype(np.float64), ring[:, 1].astype(np.float64)
+    return (x[:-1] * y[1:] - x[1:] * y[:-1]).sum() / 2
+
+
+# Whether each point is inside the rings, by the even-odd rule.
+def inside(rings, points):
+    result = np.zeros(len(points), dtype = bool)
+    for ring in rings:
+        a, b = ring[:-1].astype(np.float64), ring[1:].astype(np.float64)
+        for (x0, y0), (x1, y1) in zip(a, b):
+            crosses = (y0 > points[:, 1]) != (y1 > points[:, 1])
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                x = x0 + (points[:, 1] - y0) * (x1 - x0) / (y1 - y0)
+            result ^= crosses & (points[:, 0] < x)
+    return result
+
+
+# Cells of a 20 x 20 grid in squares of 1, 2 and 4, as a quadtree leaves
+# them, with a few labels and some cells left out.
+def quadtree_cells(rng):
+    x, y, width = [], [], []
+
+    def split(cx, cy, w):
+        if w > 1 and rng.random() < 0.6:
+            h = w // 2
+            for dx, dy in ((0, 0), (h, 0), (0, h), (h, h)):
+                split(cx + dx, cy + dy, h)
+        elif rng.random() < 0.9:
+            x.append(cx)
+            y.append(cy)
+            width.append(w)
+    for cx in range(0, 20, 4):
+        for cy in range(0, 20, 4):
+            split(cx, cy, 4)
+    return np.array(x), np.array(y), np.array(width)
+
+
+# Rings are closed and wound as documented, every label's outline covers
+# exactly its cells, so outlines of different labels never overlap.
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_grid_outlines_cover_their_cells(seed):
+    rng = np.random.default_rng(seed)
+    x, y, width = quadtree_cells(rng)
+    labels = rng.integers(0, 4, len(x))
+    names, outlines = grid_outlines(x, y, width, labels)
+    assert names.tolist() == np.unique(labels).tolist()
+
+    # Centres of the unit squares of the grid and the label of each.
+    unit = np.full((20, 20), -1)
+    for cx, cy, w, label in zip(x, y, width, labels):
+        unit[cx:cx + w, cy:cy + w] = label
+    gx, gy = np.meshgrid(np.arange(20), np.arange(20), indexing = "ij")
+    centres = np.column_stack([gx.ravel() + 0.5, gy.ravel() + 0.5])
+
+    for name, rings in zip(names.tolist(), outlines):
+        for ring in rings:
+            assert (ring[0] == ring[-1]).all()
+            assert len(ring) >= 5
+        area = -sum(signed_area(ring) for ring in rings)
+        assert area == (width[labels == name] ** 2).sum()
+        assert (inside(rings, centres) == (unit.ravel() == name)).all()
+
+
+# A ring around a hole: the outer ring is clockwise and the hole
+# counterclockwise.
+def test_grid_outlines_hole():
+    gx, gy = np.meshgrid(np.arange(3), np.arange(3), indexing = "ij")
+    keep = ~((gx == 1) & (gy == 1)).ravel()
+    names, outlines = grid_outlines(gx.ravel()[keep], gy.ravel()[keep],
+                                    np.ones(keep.sum()), np.zeros(keep.sum()))
+    areas = sorted(signed_area(ring) for ring in outlines[0])
+    assert areas == [-9.0, 1.0]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from network_partitioning.voronoi import NetworkVoronoi
+
+from conftest import source_costs
+
+
+# Every node is labelled with a source no farther than any other, at the
+# cost of that source.
+@pytest.mark.parametrize("reverse", [False, True])
+def test_voronoi_owners_match_brute_force(graph, reverse):
+    sources = np.random.default_rng(1).choice(graph.num_nodes, 9, replace = False)
+    costs = source_costs(graph, sources, reverse)
+    voronoi = NetworkVoronoi(graph, sources, reverse)
+
+    reached = voronoi.label >= 0
+    assert (reached == np.isfinite(costs.min(axis = 0))).all()
+    nodes = np.nonzero(reached)[0]
+    np.testing.assert_allclose(voronoi.dist[nodes], costs.min(axis = 0)[nodes])
+    np.testing.assert_allclose(costs[voronoi.label[nodes], nodes], voronoi.dist[nodes])
+
+
+# Nodes beyond `max_cost` of every source are not labelled.
+def test_voronoi_stops_at_max_cost(graph):
+    sources = [0, graph.num_nodes - 1]
+    max_cost = 300.0
+    voronoi = NetworkVoronoi(graph, sources, max_cost = max_cost)
+    within = source_costs(graph, sources).min(axis = 0) <= max_cost
+    assert ((voronoi.label >= 0) == within).all()
+
+
+# The k nearest sources of every node, in order of cost, with the costs of
+# one search per source.
+@pytest.mark.parametrize("reverse", [False, True])
+def test_k_nearest_matches_brute_force(graph, reverse):
+    sources = np.random.default_rng(2).choice(graph.num_nodes, 8, replace = False)
+    k = 3
+    costs = source_costs(graph, sources, reverse)
+    dist, label = graph.k_nearest(sources, k, reverse)
+
+    expected = np.sort(costs, axis = 0)[:k].T
+    np.testing.assert_allclose(dist, expected)
+    found = label >= 0
+    rows = np.nonzero(found)
+    np.testing.assert_allclose(costs[label[found], rows[0]], dist[found])
+    for row in label:
+        listed = row[row >= 0]
+        assert len(set(listed.tolist())) == len(listed)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from network_partitioning.graph import Graph
+from network_partitioning.hierarchy import ContractionHierarchy
+
+import synthetic
+from conftest import source_costs
+
+
+@pytest.fixture
+def hierarchy(graph):
+    return ContractionHierarchy.build(graph)
+
+
+# Costs from the nearest source equal those of plain Dijkstra, and every
+# label is a source at that cost.
+@pytest.mark.parametrize("reverse", [False, True])
+def test_one_to_all_equals_dijkstra(graph, hierarchy, reverse):
+    sources = np.random.default_rng(3).choice(graph.num_nodes, 5, replace = False)
+    dist, label = hierarchy.one_to_all(sources, reverse)
+    expected, _ = graph.dijkstra(sources, reverse)
+    np.testing.assert_allclose(dist, expected)
+    costs = source_costs(graph, sources, reverse)
+    np.testing.assert_allclose(costs[label, np.arange(graph.num_nodes)], dist)
+
+
+def test_one_to_all_stops_at_max_cost(graph, hierarchy):
+    dist, label = hierarchy.one_to_all([0], max_cost = 400.0)
+    expected, expected_label = graph.dijkstra([0], max_cost = 400.0)
+    np.testing.assert_allclose(dist, expected)
+    assert (label == expected_label).all()
+
+
+# The k nearest sources of some target nodes equal those of the plain
+# batched search.
+@pytest.mark.parametrize("reverse", [False, True])
+def test_k_nearest_equals_graph(graph, hierarchy, reverse):
+    rng = np.random.default_rng(4)
+    sources = rng.choice(graph.num_nodes, 8, replace = False)
+    targets = rng.choice(graph.num_nodes, 40, replace = False)
+    dist, label = hierarchy.k_nearest(sources, targets, 3, reverse)
+    expected, _ = graph.k_nearest(sources, 3, reverse)
+    np.testing.assert_allclose(dist, expected[targets])
+    costs = source_costs(graph, sources, reverse)
+    np.testing.assert_allclose(costs[label, targets[:, None]], dist)
+
+
+# A hierarchy saved with its graph loads the same.
+def test_save_and_load(graph, hierarchy, tmp_path):
+    path = str(tmp_path / "index.npz")
+    hierarchy.save(path, graph)
+    loaded = ContractionHierarchy.load(path)
+    sources = [3, 50, 100]
+    np.testing.assert_allclose(loaded.one_to_all(sources)[0], hierarchy.one_to_all(sources)[0])
+
+
+# On a regular grid, where many paths tie, costs still equal Dijkstra's.
+def test_one_to_all_with_ties():
+    graph = Graph.from_polylines(synthetic.grid_network(10, None))
+    hierarchy = ContractionHierarchy.build(graph)
+    sources = [0, 37, 99]
+    np.testing.assert_allclose(hierarchy.one_to_all(sources)[0], graph.dijkstra(sources)[0])
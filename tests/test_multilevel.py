@@ -0,0 +1,98 @@
+import numpy as np
+
+from network_partitioning.candidates import CandidateMatrix
+from network_partitioning.fishnet import Fishnet
+from network_partitioning.multilevel import _match, _symmetric, coarsen, project
+
+
+# A 16 x 16 fishnet with a few cells left out, of two zones (left and right
+# halves) and random burden.
+def grid_fishnet(rng):
+    row, col = np.divmod(np.arange(256), 16)
+    keep = rng.random(256) < 0.9
+    row, col = row[keep], col[keep]
+    return Fishnet((0.5, 0.5), 1.0, row, col, np.where(col < 8, 1, 2),
+                   rng.uniform(0.5, 2.0, len(row)))
+
+
+# Matched super-cells are adjacent pairs within the burden limit, agreed
+# from both sides.
+def test_match_pairs_adjacent_cells_within_limit():
+    rng = np.random.default_rng(0)
+    fishnet = grid_fishnet(rng)
+    edges = _symmetric(*fishnet.neighbours())
+    burden = fishnet.value
+    mate = _match(len(fishnet), edges, burden, fishnet.zone, 3.0, 3)
+    paired = np.nonzero(mate >= 0)[0]
+    assert len(paired) > len(fishnet) / 2
+    assert (mate[mate[paired]] == paired).all()
+    adjacent = set(zip(*[e.tolist() for e in edges]))
+    assert all((i, mate[i]) in adjacent for i in paired.tolist())
+    assert (burden[paired] + burden[mate[paired]] <= 3.0).all()
+
+    # A cell over the limit on its own is never paired.
+    burden = burden.copy()
+    burden[10] = 5.0
+    assert _match(len(fishnet), edges, burden, fishnet.zone, 3.0, 3)[10] == -1
+
+
+def test_coarsen_keeps_burden_and_links_levels():
+    rng = np.random.default_rng(1)
+    fishnet = grid_fishnet(rng)
+    hierarchy = coarsen(fishnet, 4, max_burden = 12.0)
+    sizes = hierarchy.sizes()
+    assert hierarchy.num_levels == 5
+    assert all(b < 0.9 * a for a, b in zip(sizes, sizes[1:]))
+
+    for level in range(hierarchy.num_levels):
+        owner, burden = hierarchy.owner[level], hierarchy.burden[level]
+        np.testing.assert_allclose(burden, np.bincount(owner, fishnet.value,
+                                                       minlength = sizes[level]))
+        assert (burden <= 12.0).all()
+        # Every super-cell's representative is one of its own cells.
+        np.testing.assert_array_equal(owner[hierarchy.rep[level]], np.arange(sizes[level]))
+        if level:
+            np.testing.assert_array_equal(
+                hierarchy.parent[level - 1][hierarchy.owner[level - 1]], owner)
+        # Adjacent super-cells hold adjacent fishnet cells.
+        i, j = hierarchy.edges[level]
+        assert (i != j).all()
+        cell_i, cell_j = fishnet.neighbours()
+        pairs = set(zip(owner[cell_i].tolist(), owner[cell_j].tolist()))
+        assert set(zip(i.tolist(), j.tolist())) <= pairs
+
+    # Cells are paired within their zone first.
+    first = hierarchy.owner[1]
+    zones = np.bincount(first, fishnet.zone == 1, minlength = sizes[1])
+    counts = np.bincount(first, minlength = sizes[1])
+    mixed = (zones > 0) & (zones < counts)
+    assert mixed.sum() < 0.1 * sizes[1]
+
+
+def test_coarsen_stops_at_min_cells():
+    fishnet = grid_fishnet(np.random.default_rng(2))
+    hierarchy = coarsen(fishnet, 20, max_burden = np.inf, min_cells = 30)
+    assert hierarchy.sizes()[-2] > 30
+    assert hierarchy.sizes()[-1] <= 30
+
+
+# Cells copy the candidate lists of their super-cells, in place of the rows
+# of the solved cells.
+def test_project_copies_parent_lists():
+    fac_ids = np.array([10, 20, 30])
+    coarse = CandidateMatrix.from_triples(np.array([1, 2, 3]), fac_ids,
+        [1, 1, 2, 3, 3, 3], [10, 20, 30, 30, 10, 20], [1.0, 2.0, 0.5, 3.0, 1.0, 2.0])
+    parent = np.array([0, 0, 1, 2, 2, 1])
+    cell_ids = np.arange(101, 107)
+    solved = np.array([False, True, False, False, False, True])
+    rows = (np.array([1, 1, 5]), np.array([30, 10, 20]), np.array([0.2, 0.1, 4.0]))
+    fine = project(coarse, parent, cell_ids, solved, rows)
+
+    np.testing.assert_array_equal(fine.cell_ids, cell_ids)
+    expected = {0: ([10, 20], [1.0, 2.0]), 1: ([10, 30], [0.1, 0.2]),
+                2: ([30], [0.5]), 3: ([10, 20, 30], [1.0, 2.0, 3.0]),
+                4: ([10, 20, 30], [1.0, 2.0, 3.0]), 5: ([20], [4.0])}
+    for c, (facs, costs) in expected.items():
+        rows = slice(fine.offsets[c], fine.offsets[c + 1])
+        np.testing.assert_array_equal(fine.fac_ids[fine.fac[rows]], facs)
+        np.testing.assert_allclose(fine.cost[rows], costs)
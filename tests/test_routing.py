@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from network_partitioning.distance import create_boundary_points
+from network_partitioning.routing import GraphBackend, PointSet
+
+
+# Length of the network in each facility's partition.
+def partition_lengths(graph, voronoi, num):
+    edges, start, end, owner = voronoi.edge_pieces()
+    return np.bincount(owner, (end - start) * graph.edge_cost[edges], minlength = num)
+
+
+# The boundary points of the ITERATIVE loop, used as barriers, give the
+# partitions of the single-pass network Voronoi diagram.
+@pytest.mark.parametrize("direction", ["FROM_FACILITIES", "TO_FACILITIES"])
+def test_iterative_partitions_equal_voronoi(graph, direction):
+    backend = GraphBackend(graph, direction)
+    nodes = np.random.default_rng(8).choice(graph.num_nodes, 10, replace = False)
+    facilities = PointSet(np.arange(1, 11), graph.node_xy[nodes])
+    ids = facilities.ids.tolist()
+    barriers = []
+    for i, current_id in enumerate(ids[:-1]):
+        barriers.extend(create_boundary_points(current_id, ids[i + 1:], facilities, backend,
+                                               ids[:i]))
+
+    iterative = backend.voronoi(facilities, barriers = barriers)
+    voronoi = backend.voronoi(facilities)
+    assert (iterative.label == voronoi.label).all()
+    np.testing.assert_allclose(partition_lengths(graph, iterative, len(ids)),
+                               partition_lengths(graph, voronoi, len(ids)))
@@ -0,0 +1,49 @@
+import pytest
+
+from network_partitioning.sweep import SweepPlan
+
+
+def test_plan_shares_stages_by_prefix():
+    plan = SweepPlan({"cell_size": [0.002, 0.003], "num_to_find": [3, 5],
+                      "travel_mode": ["Driving Time", "Walking Time"]},
+                     {"fac_cap_field": "Capacity"})
+    assert len(plan.scenarios) == 8
+    assert plan.keys("fishnet") == [("fishnet", 0.002), ("fishnet", 0.003)]
+    assert len(plan.keys("session")) == 2
+    assert plan.keys("capacity") == [("capacity", "Capacity")]
+    assert len(plan.keys("matrix")) == 4
+    assert len(plan.keys("assign")) == 8
+
+    # Every stage follows the stages it depends on.
+    seen = set()
+    for key, deps in plan.stages.items():
+        assert all(dep in seen for dep in deps)
+        seen.add(key)
+
+    # Scenarios differing only in num_to_find share a matrix solved for the
+    # largest of them.
+    for matrix in plan.keys("matrix"):
+        users = [i for i in range(8) if plan.stage_of(i, "matrix") == matrix]
+        assert sorted(plan.scenarios[i]["num_to_find"] for i in users) == [3, 5]
+        assert plan.num_to_find[matrix] == 5
+    for i, s in enumerate(plan.scenarios):
+        assert plan.stage_of(i, "fishnet") == ("fishnet", s["cell_size"])
+        assert plan.stage_of(i, "session") == ("session", s["travel_mode"],
+                                               "FROM_FACILITIES")
+
+
+# Scenarios varying only in what the assignment uses share one matrix.
+def test_plan_solves_one_matrix_for_assignment_variants():
+    plan = SweepPlan({"assignment": ["GREEDY", "FLOW"],
+                      "fac_cap_field": ["Capacity", "Capacity2"]})
+    assert len(plan.scenarios) == 4
+    assert len(plan.keys("fishnet")) == len(plan.keys("matrix")) == 1
+    assert len(plan.keys("capacity")) == 2
+    assert str(plan) == "4 scenarios: 1 fishnets, 1 matrices, 2 capacity fields"
+
+
+def test_plan_rejects_bad_grids():
+    with pytest.raises(ValueError):
+        SweepPlan({"cell_sizes": [0.002]}, {"fac_cap_field": "Capacity"})
+    with pytest.raises(ValueError):
+        SweepPlan({"cell_size": [0.002]})
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+from network_partitioning.fishnet import Fishnet
+from network_partitioning.tiles import TileSpill, make_tiles, stitch, tile_fishnets
+
+import synthetic
+
+
+# Zones of uneven burden over the graph's extent, and its street segments.
+def zones_and_streets(graph):
+    extent = tuple(graph.node_xy.min(axis = 0)) + tuple(graph.node_xy.max(axis = 0))
+    zones = synthetic.zones(extent, 3, np.random.default_rng(1), "lognormal")
+    return extent, zones, graph.node_xy[graph.edge_u], graph.node_xy[graph.edge_v]
+
+
+def test_tiles_cover_grid_once():
+    extent, size = (0.0, 0.0, 1030.0, 770.0), 50.0
+    origin, tiles = make_tiles(extent, size, 200.0)
+    assert origin == (25.0, 25.0)
+    cover = np.zeros((16, 21), dtype = np.int64)
+    for tile in tiles:
+        assert tile.num_rows <= 4 and tile.num_cols <= 4
+        cover[tile.row0:tile.row0 + tile.num_rows, tile.col0:tile.col0 + tile.num_cols] += 1
+    assert (cover == 1).all()
+
+
+# Fishnets made tile by tile and stitched hold the cells, zones and burden
+# shares of the fishnet made in one go, and the matrix keeps every cell's
+# candidates with it.
+def test_stitched_tiles_equal_untiled_fishnet(graph):
+    extent, zones, starts, ends = zones_and_streets(graph)
+    size = 45.0
+    whole = Fishnet.from_geometry(zones, starts, ends, extent, size, near_meters = 60)
+    origin, tiles = make_tiles(extent, size, 7 * size)
+    assert len(tiles) > 4
+
+    with TileSpill() as spill:
+        for tile, fishnet in tile_fishnets(tiles, origin, zones, starts, ends, size,
+                                           near_meters = 60):
+            counts = (fishnet.row + fishnet.col) % 3 + 1
+            key = np.repeat(fishnet.row * 1000 + fishnet.col, counts)
+            spill.save(tile, {"row": fishnet.row, "col": fishnet.col, "zone": fishnet.zone,
+                              "counts": counts, "fac": key % 7, "cost": key})
+        stitched, matrix = stitch(spill, origin, size, zones, np.arange(1, 8))
+        folder = spill.folder
+
+        assert stitched.origin == whole.origin
+        order = np.lexsort((stitched.col, stitched.row))
+        whole_order = np.lexsort((whole.col, whole.row))
+        np.testing.assert_array_equal(stitched.row[order], whole.row[whole_order])
+        np.testing.assert_array_equal(stitched.col[order], whole.col[whole_order])
+        np.testing.assert_array_equal(stitched.zone[order], whole.zone[whole_order])
+        np.testing.assert_allclose(stitched.value[order], whole.value[whole_order])
+
+        assert len(matrix.cell_ids) == len(stitched)
+        for c in range(len(stitched)):
+            rows = slice(matrix.offsets[c], matrix.offsets[c + 1])
+            key = stitched.row[c] * 1000 + stitched.col[c]
+            assert (matrix.cost[rows] == key).all()
+            assert (matrix.fac[rows] == key % 7).all()
+            assert len(matrix.cost[rows]) == (stitched.row[c] + stitched.col[c]) % 3 + 1
+    assert not os.path.exists(folder)
+
+
+# Arrays are joined in the order the tiles were saved, into a memory-mapped
+# file of the folder, which is kept when it was given.
+def test_spill_concatenates_in_save_order(tmp_path):
+    _, tiles = make_tiles((0.0, 0.0, 30.0, 10.0), 10.0, 10.0)
+    with TileSpill(str(tmp_path)) as spill:
+        spill.save(tiles[2], {"cost": [5.0, 6.0]})
+        spill.save(tiles[0], {"cost": [1.0]})
+        spill.save(tiles[1], {"cost": np.zeros(0)})
+        joined = spill.concatenate("cost", np.float64)
+        assert isinstance(joined, np.memmap)
+        np.testing.assert_array_equal(joined, [5.0, 6.0, 1.0])
+    np.testing.assert_array_equal(np.load(str(tmp_path / "cost.npy")), [5.0, 6.0, 1.0])